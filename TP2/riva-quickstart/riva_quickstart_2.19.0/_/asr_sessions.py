@@ -0,0 +1,240 @@
+"""
+Multi-session ASR: one Riva streaming session per WebSocket client
+Each client streams its own PCM audio over the WebSocket and gets its own
+transcript. A SessionScheduler caps the number of concurrent gRPC streams,
+queues (then rejects) new sessions past capacity, and tears down streams
+that stopped receiving audio.
+"""
+
+# Import asyncio for the scheduler (semaphore, idle reaper task)
+import asyncio
+
+# Import itertools to number sessions
+import itertools
+
+# Import threading to run each Riva stream in its own thread
+import threading
+
+# Import time for idle detection
+import time
+
+# Import the preallocated audio ring buffer read by the Riva thread
+from audio_ring_buffer import AudioRingBuffer
+
+# Session numbers shown in logs and sent to clients
+_session_ids = itertools.count(1)
+
+
+class SessionRejected(Exception):
+    """Raised when the server has no free transcription slot for a new stream."""
+
+
+class AudioStream:
+    """
+    One Riva streaming recognition: an audio ring buffer, a stop event and
+    the thread running the transcription worker.
+    """
+
+    def __init__(self, session, frame_bytes, max_frames):
+        self.session = session
+        self.audio_buffer = AudioRingBuffer(frame_bytes, max_frames)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last_audio = time.monotonic()
+
+    def put(self, chunk, is_audio=True):
+        """
+        Copy an audio chunk into the ring buffer without blocking the event loop.
+        Keep-alive frames (is_audio=False) do not count as activity for the idle reaper.
+        """
+        if is_audio:
+            self.last_audio = time.monotonic()
+        self.audio_buffer.write(chunk)
+
+    def stop(self, reason=""):
+        """Ask the worker to finish: Riva flushes the last final results, then the thread exits."""
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        self.audio_buffer.close()  # Wake the audio generator so it stops
+        if reason:
+            print(f"⏹️  Session {self.session.id}: stream stopped ({reason})")
+
+
+class SessionScheduler:
+    """
+    Cap the number of concurrent Riva streams.
+
+    Parameters:
+    - max_sessions: Maximum concurrent gRPC streams
+    - max_waiting: Maximum streams waiting for a free slot (beyond that: rejected)
+    - queue_timeout: Seconds a stream may wait for a slot before being rejected
+    - idle_timeout: Seconds without audio before a stream is torn down
+    """
+
+    def __init__(self, max_sessions=8, max_waiting=16, queue_timeout=10.0, idle_timeout=30.0):
+        self.max_sessions = max_sessions
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self.idle_timeout = idle_timeout
+
+        self._slots = asyncio.Semaphore(max_sessions)
+        self.active = set()  # AudioStream objects holding a slot
+        self.waiting = 0
+
+        # Counters
+        self.started = 0
+        self.rejected = 0
+        self.idle_closed = 0
+
+    async def acquire(self, stream):
+        """Wait for a free slot for this stream, or raise SessionRejected."""
+        if self._slots.locked():
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise SessionRejected("Serveur complet : trop de sessions de transcription")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise SessionRejected("Aucune session de transcription libérée à temps")
+            finally:
+                self.waiting -= 1
+        else:
+            await self._slots.acquire()
+        self.active.add(stream)
+        self.started += 1
+
+    def release(self, stream):
+        """Give the slot of a finished stream back."""
+        if stream in self.active:
+            self.active.discard(stream)
+            self._slots.release()
+
+    async def reap_idle_streams(self, interval=1.0):
+        """Background task: stop streams that received no audio for idle_timeout seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for stream in list(self.active):
+                if not stream.stop_event.is_set() and now - stream.last_audio > self.idle_timeout:
+                    self.idle_closed += 1
+                    stream.stop(f"no audio for {self.idle_timeout:.0f}s")
+
+    def stats(self):
+        return {
+            "active": len(self.active),
+            "waiting": self.waiting,
+            "capacity": self.max_sessions,
+            "started": self.started,
+            "rejected": self.rejected,
+            "idle_closed": self.idle_closed,
+        }
+
+
+class ASRSession:
+    """
+    Transcription session of one WebSocket client.
+
+    A Riva stream is opened on the first audio frame, closed on request or
+    when idle, and reopened transparently if the client sends audio again.
+
+    Parameters:
+    - channel: The client's ClientChannel (bounded outbound queue)
+    - scheduler: The shared SessionScheduler
+    - worker: Called in a thread as worker(audio_buffer, stop_event, loop, publish=..., label=...)
+    - loop: The asyncio event loop
+    - frame_bytes: Size of one buffered audio frame in bytes
+    - max_frames: Maximum audio frames buffered for Riva
+    - gate_factory: Creates the session's VoiceActivityGate (None = no VAD)
+
+    With VAD, a Riva stream is only opened when speech is detected, so a
+    client sending silence does not hold a stream.
+    """
+
+    def __init__(self, channel, scheduler, worker, loop, frame_bytes=3200, max_frames=100,
+                 gate_factory=None):
+        self.id = next(_session_ids)
+        self.channel = channel
+        self.scheduler = scheduler
+        self.worker = worker
+        self.loop = loop
+        self.frame_bytes = frame_bytes
+        self.max_frames = max_frames
+        self.voice_gate = gate_factory() if gate_factory is not None else None
+        self.stream = None  # Current AudioStream, if any
+
+    @property
+    def streaming(self):
+        return self.stream is not None and not self.stream.stop_event.is_set()
+
+    async def publish(self, message_type, text, is_final=False):
+        """Send a message to this session's client only (same signature as broadcast_transcription)."""
+        payload = self.channel.encode({
+            "type": message_type,
+            "text": text,
+            "is_final": is_final,
+            "session": self.id,
+            "timestamp": self.loop.time()
+        })
+        # With the "block" policy a full queue refuses the message: wait for room
+        if not self.channel.offer(payload, is_final):
+            await self.channel.put(payload, is_final)
+
+    async def start_stream(self):
+        """Open a new Riva stream once the scheduler grants a slot."""
+        stream = AudioStream(self, self.frame_bytes, self.max_frames)
+        await self.scheduler.acquire(stream)
+        stream.thread = threading.Thread(target=self._run, args=(stream,), daemon=True)
+        self.stream = stream
+        stream.thread.start()
+
+    def _run(self, stream):
+        try:
+            self.worker(
+                stream.audio_buffer,
+                stream.stop_event,
+                self.loop,
+                publish=self.publish,
+                label=f"session {self.id}"
+            )
+        finally:
+            # The slot is released on the event loop, where the scheduler lives
+            self.loop.call_soon_threadsafe(self._on_stream_end, stream)
+
+    def _on_stream_end(self, stream):
+        self.scheduler.release(stream)
+        stream.stop_event.set()
+        if self.stream is stream:
+            self.stream = None
+
+    async def feed(self, chunk):
+        """Queue a PCM frame from the client, opening a Riva stream if needed."""
+        if self.voice_gate is None:
+            if not self.streaming:
+                await self.start_stream()
+            self.stream.put(chunk)
+            return
+
+        pieces = self.voice_gate.process(chunk)
+        is_speech = self.voice_gate.active
+        if not self.streaming:
+            if not is_speech:
+                return  # Silence (or keep-alive) with no open stream: nothing to send
+            await self.start_stream()
+        for piece in pieces:
+            self.stream.put(piece, is_speech)
+
+    def stop_stream(self, reason=""):
+        """Close the current Riva stream (the last final result is still delivered)."""
+        if self.stream is not None:
+            self.stream.stop(reason)
+
+    def close(self):
+        """Client disconnected: stop the stream without waiting for it."""
+        self.stop_stream()
+        if self.voice_gate is not None:
+            stats = self.voice_gate.stats()
+            print(f"🔇 Session {self.id}: {stats['suppressed_ratio']:.0%} of "
+                  f"{stats['audio_seconds']}s not sent to Riva")
@@ -0,0 +1,172 @@
+"""
+Preallocated ring buffer for audio frames
+The capture thread copies each chunk into a fixed-size slot of one
+preallocated bytearray; the Riva thread gets `memoryview` slices of those
+slots. The buffer allocates no bytes object per chunk, memory is bounded, and the
+consumer is woken by a condition variable instead of polling with a timeout.
+"""
+
+# Import threading for the condition variable shared by producer and consumer
+import threading
+
+# Import time to stamp each frame with its (monotonic) capture time
+import time
+
+# Import deque for the order of the slots waiting to be read
+from collections import deque
+
+# What to do when the buffer is full (Riva is not keeping up)
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # Overwrite the oldest frame: lowest latency
+OVERFLOW_DROP_NEWEST = "drop_newest"  # Discard the incoming frame: no gap in what was queued
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+
+class AudioRingBuffer:
+    """
+    Bounded single-producer / single-consumer queue of audio frames.
+
+    Parameters:
+    - frame_bytes: Size of one slot in bytes (e.g. CHUNK_SIZE * 2 for 16-bit mono)
+    - capacity: Number of slots (capacity * frame duration = max buffered audio)
+    - overflow: One of OVERFLOW_POLICIES
+
+    The memoryview returned by read() stays valid until the next read()
+    (or release()): that slot is never overwritten while the consumer uses it.
+    Slots are tracked by index (free list + queue of waiting slots), so
+    dropping the oldest frame frees its own slot, never the leased one.
+    """
+
+    def __init__(self, frame_bytes, capacity=50, overflow=OVERFLOW_DROP_OLDEST):
+        if capacity < 2:
+            raise ValueError("capacity must be at least 2 frames")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+
+        self.frame_bytes = frame_bytes
+        self.capacity = capacity
+        self.overflow = overflow
+
+        # One contiguous allocation for all the slots
+        self._buffer = bytearray(frame_bytes * capacity)
+        self._view = memoryview(self._buffer)
+        self._lengths = [0] * capacity  # Bytes used in each slot
+        self._stamps = [0.0] * capacity  # Monotonic time each slot was written
+        self.last_stamp = 0.0  # Capture time of the frame returned by the last read()
+
+        self._free = list(range(capacity))  # Slots available to the producer
+        self._waiting = deque()  # Slots waiting to be read, oldest first
+        self._leased = None  # Slot held by the consumer since the last read()
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # Counters
+        self.frames_written = 0
+        self.frames_read = 0
+        self.overflow_frames = 0  # Frames lost because the buffer was full
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self._waiting)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def write(self, data):
+        """
+        Copy audio into the buffer (split into slots if longer than one frame).
+
+        Returns:
+        - int: Number of frames lost to overflow during this write
+        """
+        data = memoryview(data).cast('B')
+        lost = 0
+        now = time.monotonic()
+        with self._cond:
+            if self._closed:
+                return 0
+            for offset in range(0, len(data), self.frame_bytes):
+                piece = data[offset:offset + self.frame_bytes]
+                if self._free:
+                    slot = self._free.pop()
+                else:
+                    # Full (the leased slot still belongs to the consumer)
+                    lost += 1
+                    if self.overflow == OVERFLOW_DROP_NEWEST or not self._waiting:
+                        continue
+                    # Drop the oldest waiting frame and reuse its slot
+                    slot = self._waiting.popleft()
+
+                start = slot * self.frame_bytes
+                self._view[start:start + len(piece)] = piece
+                self._lengths[slot] = len(piece)
+                self._stamps[slot] = now
+                self._waiting.append(slot)
+                self.frames_written += 1
+
+            self.overflow_frames += lost
+            self.max_depth = max(self.max_depth, len(self._waiting))
+            self._cond.notify()
+        return lost
+
+    def release(self):
+        """Give the slot returned by the last read() back to the producer."""
+        with self._cond:
+            self._release()
+
+    def _release(self):
+        if self._leased is not None:
+            self._free.append(self._leased)
+            self._leased = None
+
+    def read(self):
+        """
+        Wait for the next frame (no timeout polling).
+
+        Returns:
+        - memoryview of the frame, or None once the buffer is closed and drained
+        """
+        with self._cond:
+            self._release()  # The previous frame has been consumed
+            while not self._waiting and not self._closed:
+                self._cond.wait()
+            if not self._waiting:
+                return None
+            slot = self._waiting.popleft()
+            self._leased = slot
+            self.frames_read += 1
+            self.last_stamp = self._stamps[slot]
+            start = slot * self.frame_bytes
+            return self._view[start:start + self._lengths[slot]]
+
+    def frames(self):
+        """Iterate over frames until the buffer is closed and drained."""
+        try:
+            while True:
+                frame = self.read()
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            self.release()
+
+    def close(self):
+        """
+        Stop accepting audio and wake the consumer.
+        Frames already buffered are still returned, then read() returns None.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        """Return the buffer counters."""
+        return {
+            "frames_written": self.frames_written,
+            "frames_read": self.frames_read,
+            "overflow_frames": self.overflow_frames,
+            "depth": len(self._waiting),
+            "max_depth": self.max_depth,
+            "capacity": self.capacity,
+        }
+
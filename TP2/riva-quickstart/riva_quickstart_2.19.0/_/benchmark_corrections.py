@@ -0,0 +1,138 @@
+"""
+Micro-benchmark des corrections post-transcription
+Compare l'ancienne boucle (un re.sub par règle) au moteur compilé de
+transcript_corrections.py, pour 10, 1 000 et 10 000 règles.
+
+Usage:
+    python benchmark_corrections.py
+    python benchmark_corrections.py --rules 10 100 1000 --texts 500 --hit-rate 0.2
+"""
+
+import argparse
+import random
+import re
+import time
+
+from transcript_corrections import CompiledCorrections
+
+SYLLABLES = ["ha", "hou", "da", "ach", "raf", "mo", "ham", "med", "fa", "ti", "ma",
+             "chaa", "bi", "is", "ka", "ne", "sa", "li", "ya", "za", "ke", "ri"]
+
+# Phrases typiques d'un résultat provisoire ou final
+SENTENCES = [
+    "bonjour je voudrais parler à oda du service client",
+    "oui c'est bien ça mon dossier est au nom de hooda",
+    "je vous appelle au sujet du crédit immobilier de monsieur achraf",
+    "est-ce que vous pouvez me rappeler demain matin s'il vous plaît",
+    "ou da m'a dit que le conseiller allait me contacter",
+]
+
+
+def make_rules(count, seed=42):
+    """
+    Génère `count` règles réalistes : 90 % de noms propres (\\bmot\\b),
+    10 % de vraies regex (espaces optionnels, suffixes).
+    """
+    rng = random.Random(seed)
+    rules = []
+    seen = set()
+    while len(rules) < count:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word in seen:
+            continue
+        seen.add(word)
+        replacement = word.capitalize()
+        if rng.random() < 0.9:
+            rules.append((rf"\b{word}\b", replacement))
+        else:
+            head, tail = word[:2], word[2:]
+            rules.append((rf"\b{head}\s*{tail}s?\b", replacement))
+    return rules
+
+
+def rule_sample(pattern):
+    """Texte reconnu par une règle de make_rules (forme espacée pour les vraies regex)."""
+    body = pattern[2:-2]  # Sans les \\b
+    if "\\s*" in body:
+        head, tail = body.split("\\s*")
+        return f"{head} {tail.removesuffix('s?')}s"
+    return body
+
+
+def make_texts(rules, count, hit_rate, seed=0):
+    """
+    Génère `count` transcriptions à partir de SENTENCES.
+    Une proportion `hit_rate` contient un ou deux mots couverts par les règles,
+    pour mesurer aussi le chemin de substitution et pas seulement l'absence de correspondance.
+    """
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        words = rng.choice(SENTENCES).split()
+        if rng.random() < hit_rate:
+            for _ in range(rng.randint(1, 2)):
+                words.insert(rng.randint(0, len(words)), rule_sample(rng.choice(rules)[0]))
+        texts.append(" ".join(words))
+    return texts
+
+
+def legacy_correct(rules):
+    """Reproduit l'ancienne fonction correct_transcript (une passe par règle)."""
+    corrections = dict(rules)
+
+    def correct_transcript(text):
+        corrected = text
+        for pattern, replacement in corrections.items():
+            corrected = re.sub(pattern, replacement, corrected, flags=re.IGNORECASE)
+        return corrected
+
+    return correct_transcript
+
+
+def time_per_call(function, texts, min_duration=0.5):
+    """Retourne le temps moyen par appel (en microsecondes)."""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for text in texts:
+            function(text)
+        calls += len(texts)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_duration:
+            return elapsed / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark des corrections post-transcription")
+    parser.add_argument("--rules", type=int, nargs="+", default=[10, 1000, 10000],
+                        help="Nombre de règles à tester")
+    parser.add_argument("--texts", type=int, default=50, help="Nombre de transcriptions par tour")
+    parser.add_argument("--hit-rate", type=float, default=0.5,
+                        help="Proportion de transcriptions contenant des mots à corriger")
+    args = parser.parse_args()
+
+    print(f"{'règles':>8} | {'compilation':>12} | {'ancienne boucle':>16} | {'moteur compilé':>15} | {'gain':>7}")
+    print("-" * 72)
+    for count in args.rules:
+        rules = make_rules(count)
+        texts = make_texts(rules, args.texts, args.hit_rate)
+
+        start = time.perf_counter()
+        engine = CompiledCorrections(rules)
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        # Vérifier que les deux implémentations donnent le même résultat
+        legacy = legacy_correct(rules)
+        for text in set(texts):
+            assert legacy(text) == engine(text), text
+        corrected = sum(engine(text) != text for text in texts)
+
+        legacy_us = time_per_call(legacy, texts)
+        engine_us = time_per_call(engine, texts)
+        print(f"{count:>8} | {compile_ms:>9.1f} ms | {legacy_us:>13.1f} µs | "
+              f"{engine_us:>12.1f} µs | {legacy_us / engine_us:>6.0f}x "
+              f"({corrected}/{len(texts)} textes corrigés)")
+
+
+if __name__ == "__main__":
+    main()
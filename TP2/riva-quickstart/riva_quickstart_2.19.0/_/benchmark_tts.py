@@ -0,0 +1,276 @@
+"""
+Test de charge du serveur TTS WebSocket (tts.py)
+Simule N clients connectés en même temps qui envoient des textes de longueur
+variable, et mesure pour chaque requête :
+- le time-to-first-audio (premier message binaire reçu),
+- la latence complète (statut "success" ou "error" reçu),
+puis affiche les p50/p95/p99, le débit en caractères/s et le taux d'erreurs.
+
+Deux modes d'arrivée :
+- boucle fermée (--rate 0) : chaque client envoie sa requête suivante dès
+  que la précédente est terminée ;
+- boucle ouverte (--rate R) : les requêtes arrivent selon un processus de
+  Poisson de R requêtes/s, quel que soit l'état du serveur. Les latences
+  comptent depuis l'arrivée, y compris l'attente d'un client libre, pour ne
+  pas masquer la saturation.
+
+Pour des résultats reproductibles sans GPU, lancer tts.py contre le faux Riva :
+    python fake_riva_tts.py --ms-per-char 2 --first-chunk-ms 80 --chunk-ms 200 --capacity 4
+    python tts.py
+
+Usage:
+    python benchmark_tts.py
+    python benchmark_tts.py --clients 16 --requests 400 --rate 8 --lengths lognormal:120:0.8 --stream
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import time
+from collections import Counter, namedtuple
+
+import websockets
+
+# Identifiant de chaque requête (renvoyé par le serveur dans ses messages JSON)
+REQUEST_IDS = itertools.count(1)
+
+# Phrases assemblées pour produire des textes de la longueur voulue
+SENTENCES = [
+    "Bonjour et bienvenue sur le service client de votre banque.",
+    "Votre conseiller est momentanément indisponible, merci de patienter.",
+    "Pour consulter le solde de votre compte, dites solde.",
+    "Votre demande de crédit immobilier a bien été enregistrée.",
+    "Un conseiller vous rappellera demain matin entre neuf heures et midi.",
+    "Merci de préparer votre numéro de dossier avant de continuer.",
+    "Nous n'avons pas compris votre réponse, pouvez-vous répéter ?",
+    "La carte bancaire a été bloquée à votre demande.",
+]
+
+# chars: longueur du texte, ttfa/latency: secondes (None si erreur), error: message ou None
+Result = namedtuple("Result", ["chars", "ttfa", "latency", "error", "audio_bytes"])
+
+
+def parse_lengths(spec):
+    """
+    Distribution des longueurs de texte, en caractères.
+
+    Parameters:
+    - spec: "fixed:N", "uniform:MIN:MAX" ou "lognormal:MEDIANE:SIGMA"
+
+    Returns:
+    - Fonction rng -> longueur
+    """
+    kind, *values = spec.split(":")
+    try:
+        if kind == "fixed" and len(values) == 1:
+            length = int(values[0])
+            return lambda rng: length
+        if kind == "uniform" and len(values) == 2:
+            low, high = int(values[0]), int(values[1])
+            return lambda rng: rng.randint(low, high)
+        if kind == "lognormal" and len(values) == 2:
+            median, sigma = float(values[0]), float(values[1])
+            return lambda rng: min(2000, max(1, round(rng.lognormvariate(math.log(median), sigma))))
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"distribution invalide: {spec} (fixed:N, uniform:MIN:MAX, lognormal:MEDIANE:SIGMA)")
+
+
+def make_text(rng, length, index, unique=True):
+    """
+    Texte d'environ `length` caractères, coupé à une fin de mot.
+    Avec unique=True, le numéro de requête le rend unique (pas de cache ni de partage dans tts.py).
+    """
+    words = [f"Message {index}." if unique else ""]
+    size = len(words[0])
+    while size < length:
+        for word in rng.choice(SENTENCES).split():
+            words.append(word)
+            size += len(word) + 1
+            if size >= length:
+                break
+    return " ".join(word for word in words if word)
+
+
+def percentile(sorted_values, fraction):
+    """Percentile par rang le plus proche (valeurs déjà triées)."""
+    if not sorted_values:
+        return float("nan")
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(rank, 1)) - 1]
+
+
+async def request_once(websocket, payload, started, timeout):
+    """
+    Envoyer une requête et attendre sa fin.
+
+    Parameters:
+    - websocket: Connexion déjà ouverte (message de bienvenue lu)
+    - payload: Message JSON de la requête
+    - started: Instant d'arrivée de la requête (time.monotonic)
+    - timeout: Secondes avant d'abandonner
+
+    Returns:
+    - (ttfa, latency, error, audio_bytes)
+    """
+    await websocket.send(json.dumps(payload))
+    request_id = payload.get("id")
+    ours = True  # Les trames binaires appartiennent à la requête du dernier audio_start
+    ttfa = None
+    audio_bytes = 0
+    deadline = started + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        message = await asyncio.wait_for(websocket.recv(), remaining)
+        if isinstance(message, bytes):
+            if not ours:
+                continue
+            if ttfa is None:
+                ttfa = time.monotonic() - started
+            audio_bytes += len(message)
+            continue
+        status = json.loads(message)
+        if status.get("type") == "audio_start":
+            ours = status.get("id", request_id) == request_id
+        if status.get("id", request_id) != request_id:
+            continue  # Fin d'une requête précédente (ex. annulée après un timeout)
+        if status.get("type") == "cancelled":
+            return None, None, "annulée", audio_bytes
+        if status.get("type") == "success":
+            return ttfa, time.monotonic() - started, None, audio_bytes
+        if status.get("type") == "error":
+            # Messages sur une ligne (les erreurs gRPC en font plusieurs) pour les regrouper
+            return None, None, " ".join(status.get("message", "erreur").split())[:160], audio_bytes
+
+
+async def run_client(url, jobs, results, options):
+    """
+    Un client : une connexion, des requêtes l'une après l'autre.
+    La connexion est rouverte après un timeout ou une déconnexion.
+    """
+    websocket = None
+    while True:
+        job = await jobs.get()
+        if job is None:
+            break
+        arrival, text = job
+        started = arrival if arrival is not None else time.monotonic()
+        payload = {"id": next(REQUEST_IDS), "text": text, "stream": options.stream, "format": options.format}
+        if options.voice:
+            payload["voice"] = options.voice
+        broken = False
+        try:
+            if websocket is None:
+                websocket = await websockets.connect(url, max_size=None)
+                await websocket.recv()  # Message de bienvenue
+            ttfa, latency, error, audio_bytes = await request_once(websocket, payload, started, options.timeout)
+        except asyncio.TimeoutError:
+            ttfa, latency, error, audio_bytes, broken = None, None, "timeout", 0, True
+        except (OSError, websockets.exceptions.WebSocketException) as e:
+            ttfa, latency, error, audio_bytes, broken = None, None, f"connexion: {type(e).__name__}", 0, True
+        if broken and websocket is not None:
+            # État de la connexion inconnu : en ouvrir une nouvelle pour la requête suivante
+            await websocket.close()
+            websocket = None
+        results.append(Result(len(text), ttfa, latency, error, audio_bytes))
+    if websocket is not None:
+        await websocket.close()
+
+
+async def feed_jobs(jobs, texts, rate, clients, rng):
+    """Mettre les requêtes en file : toutes d'un coup (boucle fermée) ou à leur instant d'arrivée."""
+    if not rate:
+        for text in texts:
+            jobs.put_nowait((None, text))
+    else:
+        arrival = time.monotonic()
+        for text in texts:
+            arrival += rng.expovariate(rate)
+            delay = arrival - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            jobs.put_nowait((arrival, text))
+    for _ in range(clients):
+        jobs.put_nowait(None)
+
+
+async def run_load(options):
+    rng = random.Random(options.seed)
+    length = options.lengths
+    texts = [make_text(rng, length(rng), index, not options.allow_cache) for index in range(options.requests)]
+    jobs = asyncio.Queue()
+    results = []
+
+    start = time.monotonic()
+    clients = [asyncio.create_task(run_client(options.url, jobs, results, options)) for _ in range(options.clients)]
+    await feed_jobs(jobs, texts, options.rate, options.clients, rng)
+    await asyncio.gather(*clients)
+    return results, time.monotonic() - start
+
+
+def report(results, elapsed, options):
+    ok = [result for result in results if result.error is None]
+    errors = Counter(result.error for result in results if result.error is not None)
+    mode = f"boucle ouverte, {options.rate:g} req/s" if options.rate else "boucle fermée"
+    print(f"\n📊 {len(results)} requêtes, {options.clients} clients ({mode}), "
+          f"{'streaming' if options.stream else 'fichier'} {options.format}, en {elapsed:.1f} s")
+
+    print(f"\n{'':<22} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for label, values in (
+        ("time-to-first-audio", sorted(r.ttfa for r in ok if r.ttfa is not None)),
+        ("latence complète", sorted(r.latency for r in ok)),
+    ):
+        if values:
+            cells = [percentile(values, f) * 1000 for f in (0.50, 0.95, 0.99)] + [values[-1] * 1000]
+            print(f"{label:<22} " + " ".join(f"{cell:>6.0f} ms" for cell in cells))
+        else:
+            print(f"{label:<22} {'—':>9}")
+
+    chars = sum(result.chars for result in ok)
+    print(f"\nDébit: {chars / elapsed:.0f} caractères/s, {len(ok) / elapsed:.2f} requêtes/s réussies "
+          f"({sum(r.audio_bytes for r in ok) / 1e6:.1f} Mo d'audio)")
+    error_count = sum(errors.values())
+    print(f"Erreurs: {error_count}/{len(results)} ({error_count / max(len(results), 1):.1%})")
+    for message, count in errors.most_common(5):
+        print(f"   {count:>5} × {message}")
+
+    if options.json:
+        with open(options.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "options": {k: v for k, v in vars(options).items() if k not in ("lengths", "json")},
+                "elapsed": elapsed,
+                "results": [result._asdict() for result in results],
+            }, f, ensure_ascii=False, indent=1)
+        print(f"💾 Résultats détaillés: {options.json}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge du serveur TTS WebSocket")
+    parser.add_argument("--url", default="ws://localhost:8766", help="Adresse du serveur tts.py")
+    parser.add_argument("--clients", type=int, default=8, help="Connexions simultanées")
+    parser.add_argument("--requests", type=int, default=100, help="Nombre total de requêtes")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Arrivées par seconde (Poisson) ; 0 = boucle fermée")
+    parser.add_argument("--lengths", type=parse_lengths, default="uniform:20:300",
+                        help="Longueur des textes: fixed:N, uniform:MIN:MAX, lognormal:MEDIANE:SIGMA")
+    parser.add_argument("--stream", action="store_true", help="Demander l'audio en streaming")
+    parser.add_argument("--format", default="pcm", choices=["pcm", "opus"], help="Format audio demandé")
+    parser.add_argument("--voice", default=None, help="Voix (défaut: celle du serveur)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Secondes avant d'abandonner une requête")
+    parser.add_argument("--allow-cache", action="store_true",
+                        help="Textes répétés possibles (mesure aussi le cache et le partage)")
+    parser.add_argument("--seed", type=int, default=0, help="Graine des textes et des arrivées")
+    parser.add_argument("--json", default=None, help="Fichier où enregistrer chaque requête")
+    args = parser.parse_args()
+
+    results, elapsed = asyncio.run(run_load(args))
+    report(results, elapsed, args)
+
+
+if __name__ == "__main__":
+    main()
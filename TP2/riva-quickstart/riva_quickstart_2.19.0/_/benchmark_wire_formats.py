@@ -0,0 +1,130 @@
+"""
+Micro-benchmark des encodages envoyés aux clients WebSocket
+Rejoue un trafic réaliste (résultats provisoires qui grandissent mot à mot,
+puis un résultat final par phrase) et mesure, pour chaque encodage de
+wire_formats.py :
+- le coût d'encodage par message,
+- la taille par message, brute et après permessage-deflate (contexte
+  conservé d'un message à l'autre, comme une vraie connexion),
+- le coût de la diffusion à N clients : un encodage par client (ancien
+  comportement) contre un encodage par format (EncodedMessage).
+
+Usage:
+    python benchmark_wire_formats.py
+    python benchmark_wire_formats.py --clients 200 --repeat 20
+"""
+
+import argparse
+import time
+import zlib
+
+from wire_formats import EncodedMessage, available_encodings, decode, encode
+
+# Phrases transcrites, découpées en résultats provisoires
+SENTENCES = [
+    "bonjour je voudrais parler à Houda du service client",
+    "oui c'est bien ça mon dossier est au nom de Achraf Chaabi",
+    "je vous appelle au sujet du crédit immobilier de monsieur Mohammed",
+    "est-ce que vous pouvez me rappeler demain matin s'il vous plaît",
+    "Fatima m'a dit que le conseiller allait me contacter cette semaine",
+]
+
+
+def make_traffic(repeat):
+    """
+    Génère les messages d'une session : deux hypothèses provisoires par mot
+    (Riva révise souvent le dernier mot), puis le résultat final.
+    """
+    messages = []
+    timestamp = 1000.0
+    for _ in range(repeat):
+        for sentence in SENTENCES:
+            words = sentence.split()
+            for count in range(1, len(words) + 1):
+                for _ in range(2):
+                    timestamp += 0.08
+                    messages.append({
+                        "type": "transcription",
+                        "text": " ".join(words[:count]),
+                        "is_final": False,
+                        "timestamp": timestamp,
+                    })
+            timestamp += 0.3
+            messages.append({
+                "type": "transcription",
+                "text": sentence.capitalize() + ".",
+                "is_final": True,
+                "timestamp": timestamp,
+            })
+    return messages
+
+
+def deflated_sizes(payloads):
+    """Taille de chaque message après permessage-deflate (context takeover)."""
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    sizes = []
+    for payload in payloads:
+        data = payload.encode("utf-8") if isinstance(payload, str) else payload
+        block = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        sizes.append(len(block) - 4)  # La fin 00 00 ff ff n'est pas transmise
+    return sizes
+
+
+def bench_encodings(messages):
+    print(f"{'encodage':<10} {'µs/msg':>8} {'octets/msg':>11} {'deflate':>9} {'vs json':>8}")
+    json_bytes = None
+    for encoding in available_encodings():
+        start = time.perf_counter()
+        payloads = [encode(message, encoding) for message in messages]
+        elapsed = time.perf_counter() - start
+
+        # Vérification : l'encodage est réversible
+        sample = decode(payloads[-1], encoding)
+        assert sample["text"] == messages[-1]["text"] and sample["is_final"]
+
+        raw = sum(len(p.encode("utf-8") if isinstance(p, str) else p) for p in payloads) / len(payloads)
+        deflated = sum(deflated_sizes(payloads)) / len(payloads)
+        json_bytes = json_bytes or raw
+        print(f"{encoding:<10} {elapsed / len(messages) * 1e6:>8.2f} {raw:>11.1f} "
+              f"{deflated:>9.1f} {raw / json_bytes:>7.0%}")
+
+
+def bench_fanout(messages, clients):
+    """Coût d'encodage pour diffuser chaque message à `clients` clients."""
+    encodings = available_encodings()
+    client_encodings = [encodings[i % len(encodings)] for i in range(clients)]
+
+    start = time.perf_counter()
+    for message in messages:
+        for encoding in client_encodings:
+            encode(message, encoding)
+    per_client = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for message in messages:
+        encoded = EncodedMessage(message)
+        for encoding in client_encodings:
+            encoded.payload(encoding)
+    per_encoding = time.perf_counter() - start
+
+    print(f"\nDiffusion à {clients} clients ({', '.join(encodings)} en alternance)")
+    print(f"  un encodage par client  : {per_client / len(messages) * 1e6:>9.1f} µs/msg")
+    print(f"  un encodage par format  : {per_encoding / len(messages) * 1e6:>9.1f} µs/msg "
+          f"(x{per_client / per_encoding:.0f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="Nombre de passages sur les phrases")
+    parser.add_argument("--clients", type=int, default=50, help="Clients connectés pour la diffusion")
+    args = parser.parse_args()
+
+    messages = make_traffic(args.repeat)
+    finals = sum(message["is_final"] for message in messages)
+    print(f"{len(messages)} messages ({len(messages) - finals} provisoires, {finals} finaux)\n")
+    bench_encodings(messages)
+    bench_fanout(messages, args.clients)
+
+
+if __name__ == "__main__":
+    main()
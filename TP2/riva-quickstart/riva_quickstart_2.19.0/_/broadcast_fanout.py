@@ -0,0 +1,294 @@
+"""
+Slow-consumer-safe WebSocket fan-out
+Each connected client gets its own bounded outbound queue and its own sender
+task, so one slow or stalled browser can never delay the other clients.
+Each message is encoded once per wire encoding in use (not once per client)
+and the same payload object is shared by reference between the queues of all
+the clients using that encoding.
+"""
+
+# Import asyncio for queues, events and sender tasks
+import asyncio
+
+# Import deque for a queue we can remove interim messages from
+from collections import deque
+
+# Import websockets to detect closed connections
+import websockets
+
+# Import the wire encodings negotiated by each client
+from wire_formats import ENCODING_JSON, EncodedMessage, encode
+
+# What to do when a client's queue is full
+POLICY_DROP_OLDEST_INTERIM = "drop_oldest_interim"  # Drop a stale interim, keep finals
+POLICY_DISCONNECT = "disconnect"  # Close the slow client
+POLICY_BLOCK = "block"  # Wait for room (up to block_timeout), then disconnect
+POLICIES = (POLICY_DROP_OLDEST_INTERIM, POLICY_DISCONNECT, POLICY_BLOCK)
+
+# WebSocket close code sent to clients that cannot keep up ("Try Again Later")
+CLOSE_CODE_TOO_SLOW = 1013
+
+
+class ClientChannel:
+    """
+    Outbound queue and sender task for one WebSocket client.
+
+    Parameters:
+    - websocket: The client connection
+    - max_queue: Maximum number of messages waiting for this client
+    - policy: One of POLICIES, applied when the queue is full
+    - block_timeout: Seconds the "block" policy waits before disconnecting
+    - encoding: Wire encoding negotiated by the client (see wire_formats)
+    - send_latency: Optional Histogram of the time between enqueue and send
+    """
+
+    def __init__(self, websocket, max_queue=64, policy=POLICY_DROP_OLDEST_INTERIM, block_timeout=1.0,
+                 encoding=ENCODING_JSON, send_latency=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow client policy: {policy}")
+
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.encoding = encoding
+        self.send_latency = send_latency
+
+        # Pending messages: (payload, is_final, enqueue time)
+        self._pending = deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._closed = False
+        self._task = None
+        self._waiters = 0  # put() calls blocked on a full queue
+
+        # Per-client counters
+        self.sent = 0
+        self.dropped = 0
+        self.last_lag = 0.0  # Seconds between enqueue and send for the last message
+        self.max_lag = 0.0
+        self.max_depth = 0
+
+    def start(self):
+        """Start the sender task for this client."""
+        self._task = asyncio.create_task(self._sender())
+        return self
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def encode(self, message):
+        """Serialize a message dict in this client's encoding."""
+        return encode(message, self.encoding)
+
+    def _append(self, payload, is_final):
+        self._pending.append((payload, is_final, asyncio.get_running_loop().time()))
+        self.max_depth = max(self.max_depth, len(self._pending))
+        if len(self._pending) >= self.max_queue:
+            self._not_full.clear()
+        self._not_empty.set()
+
+    def _drop_oldest_interim(self):
+        """Remove the oldest interim message from the queue. Returns True if one was found."""
+        for index, (_, is_final, _) in enumerate(self._pending):
+            if not is_final:
+                del self._pending[index]
+                self.dropped += 1
+                return True
+        return False
+
+    def offer(self, payload, is_final):
+        """
+        Queue a message without waiting.
+
+        Returns False if the message could not be queued right now
+        (the "block" policy must then call put()).
+        """
+        if self._closed:
+            return True
+
+        # Keep ordering: queue behind messages already waiting for room
+        if self._waiters and self.policy == POLICY_BLOCK:
+            return False
+
+        if len(self._pending) < self.max_queue:
+            self._append(payload, is_final)
+            return True
+
+        if self.policy == POLICY_DROP_OLDEST_INTERIM:
+            if self._drop_oldest_interim():
+                self._append(payload, is_final)
+            elif not is_final:
+                # Only finals are waiting: the new interim is the one to drop
+                self.dropped += 1
+            else:
+                # A queue full of finals means this client is hopelessly behind
+                self.close("too many pending final transcriptions")
+            return True
+
+        if self.policy == POLICY_DISCONNECT:
+            self.close("outbound queue full")
+            return True
+
+        return False
+
+    async def put(self, payload, is_final):
+        """Queue a message, waiting for room if the "block" policy requires it."""
+        if self.offer(payload, is_final):
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.block_timeout
+        self._waiters += 1
+        try:
+            while not self._closed and len(self._pending) >= self.max_queue:
+                self._not_full.clear()
+                await asyncio.wait_for(self._not_full.wait(), max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            self.close(f"blocked for more than {self.block_timeout}s")
+            return
+        finally:
+            self._waiters -= 1
+        if not self._closed:
+            self._append(payload, is_final)
+
+    def close(self, reason=""):
+        """Stop sending to this client and close its connection in the background."""
+        if self._closed:
+            return
+        self._closed = True
+        self.dropped += len(self._pending)
+        self._pending.clear()
+        self._not_empty.set()  # Wake the sender so it can exit
+        self._not_full.set()  # Release any blocked put()
+        if reason:
+            print(f"⚠️  Disconnecting slow client: {reason} ({self.stats()})")
+        asyncio.ensure_future(self.websocket.close(CLOSE_CODE_TOO_SLOW, reason[:120]))
+
+    async def _sender(self):
+        """Send queued messages to the client, one at a time, in order."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await self._not_empty.wait()
+                if self._closed:
+                    return
+                payload, _, enqueued_at = self._pending.popleft()
+                if not self._pending:
+                    self._not_empty.clear()
+                self._not_full.set()
+
+                await self.websocket.send(payload)
+
+                self.sent += 1
+                self.last_lag = loop.time() - enqueued_at
+                self.max_lag = max(self.max_lag, self.last_lag)
+                if self.send_latency is not None:
+                    self.send_latency.observe(self.last_lag)
+        except websockets.exceptions.ConnectionClosed:
+            # The client went away: nothing left to send
+            self._closed = True
+
+    async def stop(self):
+        """Stop the sender task (the connection itself is closed by its handler)."""
+        self._closed = True
+        self._not_empty.set()
+        self._not_full.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, websockets.exceptions.ConnectionClosed):
+                pass
+
+    def stats(self):
+        """Return the counters for this client."""
+        return {
+            "queued": len(self._pending),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "last_lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "max_depth": self.max_depth,
+            "encoding": self.encoding,
+        }
+
+
+class Fanout:
+    """
+    Set of connected clients, each with its own ClientChannel.
+
+    Parameters:
+    - max_queue: Maximum pending messages per client
+    - policy: Slow client policy (see POLICIES)
+    - block_timeout: Seconds the "block" policy waits before disconnecting
+    - send_latency: Optional Histogram shared by all the clients (enqueue → send)
+    """
+
+    def __init__(self, max_queue=64, policy=POLICY_DROP_OLDEST_INTERIM, block_timeout=1.0,
+                 send_latency=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow client policy: {policy}")
+        self.max_queue = max_queue
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.send_latency = send_latency
+        self.channels = {}  # websocket → ClientChannel
+        self.encodes = 0  # Messages serialized (at most one per encoding in use)
+
+    def __len__(self):
+        return len(self.channels)
+
+    def __bool__(self):
+        return bool(self.channels)
+
+    def add(self, websocket, encoding=ENCODING_JSON):
+        """Register a new client and start its sender task."""
+        channel = ClientChannel(
+            websocket, self.max_queue, self.policy, self.block_timeout, encoding, self.send_latency
+        ).start()
+        self.channels[websocket] = channel
+        return channel
+
+    async def remove(self, websocket):
+        """Unregister a client and stop its sender task. Returns its final counters."""
+        channel = self.channels.pop(websocket, None)
+        if channel is None:
+            return None
+        await channel.stop()
+        return channel.stats()
+
+    async def publish(self, message, is_final=False):
+        """
+        Queue one message for every client.
+
+        The message dict is encoded lazily, once per encoding used by at
+        least one client. Never waits on a slow client, except with the
+        "block" policy where all the full clients are waited for
+        concurrently (bounded by block_timeout).
+        """
+        encoded = EncodedMessage(message)
+        blocked = []
+        for channel in list(self.channels.values()):
+            if channel.closed:
+                continue
+            payload = encoded.payload(channel.encoding)
+            if not channel.offer(payload, is_final):
+                blocked.append(channel.put(payload, is_final))
+        self.encodes += len(encoded.encodings)
+        if blocked:
+            await asyncio.gather(*blocked)
+
+    async def close_all(self):
+        """Stop every sender task and close every connection."""
+        for websocket in list(self.channels):
+            await self.remove(websocket)
+            await websocket.close()
+
+    def stats(self):
+        """Return the counters of every client, keyed by remote address."""
+        return {
+            str(websocket.remote_address): channel.stats()
+            for websocket, channel in self.channels.items()
+        }
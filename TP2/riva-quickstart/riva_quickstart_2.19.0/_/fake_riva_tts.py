@@ -0,0 +1,322 @@
+"""
+Faux serveur Riva TTS pour les tests de charge
+Implémente le service gRPC nvidia.riva.tts.RivaSpeechSynthesis (Synthesize et
+SynthesizeOnline), avec des stubs générés au démarrage depuis
+protos/riva_tts.proto, sans GPU ni modèle. Le temps de calcul est simulé :
+- une latence fixe avant le premier morceau d'audio,
+- une latence par caractère du texte,
+- une cadence de morceaux en streaming (durée d'audio par morceau),
+- une capacité (synthèses simultanées, les suivantes attendent),
+- un taux d'erreurs (UNAVAILABLE), déterministe pour un texte et une graine.
+L'audio est une sinusoïde PCM 16 bits au débit demandé, de durée
+proportionnelle au texte. En OGGOPUS, c'est un vrai flux Ogg Opus de même
+durée (en-têtes OpusHead/OpusTags puis pages de paquets Opus de silence :
+aucun encodeur n'est nécessaire). tts.py s'y connecte comme à un vrai Riva.
+
+Usage:
+    python fake_riva_tts.py
+    python fake_riva_tts.py --port 50051 --ms-per-char 2 --first-chunk-ms 80 --chunk-ms 200 --capacity 4
+"""
+
+import argparse
+import functools
+import math
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent import futures
+
+import grpc
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROTO_DIR = os.path.join(SCRIPT_DIR, "protos")
+
+# AudioEncoding.OGGOPUS des clients Riva récents (absent de protos/riva_audio.proto)
+OGGOPUS = 4
+
+# Paquet Opus de 20 ms de silence (CELT pleine bande, mono, une trame)
+OPUS_SILENCE = b"\xf8\xff\xfe"
+OPUS_FRAME_SAMPLES = 960  # 20 ms, les positions Opus sont comptées à 48 kHz
+
+
+def load_stubs(proto_dir=PROTO_DIR):
+    """
+    Génère les modules Python de riva_tts.proto (et riva_audio.proto qu'il importe)
+    dans un dossier temporaire et les importe.
+
+    Returns:
+    - (riva_tts_pb2, riva_tts_pb2_grpc, riva_audio_pb2)
+    """
+    from grpc_tools import protoc
+
+    out_dir = tempfile.mkdtemp(prefix="riva_tts_stubs_")
+    # Les protos standards (google/protobuf/...) sont fournis avec grpc_tools
+    include = os.path.join(os.path.dirname(protoc.__file__), "_proto")
+    status = protoc.main([
+        "grpc_tools.protoc",
+        f"-I{proto_dir}",
+        f"-I{include}",
+        f"--python_out={out_dir}",
+        f"--grpc_python_out={out_dir}",
+        os.path.join(proto_dir, "riva_audio.proto"),
+        os.path.join(proto_dir, "riva_tts.proto"),
+    ])
+    if status != 0:
+        raise RuntimeError(f"protoc a échoué ({status}) sur {proto_dir}")
+    sys.path.insert(0, out_dir)
+    import riva_audio_pb2
+    import riva_tts_pb2
+    import riva_tts_pb2_grpc
+    return riva_tts_pb2, riva_tts_pb2_grpc, riva_audio_pb2
+
+
+class SimulatedSynthesis:
+    """
+    Modèle de coût d'une synthèse.
+
+    Parameters:
+    - ms_per_char: Temps de calcul par caractère
+    - first_chunk_ms: Temps avant le premier morceau (chargement, prétraitement)
+    - chunk_ms: Durée d'audio de chaque morceau envoyé en streaming
+    - audio_ms_per_char: Durée d'audio produite par caractère (~15 caractères/s parlés)
+    - error_rate: Proportion des textes qui échouent (UNAVAILABLE)
+    - seed: Graine des erreurs (même texte + même graine = même résultat)
+    """
+
+    def __init__(self, ms_per_char=2.0, first_chunk_ms=80.0, chunk_ms=200, audio_ms_per_char=65.0,
+                 error_rate=0.0, seed=0):
+        self.ms_per_char = ms_per_char
+        self.first_chunk_ms = first_chunk_ms
+        self.chunk_ms = chunk_ms
+        self.audio_ms_per_char = audio_ms_per_char
+        self.error_rate = error_rate
+        self.seed = seed
+
+    def fails(self, text):
+        draw = zlib.crc32(f"{self.seed}:{text}".encode("utf-8")) / 0xFFFFFFFF
+        return draw < self.error_rate
+
+    def chunks(self, text, sample_rate):
+        """
+        Morceaux d'audio et instant (secondes depuis le début) où chacun est prêt.
+
+        Returns:
+        - list of (ready_at, pcm bytes)
+        """
+        total_samples = max(1, int(sample_rate * self.audio_ms_per_char * len(text) / 1000))
+        chunk_samples = max(1, sample_rate * self.chunk_ms // 1000)
+        count = math.ceil(total_samples / chunk_samples)
+        first = self.first_chunk_ms / 1000
+        per_char = self.ms_per_char * len(text) / 1000
+        result = []
+        for index in range(count):
+            start = index * chunk_samples
+            samples = min(chunk_samples, total_samples - start)
+            ready_at = first + per_char * (index + 1) / count
+            result.append((ready_at, tone(start, samples, sample_rate)))
+        return result
+
+
+@functools.lru_cache(maxsize=None)
+def one_second_tone(sample_rate, frequency=220, amplitude=3000):
+    """Une seconde de sinusoïde PCM 16 bits little-endian (un nombre entier de périodes)."""
+    step = 2 * math.pi * frequency / sample_rate
+    return b"".join(
+        int(amplitude * math.sin(step * n)).to_bytes(2, "little", signed=True)
+        for n in range(sample_rate)
+    )
+
+
+def tone(start, samples, sample_rate):
+    """Échantillons [start, start + samples) de la sinusoïde (continue d'un morceau à l'autre)."""
+    second = one_second_tone(sample_rate)
+    offset = start % sample_rate * 2
+    needed = offset + samples * 2
+    repeated = second * (needed // len(second) + 1)
+    return repeated[offset:needed]
+
+
+def _ogg_crc_table():
+    table = []
+    for index in range(256):
+        crc = index << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1) & 0xFFFFFFFF
+        table.append(crc)
+    return table
+
+
+OGG_CRC_TABLE = _ogg_crc_table()
+
+
+def ogg_page(header_type, granule, serial, sequence, packets):
+    """Une page Ogg (packets : paquets complets, 255 segments au plus)."""
+    lacing = bytearray()
+    for packet in packets:
+        lacing += b"\xff" * (len(packet) // 255) + bytes([len(packet) % 255])
+    page = bytearray(struct.pack("<4sBBqIIIB", b"OggS", 0, header_type, granule, serial, sequence, 0, len(lacing)))
+    page += lacing
+    for packet in packets:
+        page += packet
+    crc = 0
+    for byte in page:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ OGG_CRC_TABLE[(crc >> 24) ^ byte]
+    struct.pack_into("<I", page, 22, crc)
+    return bytes(page)
+
+
+class OggOpusStream:
+    """
+    Flux Ogg Opus simulé : les en-têtes au premier morceau, puis des pages
+    de silence de la durée de chaque morceau d'audio.
+    """
+
+    def __init__(self, sample_rate, serial):
+        self.sample_rate = sample_rate
+        self.serial = serial
+        self.sequence = 0
+        self.granule = 0
+
+    def _page(self, header_type, packets):
+        page = ogg_page(header_type, self.granule, self.serial, self.sequence, packets)
+        self.sequence += 1
+        return page
+
+    def header(self):
+        """Pages OpusHead (début de flux) et OpusTags."""
+        head = struct.pack("<8sBBHIhB", b"OpusHead", 1, 1, 0, self.sample_rate, 0, 0)
+        vendor = b"fake_riva_tts"
+        tags = b"OpusTags" + struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", 0)
+        return self._page(0x02, [head]) + self._page(0x00, [tags])
+
+    def pages(self, samples, last=False):
+        """Pages de `samples` échantillons (au débit du flux) ; last=True ferme le flux."""
+        count = max(1, round(samples * 48000 / self.sample_rate / OPUS_FRAME_SAMPLES))
+        pages = []
+        while count:
+            packets = min(count, 255)
+            count -= packets
+            self.granule += packets * OPUS_FRAME_SAMPLES
+            pages.append(self._page(0x04 if last and not count else 0x00, [OPUS_SILENCE] * packets))
+        return b"".join(pages)
+
+
+def wait_until(context, deadline):
+    """Attendre jusqu'à `deadline` (time.monotonic) ; False si l'appel a été annulé entre-temps."""
+    while True:
+        remaining = deadline - time.monotonic()
+        if not context.is_active():
+            return False
+        if remaining <= 0:
+            return True
+        time.sleep(min(remaining, 0.01))
+
+
+def make_servicer(pb2, pb2_grpc, audio_pb2, model, capacity):
+    """Servicer RivaSpeechSynthesis qui simule le modèle `model`."""
+    slots = threading.BoundedSemaphore(capacity)
+    stats = {"requests": 0, "errors": 0, "cancelled": 0, "chars": 0}
+    stats_lock = threading.Lock()
+
+    def count(field, value=1):
+        with stats_lock:
+            stats[field] += value
+
+    def check(request, context):
+        count("requests")
+        if not request.text:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "text is empty")
+        if request.encoding not in (audio_pb2.LINEAR_PCM, audio_pb2.ENCODING_UNSPECIFIED, OGGOPUS):
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "only LINEAR_PCM and OGGOPUS are simulated")
+        if model.fails(request.text):
+            count("errors")
+            context.abort(grpc.StatusCode.UNAVAILABLE, "simulated failure")
+        count("chars", len(request.text))
+
+    def run(request, context):
+        """Morceaux d'audio au rythme du modèle ; s'arrête si le client annule."""
+        sample_rate = request.sample_rate_hz or 22050
+        opus = OggOpusStream(sample_rate, zlib.crc32(request.text.encode("utf-8"))) \
+            if request.encoding == OGGOPUS else None
+        # La capacité est occupée pendant toute la synthèse, comme un GPU
+        with slots:
+            started = time.monotonic()
+            chunks = model.chunks(request.text, sample_rate)
+            for index, (ready_at, audio) in enumerate(chunks):
+                if not wait_until(context, started + ready_at):
+                    count("cancelled")
+                    return
+                if opus is not None:
+                    # Même durée que le PCM, en pages Ogg Opus (en-têtes en tête du premier morceau)
+                    header = opus.header() if index == 0 else b""
+                    audio = header + opus.pages(len(audio) // 2, last=index == len(chunks) - 1)
+                yield audio
+
+    class FakeRivaSpeechSynthesis(pb2_grpc.RivaSpeechSynthesisServicer):
+
+        def Synthesize(self, request, context):
+            check(request, context)
+            audio = b"".join(run(request, context))
+            return pb2.SynthesizeSpeechResponse(audio=audio)
+
+        def SynthesizeOnline(self, request, context):
+            check(request, context)
+            for audio in run(request, context):
+                yield pb2.SynthesizeSpeechResponse(audio=audio)
+
+    return FakeRivaSpeechSynthesis(), stats
+
+
+def serve(port, model, capacity, workers):
+    """Démarrer le faux serveur (retourne le grpc.Server et ses compteurs)."""
+    pb2, pb2_grpc, audio_pb2 = load_stubs()
+    servicer, stats = make_servicer(pb2, pb2_grpc, audio_pb2, model, capacity)
+    # Sans SO_REUSEPORT : un ancien faux serveur encore lancé ferait échouer le démarrage
+    # au lieu de se partager silencieusement les requêtes
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers), options=[("grpc.so_reuseport", 0)])
+    pb2_grpc.add_RivaSpeechSynthesisServicer_to_server(servicer, server)
+    server.add_insecure_port(f"[::]:{port}")
+    server.start()
+    return server, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Faux serveur Riva TTS (latences simulées)")
+    parser.add_argument("--port", type=int, default=50051, help="Port gRPC (celui de RIVA_SERVER dans tts.py)")
+    parser.add_argument("--ms-per-char", type=float, default=2.0, help="Temps de calcul par caractère")
+    parser.add_argument("--first-chunk-ms", type=float, default=80.0, help="Temps avant le premier morceau")
+    parser.add_argument("--chunk-ms", type=int, default=200, help="Durée d'audio par morceau en streaming")
+    parser.add_argument("--audio-ms-per-char", type=float, default=65.0, help="Durée d'audio par caractère")
+    parser.add_argument("--capacity", type=int, default=4, help="Synthèses simultanées (les autres attendent)")
+    parser.add_argument("--workers", type=int, default=64, help="Threads gRPC (appels acceptés en même temps)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Proportion de textes en erreur (0-1)")
+    parser.add_argument("--seed", type=int, default=0, help="Graine des erreurs simulées")
+    args = parser.parse_args()
+
+    model = SimulatedSynthesis(
+        ms_per_char=args.ms_per_char,
+        first_chunk_ms=args.first_chunk_ms,
+        chunk_ms=args.chunk_ms,
+        audio_ms_per_char=args.audio_ms_per_char,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    server, stats = serve(args.port, model, args.capacity, args.workers)
+    print(f"🎭 Faux Riva TTS sur le port {args.port} "
+          f"({args.first_chunk_ms:g} ms + {args.ms_per_char:g} ms/caractère, "
+          f"morceaux de {args.chunk_ms} ms, capacité {args.capacity}, erreurs {args.error_rate:.0%})")
+    try:
+        server.wait_for_termination()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop(grace=1)
+        print(f"📊 {stats}")
+
+
+if __name__ == "__main__":
+    main()
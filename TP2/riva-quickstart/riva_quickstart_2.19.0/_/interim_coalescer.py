@@ -0,0 +1,125 @@
+"""
+Latest-wins coalescing of interim transcriptions
+Sits between the Riva thread and the asyncio event loop. Only the newest
+pending interim hypothesis is kept, and it is flushed at most once every
+`min_interval` seconds. Final transcriptions are never delayed or dropped:
+they are scheduled immediately, cancel the interim flush waiting on its
+timer and supersede any pending interim.
+"""
+
+# Import threading to protect the pending interim shared with the Riva thread
+import threading
+
+# Import time for a monotonic clock shared by both threads
+import time
+
+
+class InterimCoalescer:
+    """
+    Coalesce interim results of one transcription stream.
+
+    Parameters:
+    - loop: The asyncio event loop that owns the WebSocket clients
+    - publish: Coroutine function called as publish(message_type, text, is_final)
+    - min_interval: Minimum seconds between two interim flushes (e.g. 0.05 to 0.1)
+    - message_type: Message type passed to publish
+    """
+
+    def __init__(self, loop, publish, min_interval=0.075, message_type="transcription"):
+        self.loop = loop
+        self.publish = publish
+        self.min_interval = min_interval
+        self.message_type = message_type
+
+        self._lock = threading.Lock()
+        self._pending = None  # Newest interim text not yet flushed
+        self._flush_scheduled = False  # A flush is already queued on the loop
+        self._flush_handle = None  # Timer of the queued flush (loop side)
+        self._last_flush = 0.0
+        self._tasks = set()  # Publish tasks still running (keeps them referenced)
+
+        # Counters
+        self.interims_received = 0
+        self.interims_sent = 0
+        self.finals_sent = 0
+
+    # ===== Riva thread side =====
+
+    def submit(self, text, is_final):
+        """
+        Hand a result over from the Riva thread. Never blocks on the event loop.
+        """
+        with self._lock:
+            if is_final:
+                # The final supersedes whatever interim is still pending
+                self._pending = None
+                self.finals_sent += 1
+            else:
+                self.interims_received += 1
+                self._pending = text
+                if self._flush_scheduled:
+                    # A flush is already on its way: it will pick up this text
+                    return
+                self._flush_scheduled = True
+
+        if is_final:
+            self.loop.call_soon_threadsafe(self._send_final, text)
+        else:
+            # One cross-thread wakeup per flush window, not per hypothesis
+            self.loop.call_soon_threadsafe(self._schedule_flush)
+
+    # ===== Event loop side =====
+
+    def _schedule_flush(self):
+        delay = self._last_flush + self.min_interval - time.monotonic()
+        if delay > 0:
+            self._flush_handle = self.loop.call_later(delay, self._flush)
+        else:
+            self._flush()
+
+    def _flush(self):
+        self._flush_handle = None
+        with self._lock:
+            text = self._pending
+            self._pending = None
+            self._flush_scheduled = False
+        if text is None:
+            # Superseded by a final in the meantime
+            return
+        self._last_flush = time.monotonic()
+        self.interims_sent += 1
+        self._send(text, False)
+
+    def _send_final(self, text):
+        reschedule = False
+        if self._flush_handle is not None:
+            # Never let a flush timer armed before the final fire after it
+            self._flush_handle.cancel()
+            self._flush_handle = None
+            with self._lock:
+                # An interim that arrived after the final relied on that timer
+                reschedule = self._pending is not None
+                self._flush_scheduled = reschedule
+        self._send(text, True)
+        if reschedule:
+            self._schedule_flush()
+
+    def _send(self, text, is_final):
+        # Tasks start in creation order, so finals stay ordered with interims
+        task = self.loop.create_task(self.publish(self.message_type, text, is_final))
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"⚠️  Interim coalescer: publish failed: {task.exception()!r}")
+
+    def stats(self):
+        """Return how many interims were received and how many were actually sent."""
+        return {
+            "interims_received": self.interims_received,
+            "interims_sent": self.interims_sent,
+            "interims_coalesced": self.interims_received - self.interims_sent,
+            "finals_sent": self.finals_sent,
+        }
@@ -0,0 +1,152 @@
+"""
+Latency histograms and a Prometheus /metrics endpoint
+Histograms have fixed buckets. Each thread that records into a histogram
+gets its own shard of counters, so recording never takes a lock and never
+loses an update: a shard has exactly one writer, and the scraper only reads
+(and sums) the shards. Shards of finished threads are folded into a single
+retired shard at scrape time, so short-lived Riva threads do not accumulate.
+"""
+
+# Import asyncio for the HTTP endpoint served next to the WebSocket server
+import asyncio
+
+# Import bisect to find a value's bucket
+from bisect import bisect_left
+
+# Import json for the readiness report
+import json
+
+# Import threading for per-thread shards
+import threading
+
+# Default buckets for latencies (seconds): 5 ms to 10 s
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 0.75, 1.0, 1.5, 2.5, 5.0, 10.0)
+
+# Buckets for short CPU-bound steps (seconds): 10 µs to 50 ms
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with lock-free recording.
+
+    Parameters:
+    - name: Prometheus metric name
+    - help: One-line description
+    - buckets: Increasing upper bounds (+Inf is implicit)
+    """
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._shards = {}  # id(shard) → (thread, shard)
+        # Counts of threads that have exited: [bucket counts..., +Inf, sum]
+        self._retired = [0] * (len(self.buckets) + 1) + [0.0]
+
+    def _shard(self):
+        shard = [0] * (len(self.buckets) + 1) + [0.0]
+        self._local.shard = shard
+        # dict assignment is atomic: no lock needed to register
+        self._shards[id(shard)] = (threading.current_thread(), shard)
+        return shard
+
+    def observe(self, value):
+        """Record one value (only touches the calling thread's shard)."""
+        shard = getattr(self._local, "shard", None) or self._shard()
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def snapshot(self):
+        """
+        Return (cumulative bucket counts including +Inf, sum).
+        Called by the scraper; folds the shards of finished threads.
+        """
+        totals = list(self._retired)
+        for key, (thread, shard) in list(self._shards.items()):
+            if not thread.is_alive():
+                # The thread can no longer write: move its counts to the retired shard
+                self._shards.pop(key, None)
+                for i, value in enumerate(shard):
+                    self._retired[i] += value
+            for i, value in enumerate(shard):
+                totals[i] += value
+
+        cumulative = []
+        running = 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-1]
+
+    def render(self):
+        """Return the histogram in Prometheus text format."""
+        cumulative, total = self.snapshot()
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for bound, count in zip(self.buckets, cumulative):
+            lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {count}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative[-1]}')
+        lines.append(f"{self.name}_sum {total:.6f}")
+        lines.append(f"{self.name}_count {cumulative[-1]}")
+        return "\n".join(lines)
+
+
+class MetricsRegistry:
+    """Set of histograms rendered together on /metrics."""
+
+    def __init__(self):
+        self.histograms = []
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        """Create and register a histogram."""
+        histogram = Histogram(name, help, buckets)
+        self.histograms.append(histogram)
+        return histogram
+
+    def render(self):
+        return "\n".join(h.render() for h in self.histograms) + "\n"
+
+
+async def serve_metrics(registry, host="0.0.0.0", port=9100, ready=None):
+    """
+    Serve GET /metrics in Prometheus text format (minimal HTTP/1.1 server).
+
+    Parameters:
+    - ready: Optional callable returning (is_ready, details dict), served as
+      GET /ready (200 if ready, 503 otherwise) for readiness probes
+
+    Returns:
+    - the asyncio Server
+    """
+
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5.0)
+            # Skip the request headers
+            while (await asyncio.wait_for(reader.readline(), 5.0)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.decode("latin-1").split()
+            path = parts[1].split("?")[0] if len(parts) >= 2 and parts[0] == "GET" else None
+            if path == "/metrics":
+                status, content_type, body = "200 OK", PROMETHEUS_CONTENT_TYPE, registry.render()
+            elif path == "/ready" and ready is not None:
+                is_ready, details = ready()
+                status = "200 OK" if is_ready else "503 Service Unavailable"
+                content_type, body = "application/json", json.dumps({"ready": is_ready, **details}) + "\n"
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", "not found\n"
+            data = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1") + data
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -19,25 +19,124 @@ import websockets
 # Import json to format data as JSON
 import json
 
-# Import queue for thread-safe data passing
-import queue
+# Import the preallocated audio ring buffer for thread-safe data passing
+from audio_ring_buffer import AudioRingBuffer, OVERFLOW_DROP_OLDEST
 
 # Import threading to run audio capture in a separate thread
 import threading
 
-# Import regular expressions for text corrections
-import re
+# Import argparse to choose between microphone and multi-session server mode
+import argparse
+
+# Import functools to bind the shared Riva service to session workers
+import functools
+
+# Import os to locate files next to this script
+import os
+
+# Import time for monotonic latency measurements
+import time
+
+# Import the lock-free latency histograms and the Prometheus endpoint
+from latency_metrics import MetricsRegistry, FAST_BUCKETS, serve_metrics
+
+# Import the compiled, hot-reloadable correction engine
+from transcript_corrections import CorrectionRulesWatcher
+
+# Import the per-client fan-out (bounded queue + sender task per client)
+from broadcast_fanout import Fanout, ClientChannel, POLICY_DROP_OLDEST_INTERIM
+
+# Import the wire encodings clients can negotiate (json, msgpack, binary)
+from wire_formats import negotiate, available_encodings, websocket_path
+
+# Import the history of finals replayed to late-joining clients
+from transcript_history import TranscriptHistory, request_from_path
+
+# Import the latest-wins interim coalescer (Riva thread → event loop)
+from interim_coalescer import InterimCoalescer
+
+# Import the per-client ASR sessions and their scheduler (server mode)
+from asr_sessions import ASRSession, SessionScheduler, SessionRejected
+
+# Import the self-renewing Riva stream (rollover + reconnect with audio replay)
+from stream_rollover import RollingRecognizer
 
 # Configuration
 RIVA_SERVER = "localhost:50051"  # Address of Riva server
 SAMPLE_RATE = 16000  # Audio sample rate (16kHz is standard for speech)
 CHUNK_SIZE = 1600  # Number of samples per chunk (100ms at 16kHz)
+CHUNK_BYTES = CHUNK_SIZE * 2  # 16-bit samples
+AUDIO_BUFFER_FRAMES = 50  # Audio buffered for Riva before overflow (50 x 100ms = 5s)
+AUDIO_OVERFLOW_POLICY = OVERFLOW_DROP_OLDEST  # "drop_oldest" (lowest latency) or "drop_newest"
+
+# Voice-activity gating (--vad): silence is not sent to Riva
+VAD_ENABLED = False  # Default when --vad is not given
+VAD_ENERGY_THRESHOLD = 300  # Mean absolute amplitude of speech (same scale as test_riva.py)
+VAD_HANGOVER_MS = 600  # Audio still sent after speech, so Riva can finalize
+VAD_PREROLL_MS = 300  # Audio replayed from before the speech onset
+VAD_KEEPALIVE_INTERVAL = 2.0  # Seconds between keep-alive frames while gated off
 WEBSOCKET_HOST = "0.0.0.0"  # Listen on all network interfaces
 WEBSOCKET_PORT = 8765  # Port for WebSocket server
+# permessage-deflate, used only with clients that offer it ("deflate" or None)
+WEBSOCKET_COMPRESSION = "deflate"
+METRICS_PORT = 8767  # Prometheus metrics: http://host:8767/metrics (0 = disabled, 8766 is tts.py)
+
+# Late joiners: finals kept for clients asking for "last N" or "since T"
+HISTORY_SIZE = 500  # Finals kept in memory
+HISTORY_DIR = None  # Directory of the on-disk history log (None = memory only)
+# Post-transcription correction rules (hot-reloaded when the file changes)
+CORRECTIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corrections.txt")
+CLIENT_QUEUE_SIZE = 64  # Maximum messages waiting for one client
+SLOW_CLIENT_POLICY = POLICY_DROP_OLDEST_INTERIM  # "drop_oldest_interim", "disconnect" or "block"
+SLOW_CLIENT_BLOCK_TIMEOUT = 1.0  # Seconds the "block" policy waits before disconnecting
+INTERIM_FLUSH_INTERVAL = 0.075  # Max one interim broadcast every 75 ms (finals are never delayed)
+
+# Long-running Riva streams: renewed before the server-side duration limit
+STREAM_SOFT_LIMIT = 240.0  # Seconds after which the stream is renewed at the next final result
+STREAM_HARD_LIMIT = 290.0  # Seconds after which the stream is renewed even mid-utterance
+REPLAY_BUFFER_SECONDS = 10.0  # Unconfirmed audio replayed into a renewed/reconnected stream
+
+# Server mode: each client streams its own audio (16-bit mono PCM at SAMPLE_RATE)
+MAX_SESSIONS = 8  # Maximum concurrent Riva streams
+MAX_WAITING_SESSIONS = 16  # Sessions allowed to wait for a free stream (beyond: rejected)
+SESSION_QUEUE_TIMEOUT = 10.0  # Seconds a session may wait for a free stream
+SESSION_IDLE_TIMEOUT = 30.0  # Seconds without audio before a stream is torn down
+
+# Latency histograms served on /metrics
+# Recording is lock-free (one shard per thread), so they are always on
+metrics = MetricsRegistry()
+CAPTURE_TO_FIRST_INTERIM = metrics.histogram(
+    "asr_capture_to_first_interim_seconds",
+    "Capture of the audio to the first interim result of an utterance")
+END_OF_SPEECH_TO_FINAL = metrics.histogram(
+    "asr_end_of_speech_to_final_seconds",
+    "Capture of the last word heard (last changed interim) to the final result")
+AUDIO_QUEUE_DEPTH = metrics.histogram(
+    "asr_audio_queue_depth_frames",
+    "Frames waiting in the audio ring buffer when Riva reads one",
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128))
+CORRECTION_TIME = metrics.histogram(
+    "asr_correction_seconds",
+    "Post-transcription correction of one result", buckets=FAST_BUCKETS)
+PUBLISH_TIME = metrics.histogram(
+    "ws_publish_seconds",
+    "Encoding and queueing one message for every client", buckets=FAST_BUCKETS)
+SEND_LATENCY = metrics.histogram(
+    "ws_send_latency_seconds",
+    "Time a message waits in a client queue until it is sent")
 
-# Global set to store all connected WebSocket clients
-# A set automatically handles adding/removing clients without duplicates
-connected_clients = set()
+# Global fan-out holding all connected WebSocket clients
+# Each client has its own bounded queue and sender task, so a slow
+# client never delays the others
+connected_clients = Fanout(
+    max_queue=CLIENT_QUEUE_SIZE,
+    policy=SLOW_CLIENT_POLICY,
+    block_timeout=SLOW_CLIENT_BLOCK_TIMEOUT,
+    send_latency=SEND_LATENCY
+)
+
+# Finals already broadcast, for clients that join late or reconnect
+transcript_history = TranscriptHistory(HISTORY_SIZE)
 
 async def broadcast_transcription(message_type, text, is_final=False):
     """
@@ -49,117 +148,246 @@ async def broadcast_transcription(message_type, text, is_final=False):
     - is_final: Whether this is a final transcription (True) or interim (False)
     """
     
+    # Keep finals for clients that connect later (even if nobody listens now)
+    record = None
+    if message_type == "transcription" and is_final:
+        record = transcript_history.append(text)
+    
     # If there are no connected clients, don't waste time creating the message
     if not connected_clients:
         return
     
-    # Create a JSON message with all the information
-    message = json.dumps({
+    # Create a message with all the information
+    message = {
         "type": message_type,  # What kind of message is this?
         "text": text,  # The actual content
         "is_final": is_final,  # Is this the final version or still processing?
         "timestamp": asyncio.get_event_loop().time()  # When was this sent?
-    })
-    
-    # Create a list to store clients that have disconnected
-    # We can't modify the set while iterating over it, so we collect disconnected clients
-    disconnected_clients = set()
+    }
+    if record is not None:
+        # Wall-clock time of the final: what a client passes back as "since"
+        message["time"] = record["time"]
+    
+    # Queue the message for every client, serialized once per encoding in use
+    # Each client's sender task delivers it at that client's own pace
+    started = time.perf_counter()
+    await connected_clients.publish(message, is_final)
+    PUBLISH_TIME.observe(time.perf_counter() - started)
+
+def send_history(channel, request):
+    """
+    Queue the finals matching a history request as one batched message.
     
-    # Send the message to all connected clients
-    for client in connected_clients:
-        try:
-            # Try to send the message to this client
-            await client.send(message)
-        except websockets.exceptions.ConnectionClosed:
-            # If the connection is closed, mark this client for removal
-            disconnected_clients.add(client)
+    Parameters:
+    - channel: The client's ClientChannel
+    - request: {"last": N} or {"since": T} (T in epoch seconds)
     
-    # Remove all disconnected clients from our set
-    connected_clients.difference_update(disconnected_clients)
+    "since" answers are paged: "more" is true when the client must ask again
+    with the time of the last item to receive the next finals.
+    """
+    result = transcript_history.query(request)
+    if result is None:
+        return
+    items, more = result
+    channel.offer(channel.encode({
+        "type": "history",
+        "items": items,
+        "more": more,
+        "is_final": True,
+        "timestamp": asyncio.get_event_loop().time()
+    }), True)
 
-async def websocket_handler(websocket, path):
+async def websocket_handler(websocket):
     """
     Handle a new WebSocket connection.
     This function is called whenever a client connects.
     
     Parameters:
     - websocket: The WebSocket connection object
-    - path: The URL path the client connected to (we don't use this)
+    
+    The connection URL may carry ?encoding=json|msgpack|binary, and ?last=N
+    or ?since=T to receive earlier finals right away.
+    
+    Messages from the client:
+    - {"type": "history", "last": N}: the N most recent finals
+    - {"type": "history", "since": T}: the finals after T (epoch seconds),
+      one page at a time (the reply has "more": true if others follow)
     """
     
-    # Add this new client to our set of connected clients
-    connected_clients.add(websocket)
+    # Wire encoding requested by the client (JSON by default)
+    encoding, note = negotiate(websocket_path(websocket))
+    
+    # Add this new client to the fan-out (starts its sender task)
+    channel = connected_clients.add(websocket, encoding)
     
     # Get the client's IP address for logging
     client_ip = websocket.remote_address[0] if websocket.remote_address else "unknown"
     
     # Print a message when a client connects
-    print(f"✓ New client connected from {client_ip} (Total clients: {len(connected_clients)})")
+    print(f"✓ New client connected from {client_ip} ({encoding}, Total clients: {len(connected_clients)})")
     
-    # Send a welcome message to the new client
-    await websocket.send(json.dumps({
+    # Queue a welcome message for the new client
+    welcome = f"Connected to transcription server ({encoding})"
+    if note:
+        welcome += f" - {note}"
+    channel.offer(channel.encode({
         "type": "status",
-        "text": "Connected to transcription server",
+        "text": welcome,
         "is_final": True
-    }))
+    }), True)
+    
+    # Catch up on what was said before the client joined, in one message
+    request = request_from_path(websocket_path(websocket))
+    if request is not None:
+        send_history(channel, request)
     
     try:
-        # Keep the connection open and wait for messages from the client
-        # In this case, we don't expect messages from clients, but we need to keep the connection alive
+        # Keep the connection open and answer history requests
         async for message in websocket:
-            # If the client sends a message, we could handle it here
-            # For now, we just ignore it
-            pass
+            try:
+                data = json.loads(message)
+            except (json.JSONDecodeError, TypeError):
+                continue
+            if isinstance(data, dict) and data.get("type") == "history":
+                send_history(channel, data)
     except websockets.exceptions.ConnectionClosed:
         # This happens when the client disconnects normally
         pass
     finally:
-        # Remove this client from our set when they disconnect
-        connected_clients.discard(websocket)
+        # Remove this client from the fan-out when they disconnect
+        stats = await connected_clients.remove(websocket)
         print(f"✗ Client disconnected from {client_ip} (Total clients: {len(connected_clients)})")
+        if stats:
+            print(f"   Sent: {stats['sent']}, dropped: {stats['dropped']}, max lag: {stats['max_lag_ms']} ms")
 
-async def start_websocket_server():
+async def start_websocket_server(handler=websocket_handler, compression=WEBSOCKET_COMPRESSION):
     """
     Start the WebSocket server.
     This creates a server that listens for WebSocket connections.
+    
+    Parameters:
+    - handler: Function to call when a client connects
+    - compression: "deflate" to accept permessage-deflate, None to disable it
     """
     
     # Create and start the WebSocket server
-    # websocket_handler: Function to call when a client connects
+    # handler: Function to call when a client connects
     # WEBSOCKET_HOST: IP address to listen on (0.0.0.0 means all interfaces)
     # WEBSOCKET_PORT: Port number to listen on
-    server = await websockets.serve(websocket_handler, WEBSOCKET_HOST, WEBSOCKET_PORT)
+    server = await websockets.serve(handler, WEBSOCKET_HOST, WEBSOCKET_PORT, compression=compression)
     
     # Print a message showing the server is running
     print(f"🌐 WebSocket server started on ws://{WEBSOCKET_HOST}:{WEBSOCKET_PORT}")
     print(f"   Clients can connect using: ws://localhost:{WEBSOCKET_PORT}")
+    print(f"   Encodings: {', '.join(available_encodings())} (?encoding=...), "
+          f"permessage-deflate: {'on' if compression else 'off'}")
     
     # Keep the server running forever
     await asyncio.Future()  # This creates a future that never completes
 
-def transcription_worker(audio_queue, stop_event, loop):
+def make_voice_gate():
+    """
+    Create a voice-activity gate.
+    NumPy is imported only when VAD is enabled.
+    """
+    from voice_activity import VoiceActivityGate
+    return VoiceActivityGate(
+        sample_rate=SAMPLE_RATE,
+        energy_threshold=VAD_ENERGY_THRESHOLD,
+        hangover_ms=VAD_HANGOVER_MS,
+        preroll_ms=VAD_PREROLL_MS,
+        keepalive_interval=VAD_KEEPALIVE_INTERVAL
+    )
+
+async def asr_session_handler(websocket, scheduler, worker, gate_factory=None):
+    """
+    Handle a client in server mode: the client streams its own audio
+    and receives its own transcript.
+    
+    Parameters:
+    - websocket: The WebSocket connection object
+    - scheduler: SessionScheduler shared by all clients
+    - worker: Transcription worker run in a thread for each Riva stream
+    - gate_factory: Creates a voice-activity gate per stream (None = no VAD)
+    
+    Protocol:
+    - Binary messages: 16-bit mono PCM audio at SAMPLE_RATE
+    - Text message {"type": "stop"}: end the current utterance stream
+    """
+    
+    # Each client has its own bounded outbound queue, in its own encoding
+    encoding, note = negotiate(websocket_path(websocket))
+    channel = ClientChannel(
+        websocket, CLIENT_QUEUE_SIZE, SLOW_CLIENT_POLICY, SLOW_CLIENT_BLOCK_TIMEOUT, encoding,
+        SEND_LATENCY
+    ).start()
+    session = ASRSession(
+        channel, scheduler, worker, asyncio.get_running_loop(),
+        frame_bytes=CHUNK_BYTES, max_frames=AUDIO_BUFFER_FRAMES,
+        gate_factory=gate_factory
+    )
+    
+    client_ip = websocket.remote_address[0] if websocket.remote_address else "unknown"
+    print(f"✓ Session {session.id} opened from {client_ip} ({scheduler.stats()})")
+    welcome = f"Connected to transcription server ({encoding}) - send PCM audio"
+    if note:
+        welcome += f" - {note}"
+    await session.publish("status", welcome, True)
+    
+    try:
+        async for message in websocket:
+            if isinstance(message, bytes):
+                # Audio frame: opens a Riva stream on first use
+                try:
+                    await session.feed(message)
+                except SessionRejected as e:
+                    await session.publish("error", str(e), True)
+                    await websocket.close(1013, str(e))
+                    break
+            else:
+                # Control message
+                try:
+                    data = json.loads(message)
+                except json.JSONDecodeError:
+                    continue
+                if data.get("type") == "stop":
+                    session.stop_stream("client request")
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    finally:
+        session.close()
+        await channel.stop()
+        print(f"✗ Session {session.id} closed ({scheduler.stats()})")
+
+def transcription_worker(audio_buffer, stop_event, loop, publish=broadcast_transcription,
+                         asr_service=None, correct_transcript=None, label=None):
     """
     Fonction principale de transcription avec support des noms propres.
     
     Cette fonction :
     1. Se connecte à Riva
     2. Configure les Speech Hints pour les noms personnalisés
-    3. Lit l'audio depuis la queue
+    3. Lit l'audio depuis le tampon circulaire
     4. Envoie l'audio à Riva pour transcription
     5. Applique des corrections post-transcription
     6. Diffuse les résultats via WebSocket
     
     Paramètres:
-        audio_queue: Queue contenant les blocs audio du microphone
+        audio_buffer: AudioRingBuffer contenant les blocs audio du microphone
         stop_event: Event pour signaler l'arrêt
         loop: Boucle d'événements asyncio pour WebSocket
+        publish: Coroutine de diffusion (par défaut : tous les clients)
+        asr_service: Service ASR Riva partagé (sinon une connexion est créée)
+        correct_transcript: Correcteur partagé (sinon un correcteur est créé)
+        label: Nom de la session dans les logs (mode serveur)
     """
     
     # ===== CONNEXION À RIVA =====
-    print("🔌 Connexion au serveur Riva...")
-    auth = riva.client.Auth(uri=RIVA_SERVER)
-    asr_service = riva.client.ASRService(auth)
-    print("✅ Connecté à Riva")
+    if asr_service is None:
+        print("🔌 Connexion au serveur Riva...")
+        auth = riva.client.Auth(uri=RIVA_SERVER)
+        asr_service = riva.client.ASRService(auth)
+        print("✅ Connecté à Riva")
     
     # ===== VOCABULAIRE PERSONNALISÉ =====
     # Liste de mots/noms que le modèle doit mieux reconnaître
@@ -174,47 +402,22 @@ def transcription_worker(audio_queue, stop_event, loop):
         # Ajoutez ici tous vos noms propres personnalisés
     ]
     
-    print(f"📝 Vocabulaire personnalisé chargé: {', '.join(custom_vocabulary)}")
-    
-    # ===== DICTIONNAIRE DE CORRECTIONS POST-TRANSCRIPTION =====
-    # Si le modèle transcrit mal, on corrige après
-    corrections = {
-        # Pattern regex → Remplacement
-        r'\bou\s*dores?-?là\b': 'Houda',
-        r'\bou\s*da\b': 'Houda',
-        r'\boda\b': 'Houda',
-        r'\boh\s*da\b': 'Houda',
-        r'\bhoda\b': 'Houda',
-        r'\bhooda\b': 'Houda',
-        r'\bdores?\b': 'Houda',
-        r'\bwhere\s*d\.?\b': 'Houda',
-        r'\bdon\.?\b': 'Houda',
-        r'\bon\.?\b': 'Houda',
-        # Ajoutez d'autres corrections ici si nécessaire
-    }
+    if label is None:
+        print(f"📝 Vocabulaire personnalisé chargé: {', '.join(custom_vocabulary)}")
     
-    def correct_transcript(text):
-        """
-        Applique les corrections au texte transcrit.
-        
-        Paramètres:
-            text (str): Texte original transcrit par Riva
-        
-        Retourne:
-            str: Texte corrigé
-        """
-        corrected = text
-        
-        # Appliquer chaque règle de correction
-        for pattern, replacement in corrections.items():
-            corrected = re.sub(
-                pattern, 
-                replacement, 
-                corrected, 
-                flags=re.IGNORECASE  # Insensible à la casse
-            )
-        
-        return corrected
+    # ===== CORRECTIONS POST-TRANSCRIPTION =====
+    # Si le modèle transcrit mal, on corrige après.
+    # Les règles sont lues depuis CORRECTIONS_FILE, compilées une seule fois
+    # en un automate unique, et rechargées à chaud quand le fichier change.
+    owns_corrector = correct_transcript is None
+    if owns_corrector:
+        correct_transcript = CorrectionRulesWatcher(CORRECTIONS_FILE).start()
+    
+    # ===== DIFFUSION DES RÉSULTATS =====
+    # Seul le résultat provisoire le plus récent est conservé et diffusé
+    # au plus toutes les INTERIM_FLUSH_INTERVAL secondes ; les résultats
+    # finaux sont diffusés immédiatement
+    coalescer = InterimCoalescer(loop, publish, INTERIM_FLUSH_INTERVAL)
     
     # ===== CONFIGURATION DE LA RECONNAISSANCE VOCALE =====
     config = riva.client.StreamingRecognitionConfig(
@@ -255,33 +458,39 @@ def transcription_worker(audio_queue, stop_event, loop):
         interim_results=True,
     )
     
-    # ===== GÉNÉRATEUR AUDIO =====
-    def audio_generator():
-        """
-        Générateur qui fournit des blocs audio à Riva.
-        
-        Yields:
-            bytes: Blocs audio capturés du microphone
-        """
-        while not stop_event.is_set():
-            try:
-                # Récupérer un bloc audio de la queue
-                chunk = audio_queue.get(timeout=0.1)
-                
-                # None = signal d'arrêt
-                if chunk is None:
-                    break
-                
-                # Retourner le bloc audio
-                yield chunk
-                
-            except queue.Empty:
-                # Queue vide, continuer
-                continue
+    # ===== FLUX RIVA RENOUVELABLE =====
+    # Le flux est renouvelé avant la limite de durée du serveur, et rouvert
+    # après une erreur ; l'audio pas encore confirmé par un résultat final
+    # est rejoué dans le nouveau flux, sans dupliquer les finaux déjà diffusés
+    def on_stream_event(kind, message):
+        prefix = f"[{label}] " if label is not None else "\n"
+        print(f"{prefix}🔄 {message}")
+        asyncio.run_coroutine_threadsafe(publish("status", message, True), loop)
+    
+    recognizer = RollingRecognizer(
+        asr_service,
+        config,
+        audio_buffer,
+        stop_event,
+        SAMPLE_RATE,
+        soft_limit=STREAM_SOFT_LIMIT,
+        hard_limit=STREAM_HARD_LIMIT,
+        replay_seconds=REPLAY_BUFFER_SECONDS,
+        on_event=on_stream_event,
+        queue_depth=AUDIO_QUEUE_DEPTH
+    )
+    
+    # ===== MESURES DE LATENCE =====
+    # Chaque bloc audio est horodaté à la capture (time.monotonic) ;
+    # recognizer.last_capture_time donne l'instant de capture du dernier
+    # échantillon couvert par le résultat reçu
+    awaiting_first_interim = True  # Prochain provisoire = premier de l'énoncé
+    last_interim_text = None
+    speech_end_at = None  # Capture du dernier mot entendu (dernier provisoire modifié)
     
     # ===== MESSAGE DE DÉMARRAGE =====
     asyncio.run_coroutine_threadsafe(
-        broadcast_transcription(
+        publish(
             "status", 
             "Transcription démarrée avec corrections personnalisées", 
             True
@@ -289,85 +498,86 @@ def transcription_worker(audio_queue, stop_event, loop):
         loop
     )
     
-    print("🎤 Transcription en cours... Parlez maintenant!")
-    print("💡 Astuce: Dites 'Houda' pour tester la reconnaissance des noms propres")
-    print("💡 Les corrections automatiques sont actives\n")
+    if label is None:
+        print("🎤 Transcription en cours... Parlez maintenant!")
+        print("💡 Astuce: Dites 'Houda' pour tester la reconnaissance des noms propres")
+        print("💡 Les corrections automatiques sont actives\n")
+    else:
+        print(f"🎤 [{label}] Flux Riva ouvert")
     
     # ===== BOUCLE PRINCIPALE DE TRANSCRIPTION =====
     try:
         # Démarrer la reconnaissance vocale en streaming
-        responses = asr_service.streaming_response_generator(
-            audio_chunks=audio_generator(),
-            streaming_config=config
-        )
-        
-        # Traiter chaque réponse de Riva
-        for response in responses:
-            # Ignorer les réponses vides
-            if not response.results:
+        # (les flux successifs sont enchaînés par le RollingRecognizer)
+        for result in recognizer.results():
+            # Ignorer si pas d'alternatives
+            if not result.alternatives:
                 continue
             
-            # Traiter chaque résultat
-            for result in response.results:
-                # Ignorer si pas d'alternatives
-                if not result.alternatives:
-                    continue
+            received_at = time.monotonic()
+            captured_at = recognizer.last_capture_time
+            
+            # ===== EXTRACTION DU TEXTE =====
+            # Texte original transcrit par Riva
+            transcript_original = result.alternatives[0].transcript
+            
+            # Score de confiance (0.0 à 1.0)
+            confidence = result.alternatives[0].confidence
+            
+            # ===== CORRECTION POST-TRANSCRIPTION =====
+            correction_start = time.perf_counter()
+            transcript_corrected = correct_transcript(transcript_original)
+            CORRECTION_TIME.observe(time.perf_counter() - correction_start)
+            
+            # ===== VÉRIFIER SI FINAL OU PROVISOIRE =====
+            if result.is_final:
+                # ===== RÉSULTAT FINAL =====
+                speech_end_at = speech_end_at or captured_at
+                if speech_end_at is not None:
+                    END_OF_SPEECH_TO_FINAL.observe(received_at - speech_end_at)
+                awaiting_first_interim = True
+                last_interim_text = None
+                speech_end_at = None
                 
-                # ===== EXTRACTION DU TEXTE =====
-                # Texte original transcrit par Riva
-                transcript_original = result.alternatives[0].transcript
+                # Si correction appliquée, afficher les deux versions
+                if label is not None:
+                    # Mode serveur : une ligne par résultat final et par session
+                    print(f"✅ [{label}] {transcript_corrected}")
+                elif transcript_corrected != transcript_original:
+                    print(f"\n🔍 ORIGINAL : {transcript_original}")
+                    print(f"✅ CORRIGÉ  : {transcript_corrected}")
+                    if confidence > 0:
+                        print(f"   Confiance: {confidence:.2f}")
+                else:
+                    # Pas de correction nécessaire
+                    print(f"\n✅ FINAL: {transcript_corrected}")
+                    if confidence > 0:
+                        print(f"   Confiance: {confidence:.2f}")
                 
-                # Score de confiance (0.0 à 1.0)
-                confidence = result.alternatives[0].confidence
+                # Diffuser via WebSocket (texte corrigé, immédiatement)
+                coalescer.submit(transcript_corrected, True)
                 
-                # ===== CORRECTION POST-TRANSCRIPTION =====
-                transcript_corrected = correct_transcript(transcript_original)
+            else:
+                # ===== RÉSULTAT PROVISOIRE =====
+                if captured_at is not None:
+                    if awaiting_first_interim:
+                        CAPTURE_TO_FIRST_INTERIM.observe(received_at - captured_at)
+                        awaiting_first_interim = False
+                    if transcript_original != last_interim_text:
+                        speech_end_at = captured_at
+                last_interim_text = transcript_original
                 
-                # ===== VÉRIFIER SI FINAL OU PROVISOIRE =====
-                if result.is_final:
-                    # ===== RÉSULTAT FINAL =====
-                    
-                    # Si correction appliquée, afficher les deux versions
-                    if transcript_corrected != transcript_original:
-                        print(f"\n🔍 ORIGINAL : {transcript_original}")
-                        print(f"✅ CORRIGÉ  : {transcript_corrected}")
-                        if confidence > 0:
-                            print(f"   Confiance: {confidence:.2f}")
-                    else:
-                        # Pas de correction nécessaire
-                        print(f"\n✅ FINAL: {transcript_corrected}")
-                        if confidence > 0:
-                            print(f"   Confiance: {confidence:.2f}")
-                    
-                    # Diffuser via WebSocket (texte corrigé)
-                    asyncio.run_coroutine_threadsafe(
-                        broadcast_transcription(
-                            "transcription", 
-                            transcript_corrected, 
-                            True
-                        ),
-                        loop
-                    )
-                    
-                else:
-                    # ===== RÉSULTAT PROVISOIRE =====
-                    
-                    # Afficher sur la même ligne (écrase la précédente)
+                # Afficher sur la même ligne (écrase la précédente)
+                # (mode microphone uniquement : illisible avec plusieurs sessions)
+                if label is None:
                     print(
                         f"💬 provisoire: {transcript_corrected}          ", 
                         end='\r',  # Retour chariot sans nouvelle ligne
                         flush=True  # Forcer l'affichage immédiat
                     )
-                    
-                    # Diffuser via WebSocket (texte corrigé)
-                    asyncio.run_coroutine_threadsafe(
-                        broadcast_transcription(
-                            "transcription", 
-                            transcript_corrected, 
-                            False
-                        ),
-                        loop
-                    )
+                
+                # Diffuser via WebSocket (texte corrigé, regroupé)
+                coalescer.submit(transcript_corrected, False)
     
     except KeyboardInterrupt:
         # Interruption manuelle
@@ -380,23 +590,36 @@ def transcription_worker(audio_queue, stop_event, loop):
         
         # Diffuser l'erreur aux clients WebSocket
         asyncio.run_coroutine_threadsafe(
-            broadcast_transcription("error", error_msg, True),
+            publish("error", error_msg, True),
             loop
         )
     
     finally:
         # ===== NETTOYAGE =====
-        print("\n🛑 Arrêt de la transcription")
+        if owns_corrector:
+            correct_transcript.stop()
+        stats = coalescer.stats()
+        buffer_stats = audio_buffer.stats()
+        stream_stats = recognizer.stats()
+        prefix = f"[{label}] " if label is not None else "\n"
+        print(f"{prefix}📊 Provisoires: {stats['interims_received']} reçus, {stats['interims_sent']} diffusés")
+        print(f"{prefix}📊 Audio: {buffer_stats['frames_read']} blocs envoyés, "
+              f"{buffer_stats['overflow_frames']} perdus (tampon plein)")
+        print(f"{prefix}📊 Flux Riva: {stream_stats['streams_opened']} ouverts, "
+              f"{stream_stats['rollovers']} renouvelés, {stream_stats['reconnects']} reconnexions, "
+              f"{stream_stats['duplicates_skipped']} finaux en double ignorés")
+        print(f"{prefix}🛑 Arrêt de la transcription")
 
 
-def capture_audio(audio_queue, stop_event):
+def capture_audio(audio_buffer, stop_event, voice_gate=None):
     """
-    Capture audio from the microphone and put it in the queue.
+    Capture audio from the microphone and copy it into the ring buffer.
     This runs in a separate thread.
     
     Parameters:
-    - audio_queue: Queue to put captured audio chunks into
+    - audio_buffer: AudioRingBuffer to copy captured audio chunks into
     - stop_event: Event to signal when to stop capturing
+    - voice_gate: Optional VoiceActivityGate (silence is not sent to Riva)
     """
     
     # Initialize PyAudio
@@ -419,8 +642,15 @@ def capture_audio(audio_queue, stop_event):
             # Read audio data from microphone
             data = stream.read(CHUNK_SIZE, exception_on_overflow=False)
             
-            # Put the audio in the queue for transcription
-            audio_queue.put(data)
+            # Without VAD every chunk goes to Riva; with VAD only speech
+            # (plus pre-roll, hangover and occasional keep-alive frames)
+            chunks = voice_gate.process(data) if voice_gate is not None else (data,)
+            
+            # Copy the audio into the next free slot of the ring buffer
+            # (if Riva stalls, the oldest audio is overwritten: memory stays bounded)
+            for chunk in chunks:
+                if audio_buffer.write(chunk):
+                    print(f"⚠️  Audio buffer full: {audio_buffer.overflow_frames} chunks dropped so far")
         except Exception as e:
             print(f"Error capturing audio: {e}")
             break
@@ -430,14 +660,42 @@ def capture_audio(audio_queue, stop_event):
     stream.close()
     audio.terminate()
     print("🎤 Microphone stopped")
+    if voice_gate is not None:
+        stats = voice_gate.stats()
+        print(f"🔇 VAD: {stats['suppressed_ratio']:.0%} of {stats['audio_seconds']}s not sent to Riva")
+
+async def start_metrics_server(port=METRICS_PORT):
+    """
+    Serve the latency histograms in Prometheus format next to the WebSocket server.
+    
+    Parameters:
+    - port: HTTP port (0 = disabled)
+    """
+    if not port:
+        return None
+    server = await serve_metrics(metrics, WEBSOCKET_HOST, port)
+    print(f"📈 Metrics available on http://localhost:{port}/metrics")
+    return server
 
-async def main_async():
+async def main_async(vad=VAD_ENABLED, compression=WEBSOCKET_COMPRESSION, metrics_port=METRICS_PORT,
+                     history_dir=HISTORY_DIR):
     """
     Main asynchronous function that coordinates everything.
+    
+    Parameters:
+    - vad: Gate the microphone with voice-activity detection
+    - compression: permessage-deflate setting of the WebSocket server
+    - metrics_port: Port of the Prometheus /metrics endpoint (0 = disabled)
+    - history_dir: Directory of the on-disk history log (None = memory only)
     """
     
-    # Create a queue for audio data
-    audio_queue = queue.Queue()
+    # Persist the finals so late joiners can catch up, even across restarts
+    if history_dir:
+        transcript_history.open_log(history_dir)
+        print(f"🗂️  History log: {history_dir} ({len(transcript_history)} finals reloaded)")
+    
+    # Create a bounded, preallocated ring buffer for audio data
+    audio_buffer = AudioRingBuffer(CHUNK_BYTES, AUDIO_BUFFER_FRAMES, AUDIO_OVERFLOW_POLICY)
     
     # Create an event to signal when to stop
     stop_event = threading.Event()
@@ -445,13 +703,14 @@ async def main_async():
     # Get the current asyncio event loop
     loop = asyncio.get_event_loop()
     
-    # Start the WebSocket server (runs in the background)
-    websocket_task = asyncio.create_task(start_websocket_server())
+    # Start the metrics endpoint and the WebSocket server (runs in the background)
+    metrics_server = await start_metrics_server(metrics_port)
+    websocket_task = asyncio.create_task(start_websocket_server(compression=compression))
     
     # Start audio capture in a separate thread
     capture_thread = threading.Thread(
         target=capture_audio,
-        args=(audio_queue, stop_event),
+        args=(audio_buffer, stop_event, make_voice_gate() if vad else None),
         daemon=True
     )
     capture_thread.start()
@@ -459,7 +718,7 @@ async def main_async():
     # Start transcription worker in a separate thread
     transcription_thread = threading.Thread(
         target=transcription_worker,
-        args=(audio_queue, stop_event, loop),
+        args=(audio_buffer, stop_event, loop),
         daemon=True
     )
     transcription_thread.start()
@@ -481,26 +740,120 @@ async def main_async():
         # Signal all threads to stop
         stop_event.set()
         
-        # Put None in queue to signal generator to stop
-        audio_queue.put(None)
+        # Close the buffer to wake the generator and make it stop
+        audio_buffer.close()
         
         # Wait a bit for threads to finish
         capture_thread.join(timeout=1)
         transcription_thread.join(timeout=1)
         
         # Close all WebSocket connections
-        for client in list(connected_clients):
-            await client.close()
+        await connected_clients.close_all()
+        if metrics_server is not None:
+            metrics_server.close()
+        transcript_history.close()
         
         print("Shutdown complete!")
 
+async def server_main_async(args):
+    """
+    Multi-session server mode: every client streams its own audio
+    and gets its own Riva stream and transcript.
+    """
+    
+    # One Riva connection and one correction engine shared by all sessions
+    # (gRPC multiplexes the streams over the same connection)
+    print("🔌 Connexion au serveur Riva...")
+    auth = riva.client.Auth(uri=RIVA_SERVER)
+    asr_service = riva.client.ASRService(auth)
+    print("✅ Connecté à Riva")
+    corrector = CorrectionRulesWatcher(CORRECTIONS_FILE).start()
+    
+    worker = functools.partial(
+        transcription_worker,
+        asr_service=asr_service,
+        correct_transcript=corrector
+    )
+    
+    # Cap concurrent gRPC streams, queue or reject past capacity, reap idle streams
+    scheduler = SessionScheduler(
+        max_sessions=args.max_sessions,
+        max_waiting=args.max_waiting,
+        queue_timeout=SESSION_QUEUE_TIMEOUT,
+        idle_timeout=args.idle_timeout
+    )
+    reaper_task = asyncio.create_task(scheduler.reap_idle_streams())
+    metrics_server = await start_metrics_server(args.metrics_port)
+    
+    gate_factory = make_voice_gate if args.vad else None
+    
+    async def handler(websocket):
+        await asr_session_handler(websocket, scheduler, worker, gate_factory)
+    
+    print("\n" + "=" * 60)
+    print("Multi-session Transcription Server")
+    print("=" * 60)
+    print(f"WebSocket URL: ws://localhost:{WEBSOCKET_PORT}")
+    print(f"Audio: 16-bit mono PCM at {SAMPLE_RATE} Hz, sent as binary messages")
+    print(f"Max concurrent streams: {args.max_sessions} (+{args.max_waiting} waiting)")
+    print("Press Ctrl+C to stop")
+    print("=" * 60 + "\n")
+    
+    try:
+        await start_websocket_server(handler, args.compression)
+    finally:
+        reaper_task.cancel()
+        if metrics_server is not None:
+            metrics_server.close()
+        for stream in list(scheduler.active):
+            stream.stop("server shutdown")
+        corrector.stop()
+        print("Shutdown complete!")
+
+def parse_args():
+    """
+    Parse command line options.
+    """
+    parser = argparse.ArgumentParser(
+        description="Real-time transcription with Riva and WebSocket",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["mic", "server"],
+        default="mic",
+        help="mic: transcribe the local microphone and broadcast to every client. "
+        "server: each client streams its own audio and gets its own transcript.",
+    )
+    parser.add_argument("--max-sessions", type=int, default=MAX_SESSIONS, help="Maximum concurrent Riva streams (server mode).")
+    parser.add_argument("--max-waiting", type=int, default=MAX_WAITING_SESSIONS, help="Sessions allowed to wait for a free stream (server mode).")
+    parser.add_argument("--idle-timeout", type=float, default=SESSION_IDLE_TIMEOUT, help="Seconds without speech before a stream is closed (server mode).")
+    parser.add_argument("--vad", action="store_true", default=VAD_ENABLED, help="Do not send silence to Riva (voice-activity gating, requires numpy).")
+    parser.add_argument(
+        "--compression",
+        choices=["deflate", "none"],
+        default=WEBSOCKET_COMPRESSION or "none",
+        help="permessage-deflate for clients that offer it (costs CPU per message and per client).",
+    )
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="Port of the Prometheus /metrics endpoint (0 to disable).")
+    parser.add_argument("--history-dir", default=HISTORY_DIR, help="Keep the finals in an on-disk log in this directory (mic mode).")
+    args = parser.parse_args()
+    if args.compression == "none":
+        args.compression = None
+    return args
+
 def main():
     """
     Entry point of the program.
     """
+    args = parse_args()
     try:
         # Run the async main function
-        asyncio.run(main_async())
+        if args.mode == "server":
+            asyncio.run(server_main_async(args))
+        else:
+            asyncio.run(main_async(vad=args.vad, compression=args.compression, metrics_port=args.metrics_port,
+                                   history_dir=args.history_dir))
     except KeyboardInterrupt:
         # Handle Ctrl+C gracefully
         print("\nExiting...")
@@ -0,0 +1,246 @@
+"""
+Lazy, pooled, health-checked gRPC channels to a Riva server
+Channels are only created on first use, so importing a script does not
+depend on the server being up. A small pool of channels, each with its own
+HTTP/2 connection, is handed out round-robin; one connection caps the number
+of concurrent streams and serializes large responses. Channels send
+keepalive pings, are health-checked periodically (grpc.health.v1 when
+grpcio-health-checking is installed, channel readiness otherwise) and are
+replaced after repeated failures.
+"""
+
+# Import Riva client library for the authenticated channels and services
+import riva.client
+
+# Import grpc for the channel options and connectivity states
+import grpc
+
+# Import itertools for the round-robin counter
+import itertools
+
+# Import threading: the pool is used from the synthesis threads
+import threading
+
+# Import time to date the health checks
+import time
+
+# grpc.health.v1 stubs are optional (pip install grpcio-health-checking)
+try:
+    from grpc_health.v1 import health_pb2, health_pb2_grpc
+except ImportError:
+    health_pb2 = health_pb2_grpc = None
+
+
+def channel_lost(error):
+    """
+    True if an RPC failed because its channel went away (closed by the pool
+    when it replaced it, or connection lost): the call can be sent again on
+    another channel.
+    """
+    if not isinstance(error, grpc.RpcError) or not hasattr(error, "code"):
+        return False
+    code = error.code()
+    return code == grpc.StatusCode.UNAVAILABLE or (
+        code == grpc.StatusCode.CANCELLED and "Channel closed" in (error.details() or "")
+    )
+
+
+def channel_options(keepalive_ms):
+    """Channel arguments: keepalive pings, and a connection of its own for each channel."""
+    return [
+        ("grpc.keepalive_time_ms", keepalive_ms),
+        ("grpc.keepalive_timeout_ms", 10000),
+        ("grpc.keepalive_permit_without_calls", 1),
+        ("grpc.http2.max_pings_without_data", 0),
+        # Without this, channels with identical arguments share one subchannel (one connection)
+        ("grpc.use_local_subchannel_pool", 1),
+    ]
+
+
+def create_auth(uri, options):
+    """riva.client.Auth whose channel uses the given options."""
+    try:
+        return riva.client.Auth(uri=uri, options=options)
+    except TypeError:
+        # Older riva clients build the channel without options: replace it
+        auth = riva.client.Auth(uri=uri)
+        auth.channel.close()
+        auth.channel = grpc.insecure_channel(uri, options=options)
+        return auth
+
+
+class _Member:
+    """One channel of the pool and the service bound to it."""
+
+    def __init__(self, index, auth, service):
+        self.index = index
+        self.auth = auth
+        self.service = service
+        self.state = None  # Last grpc.ChannelConnectivity reported
+        self.healthy = None  # None until the first check or connection
+        self.failures = 0  # Consecutive failed health checks
+        self.checked_at = None
+        self.callback = None
+
+
+class RivaChannelPool:
+    """
+    Round-robin pool of Riva service clients, each on its own channel.
+
+    Parameters:
+    - uri: Riva server address
+    - service_factory: Service class built on each channel (e.g. riva.client.SpeechSynthesisService)
+    - size: Number of channels
+    - keepalive_ms: Interval of the keepalive pings
+    - health_interval: Seconds between health checks (0 = no periodic checks)
+    - health_timeout: Timeout of one health check
+    - max_failures: Consecutive failed checks after which a channel is recreated
+    - on_ready: Called (from a gRPC or health thread) when the pool is ready again after an outage
+    """
+
+    def __init__(self, uri, service_factory, size=2, keepalive_ms=30000, health_interval=10.0,
+                 health_timeout=2.0, max_failures=3, on_ready=None):
+        self.uri = uri
+        self.service_factory = service_factory
+        self.size = size
+        self.options = channel_options(keepalive_ms)
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.max_failures = max_failures
+        self.on_ready = on_ready
+
+        self._members = None
+        self._lock = threading.RLock()  # Connectivity callbacks may fire while _start holds it
+        self._counter = itertools.count()
+        self._stop = threading.Event()
+        self._health_thread = None
+        self._lost = False  # No healthy channel since the last outage
+
+        # Counters
+        self.reconnects = 0
+        self.health_checks = 0
+        self.failed_checks = 0
+
+    def _connect(self, index):
+        auth = create_auth(self.uri, self.options)
+        member = _Member(index, auth, self.service_factory(auth))
+        member.callback = lambda state: self._on_connectivity(member, state)
+        # try_to_connect: the connection is opened in the background, not on the first RPC
+        auth.channel.subscribe(member.callback, try_to_connect=True)
+        return member
+
+    def _start(self):
+        """Create the channels (first use only)."""
+        with self._lock:
+            if self._members is not None:
+                return
+            self._members = [self._connect(i) for i in range(self.size)]
+            if self.health_interval:
+                self._health_thread = threading.Thread(
+                    target=self._health_loop, name="riva-health", daemon=True
+                )
+                self._health_thread.start()
+
+    def get(self):
+        """
+        Next service client, round-robin over the healthy channels
+        (over all channels if none is known to be healthy).
+        """
+        if self._members is None:
+            self._start()
+        members = self._members
+        healthy = [m for m in members if m.healthy is not False]
+        candidates = healthy or members
+        return candidates[next(self._counter) % len(candidates)].service
+
+    @property
+    def ready(self):
+        """True if at least one channel is healthy."""
+        return self._members is not None and any(m.healthy for m in self._members)
+
+    def _on_connectivity(self, member, state):
+        member.state = state
+        if state == grpc.ChannelConnectivity.READY:
+            member.healthy = True
+        elif state in (grpc.ChannelConnectivity.TRANSIENT_FAILURE, grpc.ChannelConnectivity.SHUTDOWN):
+            member.healthy = False
+        self._update_ready()
+
+    def _update_ready(self):
+        notify = False
+        with self._lock:
+            if self._members is None:
+                return
+            if self.ready and self._lost:
+                self._lost = False
+                notify = True
+            elif not self.ready and any(m.healthy is False for m in self._members):
+                self._lost = True
+        if notify and self.on_ready is not None:
+            self.on_ready()
+
+    def _check(self, member):
+        """One health check of a channel (blocking)."""
+        channel = member.auth.channel
+        if health_pb2 is not None:
+            response = health_pb2_grpc.HealthStub(channel).Check(
+                health_pb2.HealthCheckRequest(service=""), timeout=self.health_timeout
+            )
+            return response.status == health_pb2.HealthCheckResponse.SERVING
+        grpc.channel_ready_future(channel).result(timeout=self.health_timeout)
+        return True
+
+    def check_health(self):
+        """Check every channel now; recreate those that failed max_failures times in a row."""
+        if self._members is None:
+            self._start()
+        for member in list(self._members):
+            self.health_checks += 1
+            try:
+                healthy = self._check(member)
+            except Exception:
+                healthy = False
+            member.checked_at = time.time()
+            member.healthy = healthy
+            if healthy:
+                member.failures = 0
+                continue
+            self.failed_checks += 1
+            member.failures += 1
+            if member.failures >= self.max_failures:
+                self._replace(member)
+        self._update_ready()
+
+    def _replace(self, member):
+        """Close a failing channel and open a fresh one in its place."""
+        replacement = self._connect(member.index)
+        with self._lock:
+            self._members[member.index] = replacement
+        member.auth.channel.unsubscribe(member.callback)
+        # RPCs still running on it fail with CANCELLED ("Channel closed"): see channel_lost()
+        member.auth.channel.close()
+        self.reconnects += 1
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            members, self._members = self._members or [], None
+        for member in members:
+            member.auth.channel.unsubscribe(member.callback)
+            member.auth.channel.close()
+
+    def stats(self):
+        members = self._members or []
+        return {
+            "ready": self.ready,
+            "channels": len(members),
+            "healthy": sum(bool(m.healthy) for m in members),
+            "states": [m.state.name if m.state is not None else None for m in members],
+            "reconnects": self.reconnects,
+            "health_checks": self.health_checks,
+            "failed_checks": self.failed_checks,
+        }
@@ -0,0 +1,270 @@
+"""
+Flux Riva sans interruption : renouvellement et reconnexion automatiques
+Un flux de reconnexion est renouvelé de lui-même avant une limite de durée
+côté serveur, ou rouvert immédiatement après une erreur. L'audio envoyé mais
+pas encore couvert par un résultat final est conservé dans un tampon borné
+et rejoué dans le nouveau flux ; les résultats finaux déjà diffusés ne sont
+jamais dupliqués à la jointure.
+
+Chaque bloc lu dans le tampon circulaire est copié une fois en bytes
+(protobuf n'accepte pas de memoryview) ; cette copie est celle que garde le
+tampon de rejeu. Le chemin de l'audio n'est donc pas sans copie : il fait
+exactement une copie par bloc.
+"""
+
+# Import deque pour le tampon de rejeu
+from collections import deque
+
+# Import threading : le tampon est alimenté par le thread gRPC
+# et acquitté par le thread de transcription
+import threading
+
+# Import time pour mesurer l'âge de chaque flux
+import time
+
+# Délais entre deux tentatives de reconnexion (en secondes)
+DEFAULT_BACKOFF = (0.0, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+
+class ReplayBuffer:
+    """
+    Audio envoyé à Riva mais pas encore confirmé par un résultat final.
+
+    Chaque bloc est repéré par sa position (en échantillons) dans l'audio
+    envoyé depuis le début de la session, tous flux confondus.
+
+    Paramètres:
+        sample_rate (int): Fréquence d'échantillonnage
+        max_seconds (float): Durée maximale conservée pour le rejeu
+    """
+
+    def __init__(self, sample_rate, max_seconds=10.0):
+        self.sample_rate = sample_rate
+        self.max_samples = int(sample_rate * max_seconds)
+        self._chunks = deque()  # (position du premier échantillon, bytes, instant de capture)
+        self._samples = 0
+        self._lock = threading.Lock()
+        self.next_sample = 0  # Position du prochain bloc ajouté
+        self.evicted_samples = 0  # Audio non confirmé sorti du tampon (trop ancien)
+
+    def append(self, chunk, captured_at=0.0):
+        """Mémorise un bloc qui vient d'être lu pour Riva."""
+        count = len(chunk) // 2  # 16 bits par échantillon
+        with self._lock:
+            self._chunks.append((self.next_sample, chunk, captured_at))
+            self.next_sample += count
+            self._samples += count
+            while self._samples > self.max_samples and len(self._chunks) > 1:
+                _, old, _ = self._chunks.popleft()
+                self._samples -= len(old) // 2
+                self.evicted_samples += len(old) // 2
+
+    def ack(self, position):
+        """Oublie les blocs entièrement couverts par un résultat final."""
+        with self._lock:
+            while self._chunks:
+                start, chunk, _ = self._chunks[0]
+                if start + len(chunk) // 2 > position:
+                    break
+                self._chunks.popleft()
+                self._samples -= len(chunk) // 2
+
+    def first_pending(self):
+        """Position du plus ancien échantillon non confirmé (début du prochain flux)."""
+        with self._lock:
+            return self._chunks[0][0] if self._chunks else self.next_sample
+
+    def chunks_from(self, position):
+        """Retourne les blocs [(position, bytes)] qui commencent à `position` ou après."""
+        with self._lock:
+            return [(start, chunk) for start, chunk, _ in self._chunks if start >= position]
+
+    def captured_at(self, position):
+        """Instant de capture de l'échantillon `position` (None s'il n'est plus dans le tampon)."""
+        with self._lock:
+            for start, chunk, captured_at in reversed(self._chunks):
+                if start < position:
+                    return captured_at if position <= start + len(chunk) // 2 else None
+        return None
+
+
+class _StreamState:
+    """État d'un flux Riva ouvert."""
+
+    def __init__(self, start, replayed):
+        self.start = start  # Position (échantillons) du premier bloc envoyé à ce flux
+        self.replayed = replayed  # Le flux commence par de l'audio rejoué
+        self.opened_at = time.monotonic()
+        self.ending = False  # Demande de fin (renouvellement)
+        self.input_closed = False  # Plus d'audio : fin normale de la session
+        self.finals = 0
+
+    def age(self):
+        return time.monotonic() - self.opened_at
+
+
+class RollingRecognizer:
+    """
+    Enchaîne des flux Riva pour une transcription sans fin.
+
+    Paramètres:
+        asr_service: riva.client.ASRService
+        streaming_config: StreamingRecognitionConfig utilisée pour chaque flux
+        audio_buffer: AudioRingBuffer contenant l'audio à transcrire
+        stop_event: Event pour signaler l'arrêt
+        sample_rate (int): Fréquence d'échantillonnage
+        soft_limit (float): Âge (s) à partir duquel le flux est renouvelé au prochain résultat final
+        hard_limit (float): Âge (s) auquel le flux est renouvelé même en pleine phrase
+        replay_seconds (float): Durée maximale d'audio non confirmé rejouée
+        backoff: Délais successifs entre tentatives de reconnexion
+        on_event: Appelée avec (type, message) à chaque renouvellement ou reconnexion
+        queue_depth: Histogramme recevant la profondeur du tampon audio à chaque lecture
+    """
+
+    def __init__(self, asr_service, streaming_config, audio_buffer, stop_event, sample_rate,
+                 soft_limit=240.0, hard_limit=290.0, replay_seconds=10.0,
+                 backoff=DEFAULT_BACKOFF, on_event=None, queue_depth=None):
+        self.asr_service = asr_service
+        self.streaming_config = streaming_config
+        self.audio_buffer = audio_buffer
+        self.stop_event = stop_event
+        self.sample_rate = sample_rate
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.backoff = backoff
+        self.on_event = on_event or (lambda kind, message: None)
+        self.replay = ReplayBuffer(sample_rate, replay_seconds)
+        self.queue_depth = queue_depth
+
+        # Instant de capture (time.monotonic) du dernier échantillon couvert
+        # par le résultat que results() vient de produire (None si inconnu)
+        self.last_capture_time = None
+
+        self._last_final_end = -1  # Fin (échantillons) du dernier résultat final diffusé
+        self._last_final_text = None
+
+        # Un seul générateur lit le tampon circulaire à la fois : après une
+        # erreur, l'ancien peut encore être bloqué dans read()
+        self._read_lock = threading.Lock()
+
+        # Compteurs
+        self.streams_opened = 0
+        self.rollovers = 0
+        self.reconnects = 0
+        self.duplicates_skipped = 0
+
+    def _audio(self, stream):
+        """
+        Générateur d'audio d'un flux.
+
+        Tout bloc passe par le tampon de rejeu avant d'être envoyé : un flux
+        rouvert commence donc par l'audio non confirmé, puis enchaîne sur
+        l'audio capturé. Un bloc lu après la demande de fin n'est pas envoyé ;
+        il reste dans le tampon et ouvrira le flux suivant.
+        """
+        position = stream.start
+        while True:
+            for start, chunk in self.replay.chunks_from(position):
+                if stream.ending:
+                    return
+                position = start + len(chunk) // 2
+                yield chunk
+
+            with self._read_lock:
+                if stream.ending:
+                    return
+                frame = self.audio_buffer.read()
+                if frame is None:
+                    stream.input_closed = True
+                    return
+                # Protobuf exige des bytes : cette copie sert aussi au tampon de rejeu
+                self.replay.append(bytes(frame), self.audio_buffer.last_stamp)
+                self.audio_buffer.release()
+                if self.queue_depth is not None:
+                    self.queue_depth.observe(len(self.audio_buffer))
+
+            if stream.age() >= self.hard_limit:
+                stream.ending = True
+
+    def _is_duplicate(self, stream, result):
+        """Met à jour l'acquittement et indique si ce final a déjà été diffusé."""
+        if result.audio_processed <= 0:
+            # Serveur qui ne renseigne pas audio_processed : pas de suivi possible
+            return False
+        end = stream.start + int(result.audio_processed * self.sample_rate)
+        self.replay.ack(end)
+        text = result.alternatives[0].transcript if result.alternatives else ""
+        duplicate = end <= self._last_final_end or (
+            # Premier final d'un flux rouvert identique au dernier diffusé
+            stream.replayed and stream.finals == 0 and text == self._last_final_text
+        )
+        if not duplicate:
+            self._last_final_end = end
+            self._last_final_text = text
+        return duplicate
+
+    def results(self):
+        """
+        Itère sur les résultats Riva, d'un flux à l'autre, jusqu'à la fin de l'audio.
+
+        Yields:
+            StreamingRecognitionResult (les finaux en double sont filtrés)
+        """
+        attempt = 0
+        while not self.stop_event.is_set():
+            start = self.replay.first_pending()
+            stream = _StreamState(start, replayed=start < self.replay.next_sample)
+            self.streams_opened += 1
+
+            try:
+                responses = self.asr_service.streaming_response_generator(
+                    audio_chunks=self._audio(stream),
+                    streaming_config=self.streaming_config
+                )
+                for response in responses:
+                    for result in response.results:
+                        if result.audio_processed > 0:
+                            # Avant l'acquittement, qui retire l'audio du tampon
+                            self.last_capture_time = self.replay.captured_at(
+                                stream.start + int(result.audio_processed * self.sample_rate)
+                            )
+                        else:
+                            self.last_capture_time = None
+                        if result.is_final:
+                            if self._is_duplicate(stream, result):
+                                self.duplicates_skipped += 1
+                                continue
+                            stream.finals += 1
+                            attempt = 0
+                            # Fin d'énoncé : bon moment pour renouveler un vieux flux
+                            if stream.age() >= self.soft_limit:
+                                stream.ending = True
+                        yield result
+
+            except Exception as e:
+                # Libérer le générateur de l'ancien flux s'il attend encore de l'audio
+                stream.ending = True
+                if self.stop_event.is_set() or stream.input_closed:
+                    return
+                delay = self.backoff[min(attempt, len(self.backoff) - 1)]
+                attempt += 1
+                self.reconnects += 1
+                self.on_event("reconnect", f"Flux Riva interrompu ({e}), reconnexion dans {delay:.2f}s")
+                self.stop_event.wait(delay)
+                continue
+
+            if stream.input_closed:
+                return
+
+            # Fin demandée : renouvellement proactif
+            self.rollovers += 1
+            self.on_event("rollover", f"Flux Riva renouvelé après {stream.age():.0f}s")
+
+    def stats(self):
+        return {
+            "streams_opened": self.streams_opened,
+            "rollovers": self.rollovers,
+            "reconnects": self.reconnects,
+            "duplicates_skipped": self.duplicates_skipped,
+            "replay_evicted_seconds": round(self.replay.evicted_samples / self.sample_rate, 1),
+        }
@@ -0,0 +1,384 @@
+"""
+Moteur de corrections post-transcription
+Compile toutes les règles de correction une seule fois (mots exacts
+consécutifs fusionnés dans un seul automate regex, règles ignorées quand
+elles ne peuvent pas correspondre), charge les règles depuis un fichier
+externe et les recharge à chaud quand le fichier change.
+"""
+
+# Import re pour compiler les règles de correction
+import re
+
+# Import os pour surveiller la date de modification du fichier de règles
+import os
+
+# Import threading pour la surveillance du fichier en arrière-plan
+import threading
+
+# Règles utilisées si aucun fichier de règles n'est disponible
+# Pattern regex → Remplacement
+DEFAULT_CORRECTIONS = {
+    r'\bou\s*dores?-?là\b': 'Houda',
+    r'\bou\s*da\b': 'Houda',
+    r'\boda\b': 'Houda',
+    r'\boh\s*da\b': 'Houda',
+    r'\bhoda\b': 'Houda',
+    r'\bhooda\b': 'Houda',
+    r'\bdores?\b': 'Houda',
+    r'\bwhere\s*d\.?\b': 'Houda',
+    r'\bdon\.?\b': 'Houda',
+    r'\bon\.?\b': 'Houda',
+}
+
+# Caractères qui font d'un pattern une vraie regex (et pas un simple mot)
+_REGEX_METACHARS = set('\\.^$*+?{}[]|()')
+
+# Flags inline globaux en tête de pattern : (?i), (?x), ...
+_INLINE_FLAGS = re.compile(r'^\(\?[aiLmsux]+\)')
+
+# En dessous de ce nombre de passages, les tester tous coûte moins cher que l'index
+_INDEX_MIN_PASSES = 32
+
+# Un mot au sens de \b...\b : uniquement des caractères de mot
+_WORD = re.compile(r'\w+')
+
+# re.IGNORECASE considère « İ » et « ı » égaux à « i », ce que casefold() ne fait pas
+_IGNORECASE_FIXES = str.maketrans({'İ': 'i', 'ı': 'i'})
+
+
+def _casefold(text):
+    """Repli de casse compatible avec re.IGNORECASE (deux textes égaux pour re le restent)."""
+    if 'İ' in text or 'ı' in text:
+        text = text.translate(_IGNORECASE_FIXES)
+    return text.casefold()
+
+
+def load_rules(path):
+    """
+    Charge les règles de correction depuis un fichier texte.
+
+    Format (le même que les dictionnaires de `examples/talk.py`) :
+    une règle par ligne, le pattern et le remplacement séparés par
+    deux espaces. Les lignes vides et celles commençant par # sont ignorées.
+
+    Paramètres:
+        path (str): Chemin du fichier de règles
+
+    Retourne:
+        list: Liste ordonnée de tuples (pattern, remplacement)
+    """
+    rules = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                pattern, replacement = line.split('  ', 1)  # Séparé par deux espaces
+            except ValueError:
+                print(f"⚠️  Règle mal formée ligne {line_number}: {line}")
+                continue
+            rules.append((pattern.strip(), replacement.strip()))
+    return rules
+
+
+def _literal_word(pattern):
+    """
+    Retourne le mot si le pattern est de la forme \\bmot\\b, où mot n'est
+    fait que de caractères de mot (une correspondance est alors toujours
+    un mot entier du texte), sinon None.
+    """
+    if not (pattern.startswith(r'\b') and pattern.endswith(r'\b')):
+        return None
+    inner = pattern[2:-2]
+    if not _WORD.fullmatch(inner) or any(char in _REGEX_METACHARS for char in inner):
+        return None
+    return inner
+
+
+def _literal_prefix(pattern):
+    """
+    Préfixe littéral que toute correspondance du pattern commence par contenir.
+
+    Exemple : r'\\bdores?\\b' → 'dore'
+    Retourne '' si le pattern n'en a pas (alternative de premier niveau, flags inline...).
+    """
+    if '|' in pattern or _INLINE_FLAGS.match(pattern):
+        return ''
+    body = pattern[2:] if pattern.startswith(r'\b') else pattern
+    end = 0
+    while end < len(body) and body[end] not in _REGEX_METACHARS:
+        # Un caractère suivi d'un quantificateur n'est pas obligatoire
+        if end + 1 < len(body) and body[end + 1] in '?*+{':
+            break
+        end += 1
+    return body[:end]
+
+
+def _trie_regex(words):
+    """
+    Construit une regex factorisée par préfixes (un trie).
+
+    "hoda", "hooda" et "oda" deviennent "(?:ho(?:da|oda)|oda)" : le moteur
+    regex ne teste plus chaque mot l'un après l'autre, il descend dans
+    l'arbre et n'évalue que les suites des préfixes qui correspondent.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}  # Fin de mot
+
+    def build(node):
+        branches = [
+            re.escape(char) + build(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+        # La fin de mot en dernier : le mot le plus long est essayé d'abord
+        if '' in node:
+            branches.append('')
+        if len(branches) == 1:
+            return branches[0]
+        return '(?:' + '|'.join(branches) + ')'
+
+    return build(trie)
+
+
+class _WordPass:
+    """
+    Règles "mot exact" consécutives, appliquées en un seul passage.
+
+    Chaque correspondance est un mot entier du texte : deux mots différents
+    ne se chevauchent jamais, l'ordre des règles du groupe n'a donc pas
+    d'effet et le mot trouvé est résolu par une recherche dans un dictionnaire.
+    """
+
+    def __init__(self, flags):
+        self.flags = flags
+        self.fold = _casefold if flags & re.IGNORECASE else str
+        self.rules = {}  # mot replié → [(regex seule, remplacement), ...] dans l'ordre du fichier
+        self.words = set()  # Mots tels qu'écrits dans les règles
+        self.regex = None
+
+    def accepts(self, compiled):
+        # Un remplacement déjà dans le groupe qui contient ce mot serait re-corrigé
+        # par cette règle si elles étaient appliquées l'une après l'autre
+        return not any(compiled.search(replacement)
+                       for entries in self.rules.values() for _, replacement in entries)
+
+    def add(self, word, compiled, replacement):
+        self.rules.setdefault(self.fold(word), []).append((compiled, replacement))
+        self.words.add(word)
+
+    def keys(self):
+        return set(self.rules)
+
+    def compile(self):
+        self.regex = re.compile(r'\b' + _trie_regex(self.words) + r'\b', self.flags)
+
+    def _replace(self, match):
+        token = match.group()
+        entries = self.rules.get(self.fold(token))
+        if entries is None:
+            # Ne devrait pas arriver : tous les mots du groupe, dans l'ordre
+            entries = [entry for group in self.rules.values() for entry in group]
+        if len(entries) == 1:
+            return entries[0][1]
+        # Plusieurs mots de même repli (ex. « ß » et « ss ») : le premier qui correspond
+        for compiled, replacement in entries:
+            if compiled.fullmatch(token):
+                return replacement
+        return token
+
+    def apply(self, text):
+        return self.regex.sub(self._replace, text)
+
+
+class _RegexPass:
+    """Une règle regex, appliquée seule (comme l'ancienne boucle re.sub)."""
+
+    def __init__(self, compiled, replacement, prefix):
+        self.compiled = compiled
+        self.replacement = replacement
+        self.prefix = prefix  # Préfixe littéral replié ('' = toujours appliquée)
+
+    def apply(self, text):
+        return self.compiled.sub(self.replacement, text)
+
+
+class CompiledCorrections:
+    """
+    Ensemble de règles compilé une seule fois, appliqué dans l'ordre du fichier.
+
+    Le résultat est celui de l'ancienne boucle (un re.sub par règle, dans
+    l'ordre) :
+    - les règles "mot exact" (\\bmot\\b) consécutives sont fusionnées dans un
+      trie et résolues par une recherche dans un dictionnaire ; un groupe
+      s'arrête quand une règle pourrait re-corriger le remplacement d'une
+      règle précédente du groupe ;
+    - les autres règles sont appliquées une par une, à leur place.
+
+    Seuls les passages qui peuvent correspondre sont exécutés : un index
+    des mots du texte (groupes de mots exacts) et de ses bigrammes (préfixe
+    littéral des regex) élimine les autres avant tout appel au moteur regex.
+    """
+
+    def __init__(self, rules, flags=re.IGNORECASE):
+        # Accepter un dict {pattern: remplacement} ou une liste de tuples
+        if isinstance(rules, dict):
+            rules = list(rules.items())
+
+        self.rule_count = len(rules)
+        self._fold = _casefold if flags & re.IGNORECASE else str
+        self._passes = []
+
+        for pattern, replacement in rules:
+            # Valider chaque règle individuellement (lève re.error si invalide)
+            compiled = re.compile(pattern, flags)
+
+            word = _literal_word(pattern)
+            # Un remplacement avec échappements (\\1, \\n...) passe par re.sub
+            if word is not None and '\\' not in replacement:
+                last = self._passes[-1] if self._passes else None
+                if not (isinstance(last, _WordPass) and last.accepts(compiled)):
+                    last = _WordPass(flags)
+                    self._passes.append(last)
+                last.add(word, compiled, replacement)
+                continue
+
+            self._passes.append(_RegexPass(compiled, replacement, self._fold(_literal_prefix(pattern))))
+
+        # Index : mot replié / bigramme du préfixe → passages concernés
+        self._by_word = {}
+        self._by_bigram = {}
+        self._always = []
+        for index, step in enumerate(self._passes):
+            if isinstance(step, _WordPass):
+                step.compile()
+                for key in step.keys():
+                    self._by_word.setdefault(key, []).append(index)
+            elif len(step.prefix) >= 2:
+                self._by_bigram.setdefault(step.prefix[:2], []).append(index)
+            else:
+                self._always.append(index)
+
+    def _candidates(self, text, after):
+        """Passages d'indice > after qui peuvent correspondre au texte, dans l'ordre."""
+        folded = self._fold(text)
+        if len(self._passes) < _INDEX_MIN_PASSES:
+            return folded, range(after + 1, len(self._passes))
+        indexes = set(self._always)
+        if self._by_word:
+            tokens = {self._fold(token) for token in _WORD.findall(text)}
+            for token in tokens:
+                indexes.update(self._by_word.get(token, ()))
+        # Parcourir le plus petit des deux : bigrammes du texte ou bigrammes indexés
+        if len(self._by_bigram) < len(folded):
+            for bigram, passes in self._by_bigram.items():
+                if bigram in folded:
+                    indexes.update(passes)
+        else:
+            for position in range(len(folded) - 1):
+                indexes.update(self._by_bigram.get(folded[position:position + 2], ()))
+        return folded, sorted(index for index in indexes if index > after)
+
+    def __call__(self, text):
+        """
+        Applique toutes les corrections au texte transcrit.
+
+        Paramètres:
+            text (str): Texte original transcrit par Riva
+
+        Retourne:
+            str: Texte corrigé
+        """
+        folded, candidates = self._candidates(text, -1)
+        position = 0
+        while position < len(candidates):
+            index = candidates[position]
+            position += 1
+            step = self._passes[index]
+            if isinstance(step, _RegexPass) and step.prefix not in folded:
+                continue
+            corrected = step.apply(text)
+            if corrected != text:
+                # Le texte a changé : une règle suivante peut maintenant correspondre
+                text = corrected
+                folded, candidates = self._candidates(text, index)
+                position = 0
+        return text
+
+
+class CorrectionRulesWatcher:
+    """
+    Correcteur qui recharge ses règles à chaud.
+
+    Un thread surveille la date de modification du fichier de règles.
+    Quand elle change, le nouveau jeu de règles est compilé hors du chemin
+    critique puis remplace l'ancien en une seule affectation (atomique) :
+    le flux Riva en cours n'est jamais interrompu. Si le nouveau fichier
+    est invalide, l'ancien jeu de règles reste actif.
+    """
+
+    def __init__(self, path, fallback_rules=DEFAULT_CORRECTIONS, poll_interval=1.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._fallback_rules = fallback_rules
+        self._mtime = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.engine = CompiledCorrections(fallback_rules)
+        self.reload()
+
+    def _current_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self):
+        """
+        Recompile les règles depuis le fichier (ou les règles par défaut s'il n'existe pas).
+
+        Retourne:
+            bool: True si un nouveau jeu de règles a été installé
+        """
+        mtime = self._current_mtime()
+        try:
+            if mtime is None:
+                engine = CompiledCorrections(self._fallback_rules)
+            else:
+                engine = CompiledCorrections(load_rules(self.path))
+        except (OSError, re.error) as e:
+            print(f"⚠️  Règles de correction non rechargées ({self.path}): {e}")
+            self._mtime = mtime
+            return False
+
+        # Échange atomique : les appels en cours terminent avec l'ancien moteur
+        self.engine = engine
+        self._mtime = mtime
+        source = self.path if mtime is not None else "règles par défaut"
+        print(f"📝 {engine.rule_count} règles de correction chargées ({source})")
+        return True
+
+    def _watch(self):
+        while not self._stop_event.wait(self.poll_interval):
+            if self._current_mtime() != self._mtime:
+                self.reload()
+
+    def start(self):
+        """Démarre la surveillance du fichier de règles en arrière-plan."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Arrête la surveillance du fichier de règles."""
+        self._stop_event.set()
+
+    def __call__(self, text):
+        # Lire la référence une seule fois : pas de verrou sur le chemin critique
+        return self.engine(text)
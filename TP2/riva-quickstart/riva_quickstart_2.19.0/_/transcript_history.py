@@ -0,0 +1,288 @@
+"""
+History of final transcriptions for late-joining clients
+Finals are kept in a bounded in-memory ring and, optionally, in an
+append-only log on disk split into segments. Each segment has a timestamp
+index, so "since T" queries seek straight to the first matching record.
+A client asks for "last N finals" or "finals since T" and gets them back in
+one batched message. "Since T" answers are paged: at most max_batch finals,
+the oldest first, and a "more" flag telling the client to ask again from the
+time of the last final it received.
+
+On-disk layout (log_dir):
+    history-<first time in ms>.log   one JSON record per line
+    history-<first time in ms>.idx   one (time float64, byte offset uint64) per record
+"""
+
+# Import bisect to search the in-memory ring and the segment indexes
+from bisect import bisect_right
+
+# Import islice to page through the in-memory ring without copying it
+from itertools import islice
+
+# Import deque for the in-memory ring
+from collections import deque
+
+# Import json for the log records
+import json
+
+# Import os to manage the segment files
+import os
+
+# Import struct for the index records
+import struct
+
+# Import time for wall-clock timestamps (they must survive a restart)
+import time
+
+# Import parse_qs to read a history request from the connection URL
+from urllib.parse import parse_qs, urlsplit
+
+INDEX_RECORD = struct.Struct("<dQ")
+
+
+def request_from_path(path):
+    """
+    History requested in the connection URL (?last=N or ?since=T).
+
+    Returns:
+    - {"last": ...} or {"since": ...}, or None
+    """
+    query = parse_qs(urlsplit(path or "").query)
+    for key in ("since", "last"):
+        if key in query:
+            return {key: query[key][0]}
+    return None
+
+
+class _Segment:
+    """One log file and its timestamp index (loaded in memory)."""
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.log_path = base_path + ".log"
+        self.idx_path = base_path + ".idx"
+        self.times = []
+        self.offsets = []
+        if os.path.exists(self.idx_path):
+            with open(self.idx_path, "rb") as f:
+                for record_time, offset in INDEX_RECORD.iter_unpack(f.read()):
+                    self.times.append(record_time)
+                    self.offsets.append(offset)
+        self.size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        self._log = None
+        self._idx = None
+
+    @property
+    def first_time(self):
+        return self.times[0] if self.times else None
+
+    def append(self, record_time, line):
+        if self._log is None:
+            self._log = open(self.log_path, "ab")
+            self._idx = open(self.idx_path, "ab")
+        self._log.write(line)
+        self._log.flush()
+        self._idx.write(INDEX_RECORD.pack(record_time, self.size))
+        self._idx.flush()
+        self.times.append(record_time)
+        self.offsets.append(self.size)
+        self.size += len(line)
+
+    def read(self, start_index, count=None):
+        """Read records from position start_index (count=None: to the end)."""
+        if start_index >= len(self.offsets):
+            return []
+        end_index = len(self.offsets) if count is None else min(len(self.offsets), start_index + count)
+        start = self.offsets[start_index]
+        end = self.offsets[end_index] if end_index < len(self.offsets) else self.size
+        with open(self.log_path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+        return [json.loads(line) for line in data.splitlines() if line]
+
+    def close(self):
+        for f in (self._log, self._idx):
+            if f is not None:
+                f.close()
+        self._log = self._idx = None
+
+    def delete(self):
+        self.close()
+        for path in (self.log_path, self.idx_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class TranscriptLog:
+    """
+    Segmented append-only log of finals on disk.
+
+    Parameters:
+    - log_dir: Directory holding the segments
+    - segment_bytes: Size after which a new segment is started
+    - max_segments: Oldest segments beyond this count are deleted
+    """
+
+    def __init__(self, log_dir, segment_bytes=4 * 1024 * 1024, max_segments=16):
+        self.log_dir = log_dir
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        os.makedirs(log_dir, exist_ok=True)
+        names = sorted(
+            name[:-4] for name in os.listdir(log_dir)
+            if name.startswith("history-") and name.endswith(".log")
+        )
+        self.segments = [s for s in (_Segment(os.path.join(log_dir, n)) for n in names) if s.times]
+
+    def append(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        segment = self.segments[-1] if self.segments else None
+        if segment is None or segment.size >= self.segment_bytes:
+            if segment is not None:
+                segment.close()
+            name = f"history-{int(record['time'] * 1000):015d}"
+            segment = _Segment(os.path.join(self.log_dir, name))
+            self.segments.append(segment)
+            while len(self.segments) > self.max_segments:
+                self.segments.pop(0).delete()
+        segment.append(record["time"], line)
+
+    def since(self, since_time, limit):
+        """Records with time > since_time, at most the `limit` most recent."""
+        records = []
+        # Walk back from the newest segment: only the segments that can match are read
+        for segment in reversed(self.segments):
+            start = bisect_right(segment.times, since_time)
+            start = max(start, len(segment.times) - (limit - len(records)))
+            records[:0] = segment.read(start)
+            if len(records) >= limit or segment.first_time <= since_time:
+                break
+        return records
+
+    def after(self, since_time, limit):
+        """Records with time > since_time, at most the `limit` oldest."""
+        records = []
+        for segment in self.segments:
+            if segment.times[-1] <= since_time:
+                continue
+            start = bisect_right(segment.times, since_time)
+            records.extend(segment.read(start, limit - len(records)))
+            if len(records) >= limit:
+                break
+        return records
+
+    def last(self, count):
+        return self.since(float("-inf"), count)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+
+class TranscriptHistory:
+    """
+    Recent finals, in memory and optionally on disk.
+
+    Parameters:
+    - max_entries: Size of the in-memory ring
+    - log_dir: Directory of the on-disk log (None = memory only)
+    - max_batch: Maximum finals returned by one query
+    """
+
+    def __init__(self, max_entries=500, log_dir=None, max_batch=500):
+        self.max_batch = max_batch
+        self._entries = deque(maxlen=max_entries)
+        self._times = deque(maxlen=max_entries)  # Parallel to _entries, for bisect
+        self.log = None
+        if log_dir:
+            self.open_log(log_dir)
+
+        # Counters
+        self.queries = 0
+        self.disk_queries = 0
+
+    def open_log(self, log_dir):
+        """Back the history with an on-disk log and reload its most recent finals."""
+        self.log = TranscriptLog(log_dir)
+        # Warm the ring from the log, so a restart keeps recent context
+        for record in self.log.last(self._entries.maxlen):
+            self._entries.append(record)
+            self._times.append(record["time"])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def append(self, text, session=None):
+        """Record a final transcription. Returns the stored record."""
+        record = {"time": time.time(), "text": text}
+        if session is not None:
+            record["session"] = session
+        self._entries.append(record)
+        self._times.append(record["time"])
+        if self.log is not None:
+            self.log.append(record)
+        return record
+
+    def last(self, count):
+        """The `count` most recent finals (at most max_batch), oldest first."""
+        self.queries += 1
+        count = max(0, min(int(count), self.max_batch))
+        if count <= len(self._entries) or self.log is None:
+            return list(self._entries)[len(self._entries) - min(count, len(self._entries)):]
+        self.disk_queries += 1
+        return self.log.last(count)
+
+    def since(self, since_time, limit=None):
+        """
+        First page of the finals recorded after since_time (epoch seconds).
+
+        Parameters:
+        - since_time: Only finals strictly after this time are returned
+        - limit: Page size (None = max_batch)
+
+        Returns:
+        - the `limit` oldest matching finals, oldest first; the next page
+          starts after the time of the last one
+        """
+        self.queries += 1
+        limit = self.max_batch if limit is None else limit
+        oldest = self._times[0] if self._times else None
+        if self.log is not None and (oldest is None or since_time < oldest):
+            self.disk_queries += 1
+            return self.log.after(since_time, limit)
+        start = bisect_right(self._times, since_time)
+        return list(islice(self._entries, start, start + limit))
+
+    def query(self, request):
+        """
+        Answer a client request: {"last": N} or {"since": T}.
+
+        Returns:
+        - (records, more), or None if the request has neither field;
+          more is True when finals were left out: for "since", ask again
+          with the time of the last record to get the next page
+        """
+        try:
+            if request.get("since") is not None:
+                # One extra record tells whether another page follows
+                records = self.since(float(request["since"]), self.max_batch + 1)
+                return records[:self.max_batch], len(records) > self.max_batch
+            if request.get("last") is not None:
+                count = int(request["last"])
+                records = self.last(count)
+                return records, count > len(records) == self.max_batch
+        except (TypeError, ValueError):
+            return None
+        return None
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "segments": len(self.log.segments) if self.log is not None else 0,
+            "queries": self.queries,
+            "disk_queries": self.disk_queries,
+        }
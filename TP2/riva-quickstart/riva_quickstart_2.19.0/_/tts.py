@@ -11,6 +11,9 @@ import riva.client.proto.riva_tts_pb2 as rtts
 # Import asyncio for asynchronous programming
 import asyncio
 
+# Import grpc to cancel a Synthesize call in flight
+import grpc
+
 # Import websockets library for WebSocket server
 import websockets
 
@@ -28,11 +31,59 @@ import wave
 # Import io for in-memory file operations
 import io
 
+# Import os to locate the cache files next to this script
+import os
+
+# Import threading to stop a streaming synthesis when its client leaves
+import threading
+
+# Import parse_qs to read the request policy from the connection URL
+from urllib.parse import parse_qs, urlsplit
+
+# Import time to measure time-to-first-audio
+import time
+
+# Import the lock-free histograms and the /metrics + /ready endpoint
+from latency_metrics import MetricsRegistry, serve_metrics
+
+# Import the pool of lazy, health-checked channels to Riva
+from riva_channel_pool import RivaChannelPool, channel_lost
+
+# Import the two-tier (memory + disk) cache of synthesized audio
+from tts_cache import SynthesisCache, cache_key, normalize_text, load_phrases
+
+# Import the fair scheduler that runs the blocking gRPC calls off the event loop
+from tts_scheduler import FairSynthesisScheduler
+
+# Import the sentence pipeline used to synthesize long texts in parallel
+from tts_pipeline import split_sentences, silence, synthesize_in_order
+
+# Import the discovery of the server voices and of the RPC path that works for each
+from tts_capabilities import discover, PATH_BATCH, PATH_ONLINE
+
+# Import the per-connection request queue (queue / replace / reject on barge-in)
+from tts_requests import RequestQueue, POLICIES, POLICY_QUEUE, POLICY_REPLACE
+
+# Import the single-flight registry: identical requests in flight share one synthesis
+from tts_singleflight import SingleFlight
+
+# Import the output formats (PCM at a chosen rate, Ogg Opus cut into decodable frames)
+from tts_formats import AudioFormat, parse_format, supported_formats, OggOpusPager, split_ogg_opus
+
+# Import websocket_path to read the URL of a connection (shared with the ASR server)
+from wire_formats import websocket_path
+
 # Configuration
 RIVA_SERVER = "localhost:50051"  # Address of Riva server
 SAMPLE_RATE = 22050  # Audio sample rate for TTS (22.05kHz is common for TTS)
 WEBSOCKET_HOST = "0.0.0.0"  # Listen on all network interfaces
 WEBSOCKET_PORT = 8766  # Port for WebSocket server (different from transcription)
+HEALTH_PORT = 8768  # /ready and /metrics: http://host:8768/ready (0 = disabled, 8767 is the transcription)
+
+# Riva channels: opened on first use, round-robin, keepalive and periodic health checks
+RIVA_CHANNELS = 2  # HTTP/2 connections to Riva (one connection caps the concurrent streams)
+RIVA_KEEPALIVE_MS = 30000  # Keepalive ping interval
+RIVA_HEALTH_INTERVAL = 10.0  # Seconds between health checks (a channel failing 3 in a row is recreated)
 
 # TTS Configuration
 DEFAULT_VOICE = "French-FR-Laetitia-22khz"  # Voice model to use
@@ -40,27 +91,275 @@ DEFAULT_VOICE = "French-FR-Laetitia-22khz"  # Voice model to use
 # English: "English-US-Female-1", "English-US-Male-1"
 # French: "French-FR-Laetitia-22khz", "French-FR-Loic-22khz"
 
+# Voice names of older Riva releases, still offered by tts.html: a server whose
+# catalog does not have them uses the default voice of their language instead
+LEGACY_VOICES = {
+    "French-FR-Laetitia-22khz": "fr-FR",
+    "French-FR-Loic-22khz": "fr-FR",
+    "English-US-Female-1": "en-US",
+    "English-US-Male-1": "en-US",
+}
+
+# Concurrency
+MAX_CONCURRENT_SYNTHESIS = 4  # Synthesis calls in flight (match the Riva server capacity)
+MAX_REQUESTS_PER_CLIENT = 1  # Calls in flight for one client (others wait their turn)
+
+# Streaming: each Riva chunk is forwarded as soon as it arrives
+# ("audio_start" JSON header, raw PCM binary frames, "audio_end" JSON marker)
+STREAM_BY_DEFAULT = False  # Used when the request has no "stream" field
+STREAM_FRAME_MS = 200  # Frame duration when streaming cached audio
+
+# Output format, chosen per message ("format": "pcm" | "opus", "sample_rate")
+DEFAULT_FORMAT = AudioFormat("LINEAR_PCM", SAMPLE_RATE)
+
+# Requests of one connection are processed one at a time. A request arriving while
+# another one runs is queued, replaces it (barge-in: the RPC is cancelled) or is rejected
+REQUEST_POLICY = POLICY_QUEUE  # Default policy (per connection: ?policy=..., per message: "policy")
+MAX_QUEUED_REQUESTS = 8  # Waiting requests per connection beyond which new ones are rejected
+
+# Sentence pipeline: long texts are split into sentences synthesized concurrently
+# and reassembled in order (the first sentence is sent without waiting for the rest)
+PIPELINE_BY_DEFAULT = False  # Used when the request has no "pipeline" field
+PIPELINE_MAX_IN_FLIGHT = 3  # Sentences of one request synthesized at the same time
+PIPELINE_SILENCE_MS = 150  # Pause inserted between sentences
+PIPELINE_MAX_SEGMENT_CHARS = 250  # Longer sentences are split at clause boundaries
+
+# Synthesis cache: repeated prompts are served without calling Riva
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_MEMORY_BYTES = 64 * 1024 * 1024  # In-memory LRU budget
+CACHE_DIR = os.path.join(SCRIPT_DIR, "tts_cache")  # Disk tier (None = memory only)
+CACHE_DISK_BYTES = 1024 * 1024 * 1024  # Disk tier budget
+CACHE_PREWARM_FILE = os.path.join(SCRIPT_DIR, "tts_prewarm.txt")  # Phrases synthesized at startup
+
 # Global set to store all connected WebSocket clients
 connected_clients = set()
 
-# Initialize Riva TTS service (global to reuse connection)
-print("🔌 Connexion au serveur Riva TTS...")
-auth = riva.client.Auth(uri=RIVA_SERVER)
-tts_service = riva.client.SpeechSynthesisService(auth)
-print("✅ Connecté à Riva TTS")
+# Riva TTS services, one per pooled channel (nothing connects until the first request)
+riva_pool = RivaChannelPool(
+    RIVA_SERVER,
+    riva.client.SpeechSynthesisService,
+    size=RIVA_CHANNELS,
+    keepalive_ms=RIVA_KEEPALIVE_MS,
+    health_interval=RIVA_HEALTH_INTERVAL
+)
+
+# Synthesis runs in a bounded thread pool, clients are served round-robin
+synthesis_scheduler = FairSynthesisScheduler(MAX_CONCURRENT_SYNTHESIS, MAX_REQUESTS_PER_CLIENT)
+
+# Cached PCM audio, keyed by normalized text, voice, language, rate and encoding
+synthesis_cache = SynthesisCache(CACHE_MEMORY_BYTES, CACHE_DIR, CACHE_DISK_BYTES)
+
+# Syntheses in flight, by cache key (identical concurrent requests attach to them)
+in_flight = SingleFlight()
+
+# Voices of the Riva server and their RPC path (None: not discovered, use the fallback chain)
+voice_catalog = None
+discovery_task = None
+
+# Time from a streaming request to its first PCM frame sent to the client
+metrics = MetricsRegistry()
+TIME_TO_FIRST_AUDIO = metrics.histogram(
+    "tts_time_to_first_audio_seconds",
+    "Streaming request received to first audio frame sent"
+)
 
 
-def generate_audio(text, voice=DEFAULT_VOICE, language_code="fr-FR"):
+def synthesis_key(text, voice, language_code, audio_format=DEFAULT_FORMAT):
+    """Cache key of a synthesis request (each encoding and rate is cached separately)."""
+    return cache_key(text, voice, language_code, audio_format.sample_rate, audio_format.encoding)
+
+
+def request_format(name, sample_rate):
     """
-    Generate audio from text using Riva TTS.
+    Output format of a request ("format" and "sample_rate" fields).
+    
+    Raises:
+    - ValueError if the format or the rate is not supported
+    """
+    audio_format = parse_format(name, sample_rate, SAMPLE_RATE)
+    if audio_format is None:
+        rate = f" à {sample_rate} Hz" if sample_rate is not None else ""
+        raise ValueError(f"Format audio non supporté: {name or 'pcm'}{rate} (disponibles: {supported_formats()})")
+    return audio_format
+
+
+def pcm_to_wav(audio_samples, sample_rate=SAMPLE_RATE):
+    """Wrap raw 16-bit mono PCM into a WAV file (in memory)."""
+    wav_buffer = io.BytesIO()
+    with wave.open(wav_buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)  # Mono
+        wav_file.setsampwidth(2)  # 16-bit
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(audio_samples)
+    return wav_buffer.getvalue()
+
+
+def audio_file(audio, audio_format=DEFAULT_FORMAT):
+    """Audio as a file: WAV for PCM; Riva's Ogg Opus output is already a file."""
+    if audio_format.encoding == "OGGOPUS":
+        return bytes(audio)
+    return pcm_to_wav(audio, audio_format.sample_rate)
+
+
+def stream_frames(audio, audio_format=DEFAULT_FORMAT):
+    """Cut complete audio into STREAM_FRAME_MS frames (Opus frames decodable on their own)."""
+    if audio_format.encoding == "OGGOPUS":
+        return split_ogg_opus(audio, STREAM_FRAME_MS)
+    frame_bytes = audio_format.sample_rate * STREAM_FRAME_MS // 1000 * 2
+    return [audio[offset:offset + frame_bytes] for offset in range(0, len(audio), frame_bytes)]
+
+
+class SynthesisCancelled(Exception):
+    """The synthesis was cancelled (barge-in or client gone) and its RPC stopped."""
+
+
+class CancelToken:
+    """
+    Cancellation of one synthesis, settable from any thread.
+    Used like a threading.Event, and also cancels the gRPC calls registered with it,
+    so a blocked call stops right away instead of at its next chunk.
+    """
+    
+    def __init__(self):
+        self._event = threading.Event()
+        self._calls = []
+        self._lock = threading.Lock()
+    
+    def is_set(self):
+        return self._event.is_set()
+    
+    def set(self):
+        with self._lock:
+            self._event.set()
+            calls, self._calls = self._calls, []
+        for call in calls:
+            call.cancel()
+    
+    def register(self, call):
+        """Cancel `call` when the token is set (right away if it already is)."""
+        if not hasattr(call, "cancel"):
+            return
+        with self._lock:
+            if not self._event.is_set():
+                self._calls.append(call)
+                return
+        call.cancel()
+
+
+class UnknownVoiceError(ValueError):
+    """Requested voice not offered by the Riva server (the catalog is sent back to the client)."""
+
+    def __init__(self, message, catalog):
+        super().__init__(message)
+        self.catalog = catalog
+
+
+def voice_route(voice, language_code):
+    """Discovered RPC path of a voice, or None (no catalog, or voice not in it)."""
+    entry = voice_catalog.resolve(voice, language_code) if voice_catalog is not None else None
+    return entry[1] if entry is not None else None
+
+
+def resolve_voice(voice, language_code):
+    """
+    Voice and language a request is synthesized with.
+    
+    Parameters:
+    - voice: Requested voice (None: DEFAULT_VOICE, or the first voice of the language)
+    - language_code: Requested language (None: fr-FR, or the language of the voice)
+    
+    Returns:
+    - (voice, language_code)
+    
+    A LEGACY_VOICES name missing from the catalog gets the default voice of its language.
+    
+    Raises:
+    - UnknownVoiceError if the catalog is known and does not have the voice
+    """
+    if voice_catalog is None:
+        return voice or DEFAULT_VOICE, language_code or "fr-FR"
+    if voice in LEGACY_VOICES and voice_catalog.resolve(voice) is None:
+        voice, language_code = None, language_code or LEGACY_VOICES[voice]
+    if not voice:
+        language_code = language_code or "fr-FR"
+        if voice_catalog.resolve(DEFAULT_VOICE, language_code) is not None:
+            voice = DEFAULT_VOICE
+        else:
+            voice = voice_catalog.default_voice(language_code)
+        if voice is None:
+            raise UnknownVoiceError(f"Aucune voix disponible pour la langue '{language_code}'", voice_catalog.as_dict())
+    entry = voice_catalog.resolve(voice, language_code)
+    if entry is None:
+        raise UnknownVoiceError(f"Voix inconnue: '{voice}' ({language_code or 'toutes langues'})", voice_catalog.as_dict())
+    name, route = entry
+    return name, route.language_code
+
+
+def synthesize_batch(text, voice, language_code, audio_format=DEFAULT_FORMAT, cancel_event=None):
+    """
+    Whole audio in one Synthesize call (voice=None: server default voice).
+    Setting cancel_event (CancelToken) cancels the call (raises SynthesisCancelled).
+    """
+    req = rtts.SynthesizeSpeechRequest()
+    req.text = text
+    req.language_code = language_code
+    req.encoding = getattr(riva.client.AudioEncoding, audio_format.encoding)
+    req.sample_rate_hz = audio_format.sample_rate
+    if voice:
+        req.voice_name = voice
+    if cancel_event is None:
+        return riva_pool.get().stub.Synthesize(req).audio
+    call = riva_pool.get().stub.Synthesize.future(req)
+    cancel_event.register(call)
+    try:
+        return call.result().audio
+    except grpc.FutureCancelledError:
+        raise SynthesisCancelled()
+
+
+def synthesize_online(text, voice, language_code, audio_format=DEFAULT_FORMAT, cancel_event=None):
+    """
+    Whole audio from SynthesizeOnline (voice=None: server default voice).
+    Setting cancel_event (CancelToken) cancels the call (raises SynthesisCancelled).
+    """
+    voice_args = {"voice_name": voice} if voice else {}
+    responses = riva_pool.get().synthesize_online(
+        text=text,
+        language_code=language_code,
+        encoding=getattr(riva.client.AudioEncoding, audio_format.encoding),
+        sample_rate_hz=audio_format.sample_rate,
+        **voice_args
+    )
+    if cancel_event is None:
+        # Collect all audio chunks (joined once: no quadratic copies)
+        return b"".join(response.audio for response in responses)
+    cancel_event.register(responses)
+    try:
+        audio = b"".join(response.audio for response in responses)
+    except Exception:
+        if cancel_event.is_set():
+            raise SynthesisCancelled()
+        raise
+    if cancel_event.is_set():
+        raise SynthesisCancelled()
+    return audio
+
+
+def synthesize_audio(text, voice=DEFAULT_VOICE, language_code="fr-FR", audio_format=DEFAULT_FORMAT,
+                     cancel_event=None):
+    """
+    Generate raw audio from text using Riva TTS.
+    The audio is stored in the synthesis cache.
     
     Parameters:
     - text: Text to convert to speech
     - voice: Voice model to use
     - language_code: Language code (fr-FR for French, en-US for English)
+    - audio_format: Encoding and sample rate
+    - cancel_event: CancelToken; setting it cancels the RPC (raises SynthesisCancelled)
     
     Returns:
-    - bytes: WAV audio data
+    - bytes: 16-bit mono PCM, or an Ogg Opus file
     """
     try:
         # Validate input
@@ -71,67 +370,59 @@ def generate_audio(text, voice=DEFAULT_VOICE, language_code="fr-FR"):
         print(f"   Voice: {voice}")
         print(f"   Language: {language_code}")
         
-        # Try synthesize method (newer API)
-        try:
-            req = rtts.SynthesizeSpeechRequest()
-            req.text = text
-            req.language_code = language_code
-            req.encoding = riva.client.AudioEncoding.LINEAR_PCM
-            req.sample_rate_hz = SAMPLE_RATE
-            req.voice_name = voice
-            
-            resp = tts_service.stub.Synthesize(req)
-            audio_samples = resp.audio
-            
-        except Exception as e1:
-            print(f"⚠️  Méthode Synthesize échouée, essai avec SynthesizeOnline...")
-            
-            # Try synthesize_online method (alternative API)
+        route = voice_route(voice, language_code)
+        if route is not None:
+            # Discovered voice: straight to the call that works for it
+            if route.path == PATH_BATCH:
+                call = lambda: synthesize_batch(text, voice, language_code, audio_format, cancel_event)
+            elif route.path == PATH_ONLINE:
+                call = lambda: synthesize_online(text, voice, language_code, audio_format, cancel_event)
+            else:
+                call = lambda: synthesize_online(text, None, language_code, audio_format, cancel_event)
             try:
-                responses = tts_service.synthesize_online(
-                    text=text,
-                    voice_name=voice,
-                    language_code=language_code,
-                    encoding=riva.client.AudioEncoding.LINEAR_PCM,
-                    sample_rate_hz=SAMPLE_RATE
-                )
+                audio_samples = call()
+            except Exception as e:
+                # Channel replaced by the pool (or connection lost) during the call: once more on another one
+                if not channel_lost(e):
+                    raise
+                print(f"⚠️  Canal Riva perdu, nouvel essai sur un autre canal...")
+                audio_samples = call()
+        else:
+            # No catalog: try synthesize method (newer API)
+            try:
+                audio_samples = synthesize_batch(text, voice, language_code, audio_format, cancel_event)
+            
+            except SynthesisCancelled:
+                raise
                 
-                # Collect all audio chunks
-                audio_samples = b""
-                for response in responses:
-                    audio_samples += response.audio
-                    
-            except Exception as e2:
-                print(f"⚠️  SynthesizeOnline échouée, essai sans voice_name...")
+            except Exception as e1:
+                print(f"⚠️  Méthode Synthesize échouée, essai avec SynthesizeOnline...")
                 
-                # Try without voice_name (use default voice)
-                responses = tts_service.synthesize_online(
-                    text=text,
-                    language_code=language_code,
-                    encoding=riva.client.AudioEncoding.LINEAR_PCM,
-                    sample_rate_hz=SAMPLE_RATE
-                )
+                # Try synthesize_online method (alternative API)
+                try:
+                    audio_samples = synthesize_online(text, voice, language_code, audio_format, cancel_event)
                 
-                audio_samples = b""
-                for response in responses:
-                    audio_samples += response.audio
+                except SynthesisCancelled:
+                    raise
+                    
+                except Exception as e2:
+                    print(f"⚠️  SynthesizeOnline échouée, essai sans voice_name...")
+                    
+                    # Try without voice_name (use default voice)
+                    audio_samples = synthesize_online(text, None, language_code, audio_format, cancel_event)
         
         if not audio_samples:
             raise ValueError("Aucun audio généré par Riva")
         
-        # Create WAV file in memory
-        wav_buffer = io.BytesIO()
-        with wave.open(wav_buffer, 'wb') as wav_file:
-            wav_file.setnchannels(1)  # Mono
-            wav_file.setsampwidth(2)  # 16-bit
-            wav_file.setframerate(SAMPLE_RATE)
-            wav_file.writeframes(audio_samples)
+        # Keep the audio for the next identical request
+        synthesis_cache.put(synthesis_key(text, voice, language_code, audio_format), audio_samples)
         
-        # Get the complete WAV file
-        wav_data = wav_buffer.getvalue()
-        
-        print(f"✅ Audio généré: {len(wav_data)} bytes")
-        return wav_data
+        print(f"✅ Audio généré: {len(audio_samples)} bytes")
+        return audio_samples
+    
+    except SynthesisCancelled:
+        print(f"🛑 Synthèse annulée: '{text[:50]}...'")
+        raise
     
     except Exception as e:
         error_msg = str(e)
@@ -144,6 +435,376 @@ def generate_audio(text, voice=DEFAULT_VOICE, language_code="fr-FR"):
         raise
 
 
+def generate_audio(text, voice=DEFAULT_VOICE, language_code="fr-FR", audio_format=DEFAULT_FORMAT):
+    """
+    Generate audio from text using Riva TTS.
+    
+    Returns:
+    - bytes: WAV audio data (Ogg Opus file if audio_format is Opus)
+    """
+    return audio_file(synthesize_audio(text, voice, language_code, audio_format), audio_format)
+
+
+def synthesize_stream(text, voice, language_code, on_chunk, cancel_event=None, audio_format=DEFAULT_FORMAT):
+    """
+    Stream audio from Riva TTS, chunk by chunk.
+    Runs in the synthesis thread pool.
+    
+    Parameters:
+    - text: Text to convert to speech
+    - voice: Voice model to use
+    - language_code: Language code (fr-FR for French, en-US for English)
+    - on_chunk: Called with each audio chunk (raw PCM, or Ogg Opus bytes) as soon as it arrives
+    - cancel_event: CancelToken set to stop the synthesis (barge-in, client gone)
+    - audio_format: Encoding and sample rate
+    
+    Returns:
+    - int: Number of PCM bytes produced
+    """
+    if not text or not text.strip():
+        raise ValueError("Le texte ne peut pas être vide")
+    
+    print(f"🔊 Génération audio (streaming) pour: '{text[:50]}...'")
+    
+    route = voice_route(voice, language_code)
+    if route is not None and route.streaming is None:
+        # This voice cannot stream (SynthesizeOnline failed at discovery): one chunk
+        audio = synthesize_audio(text, voice, language_code, audio_format, cancel_event)
+        on_chunk(audio)
+        return len(audio)
+    
+    # Discovered voice: the streaming call that works for it, sent again on another
+    # channel if its channel was lost. Otherwise same fallback as generate_audio:
+    # with voice_name, then with the default voice.
+    # Only retried before any audio was produced, never in the middle of a stream.
+    attempts = [route.streaming] * 2 if route is not None else [{"voice_name": voice}, {}]
+    total = 0
+    parts = []  # Kept for the cache once the synthesis is complete
+    for attempt, voice_args in enumerate(attempts):
+        try:
+            responses = riva_pool.get().synthesize_online(
+                text=text,
+                language_code=language_code,
+                encoding=getattr(riva.client.AudioEncoding, audio_format.encoding),
+                sample_rate_hz=audio_format.sample_rate,
+                **voice_args
+            )
+            if cancel_event is not None:
+                # A blocked iteration is interrupted as soon as the token is set
+                cancel_event.register(responses)
+            for response in responses:
+                if cancel_event is not None and cancel_event.is_set():
+                    return total
+                if response.audio:
+                    on_chunk(response.audio)
+                    parts.append(response.audio)
+                    total += len(response.audio)
+            break
+        except Exception as e:
+            if cancel_event is not None and cancel_event.is_set():
+                # Cancelled RPC: not an error, and not to be retried
+                return total
+            if total or attempt == len(attempts) - 1 or (route is not None and not channel_lost(e)):
+                if "UNIMPLEMENTED" in str(e):
+                    raise ValueError("Le service TTS n'est pas disponible sur ce serveur Riva. Vérifiez que les modèles TTS sont installés et que le service est activé.")
+                raise
+            if route is not None:
+                print(f"⚠️  Canal Riva perdu, nouvel essai sur un autre canal...")
+            else:
+                print(f"⚠️  SynthesizeOnline échouée, essai sans voice_name...")
+    
+    if not total:
+        raise ValueError("Aucun audio généré par Riva")
+    synthesis_cache.put(synthesis_key(text, voice, language_code, audio_format), b"".join(parts))
+    return total
+
+
+def shared_synthesis(websocket, text, voice, language_code, audio_format=DEFAULT_FORMAT,
+                     streaming=False, limit=None):
+    """
+    Attach to the synthesis of an identical request (same streaming mode) already in flight, or start it.
+    The synthesis is scheduled in the turn of the client that started it, and
+    keeps running as long as one subscriber is left.
+    
+    Parameters:
+    - websocket: Client starting the synthesis (scheduler fairness)
+    - text, voice, language_code, audio_format: Synthesis parameters
+    - streaming: Push the chunks as Riva produces them (otherwise the whole audio at once)
+    - limit: Per-client limit of the scheduler for this call
+    
+    Returns:
+    - Flight (release it with in_flight.detach(flight))
+    """
+    loop = asyncio.get_running_loop()
+    
+    async def synthesize(flight):
+        cancel_event = CancelToken()
+        
+        def on_chunk(chunk):
+            # Called in the synthesis thread: hand the chunk over to the event loop
+            loop.call_soon_threadsafe(flight.push, chunk)
+        
+        try:
+            if not streaming:
+                flight.push(await synthesis_scheduler.run(
+                    websocket, synthesize_audio, text, voice, language_code, audio_format, cancel_event,
+                    limit=limit
+                ))
+                return
+            # Chunks are queued before the synthesis completes, so they are all pushed before the end
+            await synthesis_scheduler.run(
+                websocket, synthesize_stream, text, voice, language_code, on_chunk, cancel_event, audio_format,
+                limit=limit
+            )
+        finally:
+            # Last subscriber gone (barge-in, disconnect) or error: cancel the RPC
+            cancel_event.set()
+    
+    # A streaming request must not join a whole-audio synthesis (its first chunk
+    # would only come at the end), so the two modes never share a flight
+    return in_flight.attach((synthesis_key(text, voice, language_code, audio_format), streaming), synthesize)
+
+
+async def shared_audio(websocket, text, voice, language_code, audio_format=DEFAULT_FORMAT, limit=None):
+    """Complete audio of a request, shared with the identical requests in flight."""
+    flight = shared_synthesis(websocket, text, voice, language_code, audio_format, limit=limit)
+    try:
+        return await flight.audio()
+    finally:
+        in_flight.detach(flight)
+
+
+async def segment_audio(websocket, text, voice, language_code, audio_format=DEFAULT_FORMAT):
+    """
+    Audio of one pipeline segment: from the cache if possible, otherwise
+    synthesized in the thread pool (up to PIPELINE_MAX_IN_FLIGHT per client).
+    """
+    cached = synthesis_cache.get(synthesis_key(text, voice, language_code, audio_format))
+    if cached is not None:
+        return cached
+    return await shared_audio(websocket, text, voice, language_code, audio_format, limit=PIPELINE_MAX_IN_FLIGHT)
+
+
+def pipeline_segments(text):
+    """Segments of a pipelined request (a single one for short texts)."""
+    return split_sentences(text, max_chars=PIPELINE_MAX_SEGMENT_CHARS)
+
+
+async def stream_audio_to_client(websocket, text, voice, language_code, received_at, pipeline=False,
+                                 audio_format=DEFAULT_FORMAT, ids=None):
+    """
+    Synthesize and forward each audio chunk to the client as soon as it arrives.
+    With pipeline=True, the sentences are synthesized concurrently and each one
+    is sent as soon as it and the previous ones are ready.
+    
+    Frames sent:
+    - text: {"type": "audio_start", "encoding": "pcm_s16le" | "ogg_opus", "sample_rate", "channels"}
+    - binary: raw PCM chunks, or Ogg Opus frames (header pages + complete audio
+      pages: each one can be decoded on its own), in order
+    - text: {"type": "audio_end", "bytes", "ttfa_ms", "duration_ms", "cached"}
+    
+    Parameters:
+    - websocket: WebSocket connection
+    - text, voice, language_code: Synthesis parameters
+    - received_at: time.monotonic() when the request was received
+    - pipeline: Split the text into sentences synthesized in parallel
+    - audio_format: Encoding and sample rate
+    - ids: {"id": ...} of the request, repeated in audio_start and audio_end ({} = none)
+    
+    Returns:
+    - int: Number of audio bytes sent
+    """
+    ids = ids or {}
+    opus = audio_format.encoding == "OGGOPUS"
+    ttfa = None
+    sent = 0
+    
+    async def send_chunk(chunk):
+        nonlocal ttfa, sent
+        await websocket.send(chunk)
+        if ttfa is None:
+            ttfa = time.monotonic() - received_at
+            TIME_TO_FIRST_AUDIO.observe(ttfa)
+            print(f"⏱️  Time to first audio: {ttfa:.3f}s")
+        sent += len(chunk)
+    
+    # The header only describes the format: it is sent before any audio exists
+    await websocket.send(json.dumps({
+        "type": "audio_start",
+        "encoding": "ogg_opus" if opus else "pcm_s16le",
+        "sample_rate": audio_format.sample_rate,
+        "channels": 1,
+        **ids
+    }))
+    
+    cached = synthesis_cache.get(synthesis_key(text, voice, language_code, audio_format))
+    segments = pipeline_segments(text) if pipeline and cached is None else [text]
+    if cached is not None:
+        # Cache hit: no gRPC call, no wait for a synthesis slot
+        for chunk in stream_frames(cached, audio_format):
+            await send_chunk(chunk)
+    elif len(segments) > 1:
+        print(f"✂️  Pipeline: {len(segments)} segments")
+        pause = silence(PIPELINE_SILENCE_MS, audio_format.sample_rate)
+        ordered = synthesize_in_order(
+            segments,
+            lambda segment: segment_audio(websocket, segment, voice, language_code, audio_format),
+            PIPELINE_MAX_IN_FLIGHT
+        )
+        try:
+            async for index, audio in ordered:
+                if index and not opus:
+                    await send_chunk(pause)
+                # Opus: each segment is its own Ogg stream, its frames carry its headers
+                for chunk in stream_frames(audio, audio_format):
+                    await send_chunk(chunk)
+        finally:
+            # Client gone or error: cancel the segments not yet synthesized
+            await ordered.aclose()
+    else:
+        # Identical requests in flight share this synthesis and receive the same chunks
+        flight = shared_synthesis(websocket, text, voice, language_code, audio_format, streaming=True)
+        pager = OggOpusPager() if opus else None
+        try:
+            async for chunk in flight.stream():
+                if pager is not None:
+                    # Only complete pages are sent, always behind the stream headers
+                    pages = pager.feed(chunk)
+                    if not pages:
+                        continue
+                    chunk = pager.frame(pages)
+                await send_chunk(chunk)
+        finally:
+            # Client gone or error: the synthesis stops only if no one else is listening
+            in_flight.detach(flight)
+    
+    await websocket.send(json.dumps({
+        "type": "audio_end",
+        "bytes": sent,
+        "ttfa_ms": round(ttfa * 1000, 1) if ttfa is not None else None,
+        # Opus frames repeat the headers: the duration is only derived for PCM
+        "duration_ms": None if opus else round(sent / 2 / audio_format.sample_rate * 1000, 1),
+        "cached": cached is not None,
+        **ids
+    }))
+    return sent
+
+
+async def synthesize_file(websocket, text, voice=DEFAULT_VOICE, language_code="fr-FR", pipeline=False,
+                          audio_format=DEFAULT_FORMAT):
+    """
+    Return the audio file of a request (WAV, or Ogg Opus): from the cache if
+    possible, otherwise synthesized in the thread pool (in this client's turn).
+    With pipeline=True, the sentences are synthesized concurrently and joined
+    in order (PCM only: Ogg Opus files cannot simply be concatenated).
+    """
+    cached = synthesis_cache.get(synthesis_key(text, voice, language_code, audio_format))
+    if cached is not None:
+        return audio_file(cached, audio_format)
+    segments = pipeline_segments(text) if pipeline and audio_format.encoding == "LINEAR_PCM" else [text]
+    if len(segments) > 1:
+        print(f"✂️  Pipeline: {len(segments)} segments")
+        ordered = synthesize_in_order(
+            segments,
+            lambda segment: segment_audio(websocket, segment, voice, language_code, audio_format),
+            PIPELINE_MAX_IN_FLIGHT
+        )
+        parts = []
+        try:
+            async for index, audio in ordered:
+                if index:
+                    parts.append(silence(PIPELINE_SILENCE_MS, audio_format.sample_rate))
+                parts.append(audio)
+        finally:
+            await ordered.aclose()
+        return pcm_to_wav(b"".join(parts), audio_format.sample_rate)
+    return audio_file(await shared_audio(websocket, text, voice, language_code, audio_format), audio_format)
+
+
+async def discover_voices():
+    """
+    Ask the Riva server for its voices and probe the RPC path of each one.
+    Runs at startup and each time Riva is reachable again after an outage;
+    a failed discovery keeps the previous catalog.
+    """
+    global voice_catalog
+    print("🔍 Découverte des voix du serveur Riva...")
+    try:
+        catalog = await synthesis_scheduler.run("discovery", discover, riva_pool.get(), SAMPLE_RATE)
+    except Exception as e:
+        print(f"⚠️  Découverte des voix impossible: {e}")
+        return
+    if not catalog:
+        # Old server (no GetRivaSynthesisConfig) or no usable voice: per-request fallback chain
+        print("⚠️  Aucun catalogue de voix: chaîne de repli à chaque requête")
+        voice_catalog = None
+        return
+    voice_catalog = catalog
+    print(f"🎤 Voix découvertes: {catalog.stats()}")
+
+
+def start_discovery():
+    """Start a discovery unless one is already running."""
+    global discovery_task
+    if discovery_task is None or discovery_task.done():
+        discovery_task = asyncio.ensure_future(discover_voices())
+    return discovery_task
+
+
+def on_riva_ready():
+    """Riva reachable again (restarted server, models reloaded): refresh the catalog."""
+    print("🔌 Riva TTS reconnecté")
+    start_discovery()
+
+
+def readiness():
+    """Readiness report served on /ready: at least one healthy Riva channel."""
+    pool = riva_pool.stats()
+    return pool["ready"], {
+        "riva": pool,
+        "voices": len(voice_catalog) if voice_catalog is not None else None,
+        "synthesis": synthesis_scheduler.stats(),
+    }
+
+
+async def start_health_server(port=HEALTH_PORT):
+    """
+    Serve /ready (readiness probe) and /metrics (time to first audio) over HTTP.
+    
+    Parameters:
+    - port: HTTP port (0 = disabled)
+    """
+    if not port:
+        return None
+    server = await serve_metrics(metrics, WEBSOCKET_HOST, port, ready=readiness)
+    print(f"📈 Readiness: http://localhost:{port}/ready, metrics: http://localhost:{port}/metrics")
+    return server
+
+
+async def prewarm_cache(path=CACHE_PREWARM_FILE, voice=None, language_code=None):
+    """
+    Synthesize the phrases of a list into the cache, so their first request is already a hit.
+    Runs in the background at startup and shares the synthesis slots fairly with the clients.
+    """
+    if not path or not os.path.exists(path):
+        return
+    # Same voice as a request without "voice" field (the catalog may not have DEFAULT_VOICE)
+    try:
+        voice, language_code = resolve_voice(voice, language_code)
+    except UnknownVoiceError as e:
+        print(f"⚠️  Pré-chauffage impossible: {e}")
+        return
+    phrases = [normalize_text(phrase) for phrase in load_phrases(path)]
+    missing = [p for p in phrases if synthesis_key(p, voice, language_code) not in synthesis_cache]
+    print(f"🔥 Pré-chauffage du cache: {len(missing)}/{len(phrases)} phrases à synthétiser")
+    for phrase in missing:
+        try:
+            await synthesis_scheduler.run("prewarm", generate_audio, phrase, voice, language_code)
+        except Exception as e:
+            print(f"⚠️  Pré-chauffage impossible pour '{phrase[:50]}': {e}")
+    print(f"🔥 Cache prêt: {synthesis_cache.stats()}")
+
+
 async def send_audio_to_client(websocket, audio_data):
     """
     Send audio data to a WebSocket client.
@@ -161,7 +822,7 @@ async def send_audio_to_client(websocket, audio_data):
         print(f"❌ Erreur lors de l'envoi audio: {str(e)}")
 
 
-async def send_status(websocket, status_type, message):
+async def send_status(websocket, status_type, message, **fields):
     """
     Send a status message to a client.
     
@@ -169,30 +830,120 @@ async def send_status(websocket, status_type, message):
     - websocket: WebSocket connection
     - status_type: Type of status ("success", "error", "info")
     - message: Status message text
+    - fields: Extra fields of the message (e.g. "voices")
     """
     try:
         status = json.dumps({
             "type": status_type,
             "message": message,
-            "timestamp": asyncio.get_event_loop().time()
+            "timestamp": asyncio.get_event_loop().time(),
+            **fields
         })
         await websocket.send(status)
     except Exception as e:
         print(f"❌ Erreur lors de l'envoi du statut: {str(e)}")
 
 
+def connection_policy(websocket):
+    """Request policy of a connection (?policy=queue|replace|reject), REQUEST_POLICY by default."""
+    policy = parse_qs(urlsplit(websocket_path(websocket)).query).get("policy", [REQUEST_POLICY])[0]
+    return policy if policy in POLICIES else REQUEST_POLICY
+
+
+async def process_request(websocket, request):
+    """
+    Synthesize one request and send its audio (runs in the connection's request queue).
+    Cancelled on barge-in or disconnect: the synthesis RPC is cancelled with it.
+    
+    Parameters:
+    - websocket: WebSocket connection
+    - request: dict with id, text, voice, language, stream, pipeline, format, received_at
+    
+    Every request ends with one terminal message: "success", "error", or
+    "cancelled" (barge-in or {"type": "cancel"}; sent by the request queue,
+    no more audio follows for it).
+    """
+    text = request["text"]
+    voice = request["voice"]
+    language = request["language"]
+    audio_format = request["format"]
+    ids = request_ids(request)
+    try:
+        # Send processing status
+        key = synthesis_key(text, voice, language, audio_format)
+        if key in synthesis_cache:
+            await send_status(websocket, "info", "Audio en cache", **ids)
+        elif (key, request["stream"]) in in_flight:
+            await send_status(websocket, "info", "Synthèse identique en cours, audio partagé...", **ids)
+        elif synthesis_scheduler.busy:
+            await send_status(websocket, "info", "Serveur occupé, requête en file d'attente...", **ids)
+        else:
+            await send_status(websocket, "info", "Génération de l'audio en cours...", **ids)
+        
+        if request["stream"]:
+            # Forward the audio chunk by chunk as Riva produces it
+            sent = await stream_audio_to_client(
+                websocket, text, voice, language, request["received_at"], request["pipeline"], audio_format, ids
+            )
+            await send_status(websocket, "success", f"Audio généré: {sent} bytes (streaming)", **ids)
+            return
+        
+        # Generate audio (cache, or the thread pool: other clients are not blocked)
+        audio_data = await synthesize_file(websocket, text, voice, language, request["pipeline"], audio_format)
+        
+        # Send audio to client
+        await send_audio_to_client(websocket, audio_data)
+        
+        # Send success status
+        await send_status(websocket, "success", f"Audio généré: {len(audio_data)} bytes", **ids)
+    
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    
+    except Exception as e:
+        error_msg = f"Erreur: {str(e)}"
+        print(f"❌ {error_msg}")
+        await send_status(websocket, "error", error_msg, **ids)
+
+
+def request_ids(request):
+    """{"id": ...} echoed in the messages of a request, if the client gave it an id."""
+    return {"id": request["id"]} if request.get("id") is not None else {}
+
+
+async def send_cancelled(websocket, request):
+    """Terminal message of a cancelled request (running or still waiting)."""
+    if websocket.close_code is not None:
+        return  # Cancelled because the client left
+    await send_status(websocket, "cancelled", "Requête annulée", **request_ids(request))
+
+
 async def websocket_handler(websocket):
     """
     Handle WebSocket connections and TTS requests.
+    Messages are read continuously; requests are processed one at a time by
+    the connection's request queue, according to their policy.
     
     Parameters:
-    - websocket: The WebSocket connection
+    - websocket: The WebSocket connection (?policy=queue|replace|reject in the URL)
+    
+    Messages from the client:
+    - {"text": ..., "policy": "queue" | "replace" | "reject", "id": ..., ...}: a TTS
+      request; its "id", if any, is echoed in every JSON message about it
+    - {"type": "cancel"}: stop the running request and drop the queued ones
+      (each one gets a {"type": "cancelled"} message)
+    - plain text: a TTS request with the default settings
     """
     # Add client to connected set
     connected_clients.add(websocket)
     client_ip = websocket.remote_address[0] if websocket.remote_address else "unknown"
+    default_policy = connection_policy(websocket)
+    requests = RequestQueue(
+        lambda request: process_request(websocket, request), MAX_QUEUED_REQUESTS,
+        on_cancelled=lambda request: send_cancelled(websocket, request)
+    )
     
-    print(f"✓ Nouveau client TTS connecté depuis {client_ip} (Total: {len(connected_clients)})")
+    print(f"✓ Nouveau client TTS connecté depuis {client_ip} (Total: {len(connected_clients)}, politique: {default_policy})")
     
     # Send welcome message
     await send_status(websocket, "info", "Connecté au serveur TTS - Envoyez du texte pour générer de l'audio")
@@ -200,61 +951,74 @@ async def websocket_handler(websocket):
     try:
         # Listen for messages from client
         async for message in websocket:
+            ids = {}
             try:
-                # Try to parse as JSON
-                data = json.loads(message)
-                
-                # Extract parameters
-                text = data.get("text", "").strip()
-                voice = data.get("voice", DEFAULT_VOICE)
-                language = data.get("language", "fr-FR")
+                received_at = time.monotonic()
+                try:
+                    # Try to parse as JSON
+                    data = json.loads(message)
+                except json.JSONDecodeError:
+                    # If not JSON, treat as plain text (default settings, complete file)
+                    data = {"text": message, "stream": False}
+                if not isinstance(data, dict):
+                    data = {"text": str(data)}
+                ids = request_ids(data)
                 
-                if not text:
-                    await send_status(websocket, "error", "Le texte ne peut pas être vide")
+                if data.get("type") == "cancel":
+                    cancelled = requests.cancel()
+                    print(f"🛑 Annulation demandée par {client_ip}: {cancelled} requête(s)")
+                    await send_status(websocket, "info", f"{cancelled} requête(s) annulée(s)", cancelled=cancelled)
                     continue
                 
-                print(f"📝 Requête TTS de {client_ip}: '{text[:50]}...'")
-                
-                # Send processing status
-                await send_status(websocket, "info", "Génération de l'audio en cours...")
-                
-                # Generate audio
-                audio_data = generate_audio(text, voice, language)
-                
-                # Send audio to client
-                await send_audio_to_client(websocket, audio_data)
-                
-                # Send success status
-                await send_status(websocket, "success", f"Audio généré: {len(audio_data)} bytes")
-                
-            except json.JSONDecodeError:
-                # If not JSON, treat as plain text
-                text = message.strip()
-                
+                # Extract parameters (unknown voices and formats are rejected here, before any RPC)
+                text = normalize_text(data.get("text", ""))
                 if not text:
-                    await send_status(websocket, "error", "Le texte ne peut pas être vide")
+                    await send_status(websocket, "error", "Le texte ne peut pas être vide", **ids)
+                    continue
+                voice, language = resolve_voice(data.get("voice"), data.get("language"))
+                request = {
+                    **ids,
+                    "text": text,
+                    "voice": voice,
+                    "language": language,
+                    "stream": bool(data.get("stream", STREAM_BY_DEFAULT)),
+                    "pipeline": bool(data.get("pipeline", PIPELINE_BY_DEFAULT)),
+                    "format": request_format(data.get("format"), data.get("sample_rate")),
+                    "received_at": received_at,
+                }
+                policy = data.get("policy", default_policy)
+                if policy not in POLICIES:
+                    await send_status(websocket, "error", f"Politique inconnue: {policy} (disponibles: {', '.join(POLICIES)})", **ids)
                     continue
                 
-                print(f"📝 Requête TTS (texte brut) de {client_ip}: '{text[:50]}...'")
+                print(f"📝 Requête TTS de {client_ip}: '{text[:50]}...' ({policy})")
                 
-                # Generate audio with default settings
-                audio_data = generate_audio(text)
+                busy = requests.busy
+                if not requests.submit(request, policy):
+                    await send_status(websocket, "error", "Requête refusée: une synthèse est déjà en cours pour cette connexion", **ids)
+                elif busy and policy == POLICY_QUEUE:
+                    await send_status(websocket, "info", f"Requête en attente ({requests.waiting} dans la file)", **ids)
+                elif busy and policy == POLICY_REPLACE:
+                    await send_status(websocket, "info", "Synthèse en cours interrompue", **ids)
                 
-                # Send audio to client
-                await send_audio_to_client(websocket, audio_data)
+            except UnknownVoiceError as e:
+                print(f"❌ {e}")
+                await send_status(websocket, "error", f"Erreur: {e}", voices=e.catalog, **ids)
                 
             except Exception as e:
                 error_msg = f"Erreur: {str(e)}"
                 print(f"❌ {error_msg}")
-                await send_status(websocket, "error", error_msg)
+                await send_status(websocket, "error", error_msg, **ids)
     
     except websockets.exceptions.ConnectionClosed:
         print(f"✗ Client TTS déconnecté: {client_ip}")
     
     finally:
+        # Client gone: cancel its requests (and their RPCs, unless shared with other clients)
+        requests.close()
         # Remove client from set
         connected_clients.discard(websocket)
-        print(f"📊 Clients TTS restants: {len(connected_clients)}")
+        print(f"📊 Clients TTS restants: {len(connected_clients)} (requêtes de {client_ip}: {requests.stats()})")
 
 
 async def start_websocket_server():
@@ -273,12 +1037,22 @@ async def start_websocket_server():
     print(f"🌐 WebSocket URL: ws://localhost:{WEBSOCKET_PORT}")
     print(f"🎤 Voix par défaut: {DEFAULT_VOICE}")
     print(f"📊 Fréquence d'échantillonnage: {SAMPLE_RATE} Hz")
+    print(f"⚙️  Synthèses simultanées: {MAX_CONCURRENT_SYNTHESIS} (max {MAX_REQUESTS_PER_CLIENT} par client, {PIPELINE_MAX_IN_FLIGHT} en pipeline)")
     print("\n💡 Format de requête JSON:")
     print('   {')
     print('     "text": "Votre texte ici",')
     print('     "voice": "French-FR-Laetitia-22khz",  # Optionnel')
-    print('     "language": "fr-FR"  # Optionnel')
+    print('     "language": "fr-FR",  # Optionnel')
+    print('     "format": "opus",  # Optionnel: "pcm" (WAV, défaut) ou "opus" (Ogg Opus, ~10x plus léger)')
+    print('     "sample_rate": 24000,  # Optionnel: fréquence de sortie')
+    print('     "stream": true,  # Optionnel: en-tête JSON, trames PCM brutes, puis marqueur de fin')
+    print('     "pipeline": true,  # Optionnel: phrases synthétisées en parallèle (textes longs)')
+    print('     "id": "r1"  # Optionnel: renvoyé dans chaque message JSON de la requête')
     print('   }')
+    print('💡 "policy": "queue" (défaut), "replace" (interrompt la synthèse en cours) ou "reject";')
+    print('   {"type": "cancel"} interrompt la synthèse en cours')
+    print('   Une requête interrompue se termine par {"type": "cancelled"} (sinon "success" ou "error")')
+    print("💡 Une voix inconnue est refusée avec la liste des voix disponibles (champ \"voices\")")
     print("\n💡 Ou envoyez simplement du texte brut pour utiliser les paramètres par défaut")
     print("\nAppuyez sur Ctrl+C pour arrêter")
     print("=" * 70 + "\n")
@@ -291,6 +1065,16 @@ async def main():
     """
     Main function to run the TTS server.
     """
+    # Discover the voices, then fill the cache with the usual prompts,
+    # while the server starts accepting clients
+    async def startup():
+        await start_discovery()
+        await prewarm_cache()
+    
+    loop = asyncio.get_running_loop()
+    riva_pool.on_ready = lambda: loop.call_soon_threadsafe(on_riva_ready)
+    prewarm_task = asyncio.create_task(startup())
+    health_server = await start_health_server()
     try:
         await start_websocket_server()
     except KeyboardInterrupt:
@@ -301,6 +1085,19 @@ async def main():
             print("🔌 Fermeture des connexions clients...")
             for client in list(connected_clients):
                 await client.close()
+        prewarm_task.cancel()
+        if health_server is not None:
+            health_server.close()
+        synthesis_scheduler.shutdown()
+        print(f"📊 Canaux Riva: {riva_pool.stats()}")
+        riva_pool.close()
+        print(f"📊 Synthèses: {synthesis_scheduler.stats()}")
+        print(f"📊 Cache: {synthesis_cache.stats()}")
+        print(f"📊 Requêtes identiques partagées: {in_flight.stats()}")
+        ttfa_buckets, ttfa_total = TIME_TO_FIRST_AUDIO.snapshot()
+        ttfa_count = ttfa_buckets[-1]
+        if ttfa_count:
+            print(f"⏱️  Time to first audio moyen: {ttfa_total / ttfa_count:.3f}s sur {ttfa_count} requêtes")
         print("✅ Arrêt complet!")
 
 
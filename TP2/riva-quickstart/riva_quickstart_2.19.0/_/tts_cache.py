@@ -0,0 +1,291 @@
+"""
+Content-addressed cache of synthesized audio
+Audio is keyed by a hash of the normalized text, voice, language, sample
+rate and encoding. Tier one is an in-memory LRU with a byte budget; tier two
+is a directory of files read back through mmap (copied out, the mapping is
+closed at once), evicted oldest-first when the
+directory exceeds its size budget. A hit never reaches gRPC.
+"""
+
+# Import hashlib for the content address
+import hashlib
+
+# Import mmap to read cached audio without copying it into Python buffers
+import mmap
+
+# Import os to manage the cache files
+import os
+
+# Import re to collapse whitespace
+import re
+
+# Import threading: the cache is filled from the synthesis threads
+import threading
+
+# Import unicodedata to normalize the text before hashing
+import unicodedata
+
+# Import OrderedDict for LRU order
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """
+    Canonical form of a text for caching: NFC, typographic apostrophes
+    replaced, whitespace collapsed. Case and punctuation are kept because
+    they change the prosody.
+    """
+    text = unicodedata.normalize("NFC", text).replace("’", "'")
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def cache_key(text, voice, language_code, sample_rate, encoding):
+    """Content address of one synthesis (hex SHA-256)."""
+    parts = (normalize_text(text), voice or "", language_code or "", str(sample_rate), str(encoding))
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def load_phrases(path):
+    """Read a pre-warm phrase list: one phrase per line, '#' starts a comment."""
+    phrases = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                phrases.append(line)
+    return phrases
+
+
+class MemoryLRU:
+    """
+    In-memory LRU bounded by the total size of its values.
+
+    Parameters:
+    - max_bytes: Byte budget (values larger than a quarter of it are not kept)
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items = OrderedDict()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes // 4:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old)
+        self._items[key] = value
+        self.bytes += len(value)
+        while self.bytes > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+
+
+class DiskCache:
+    """
+    Directory of cached audio files, read through mmap.
+
+    Parameters:
+    - directory: Cache directory (created if needed)
+    - max_bytes: Size budget of the directory; least recently used files are deleted beyond it
+    """
+
+    SUFFIX = ".audio"
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+        # Rebuild the LRU order from the files' modification times
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(self.SUFFIX):
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_mtime, name[:-len(self.SUFFIX)], stat.st_size))
+        self._sizes = OrderedDict()
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+            self.bytes += size
+        self.remove(self._evict())  # The budget may have been lowered since the last run
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def __contains__(self, key):
+        return key in self._sizes
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key):
+        """Return the cached audio (bytes), or None."""
+        if key not in self._sizes:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                if self._sizes[key] == 0:
+                    return b""
+                # One copy out of the page cache, then the mapping is closed: a
+                # mapping kept alive would hold a file descriptor (and, on
+                # Windows, a lock on the file) for as long as the entry is used
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    value = bytes(mapped)
+        except (FileNotFoundError, ValueError):
+            self._forget(key)
+            return None
+        except OSError:
+            return None  # Transient (e.g. out of file descriptors): the entry is kept
+        self._sizes.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if self.write(key, value):
+            self.remove(self.add(key, len(value)))
+
+    def write(self, key, value):
+        """
+        Write the file of an entry (no bookkeeping: safe to call without the cache lock).
+
+        Returns:
+        - True if the file was written, False if it is too large or could not replace the old one
+        """
+        if len(value) > self.max_bytes:
+            return False
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(value)
+            # Readers never see a partial file. On Windows a file that is still
+            # mapped by a reader cannot be replaced (PermissionError): keep the old one
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def add(self, key, size):
+        """
+        Record a written entry.
+
+        Returns:
+        - the keys evicted to fit the budget; their files are deleted by remove()
+        """
+        self._forget(key)
+        self._sizes[key] = size
+        self.bytes += size
+        return self._evict()
+
+    def remove(self, keys):
+        """Delete the files of evicted entries."""
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                # Already gone, or still mapped by a reader on Windows: the
+                # file is counted again when the cache is reopened
+                pass
+
+    def _evict(self):
+        """Forget the least recently used entries until the directory fits its budget; returns their keys."""
+        evicted = []
+        while self.bytes > self.max_bytes and len(self._sizes) > 1:
+            key = next(iter(self._sizes))
+            self._forget(key)
+            evicted.append(key)
+            self.evictions += 1
+        return evicted
+
+    def _forget(self, key):
+        size = self._sizes.pop(key, None)
+        if size is not None:
+            self.bytes -= size
+
+
+class SynthesisCache:
+    """
+    Two-tier cache of synthesized audio: memory LRU, then disk.
+
+    Parameters:
+    - memory_bytes: Byte budget of the in-memory tier
+    - disk_dir: Directory of the disk tier (None = memory only)
+    - disk_bytes: Size budget of the disk tier
+    """
+
+    def __init__(self, memory_bytes=64 * 1024 * 1024, disk_dir=None, disk_bytes=1024 * 1024 * 1024):
+        self.memory = MemoryLRU(memory_bytes)
+        self.disk = DiskCache(disk_dir, disk_bytes) if disk_dir else None
+        self._lock = threading.Lock()
+
+        # Counters
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached audio (bytes-like) or None."""
+        with self._lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory_hits += 1
+                return value
+            if self.disk is not None:
+                value = self.disk.get(key)
+                if value is not None:
+                    self.disk_hits += 1
+                    self.memory.put(key, value)  # Promote: bytes, no file kept open
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """Store audio in both tiers."""
+        with self._lock:
+            self.memory.put(key, value)
+        if self.disk is None:
+            return
+        # File I/O outside the lock: the event loop takes it for every lookup
+        if not self.disk.write(key, value):
+            return
+        with self._lock:
+            evicted = self.disk.add(key, len(value))
+        self.disk.remove(evicted)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self.memory.get(key) is not None or (self.disk is not None and key in self.disk)
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.bytes,
+            "memory_evictions": self.memory.evictions,
+            "disk_entries": len(self.disk) if self.disk is not None else 0,
+            "disk_bytes": self.disk.bytes if self.disk is not None else 0,
+            "disk_evictions": self.disk.evictions if self.disk is not None else 0,
+        }
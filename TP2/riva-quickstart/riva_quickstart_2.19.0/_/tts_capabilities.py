@@ -0,0 +1,231 @@
+"""
+Discovery of the voices and RPC paths offered by a Riva TTS server
+The server is asked once for its synthesis config (GetRivaSynthesisConfig,
+as in examples/talk.py --list-voices), then the first voice of each model is
+probed with a short text to find the call that works for it; the other
+subvoices of that model share its route. Requests are then routed
+straight to that call instead of trying the RPCs one after the other.
+"""
+
+# Import Riva client library for the probe requests
+import riva.client
+import riva.client.proto.riva_tts_pb2 as rtts
+
+# Import namedtuple for the per-voice routes
+from collections import namedtuple
+
+# RPC paths used to synthesize a whole text
+PATH_BATCH = "batch"  # stub.Synthesize: one response with all the audio
+PATH_ONLINE = "online"  # synthesize_online with voice_name, chunks joined
+PATH_DEFAULT_VOICE = "default_voice"  # synthesize_online without voice_name (server default)
+
+# Text synthesized to probe a voice
+PROBE_TEXT = "Test."
+
+# How to reach one voice:
+# - language_code: Language of the voice
+# - path: PATH_* used for whole-text requests
+# - streaming: voice_name arguments of the streaming call ({} = server default voice),
+#   or None if the voice cannot stream (the whole audio is sent as one chunk)
+VoiceRoute = namedtuple("VoiceRoute", ["language_code", "path", "streaming"])
+
+
+def parse_synthesis_config(config_response):
+    """
+    Voices listed in a GetRivaSynthesisConfig response.
+
+    Returns:
+    - dict: full voice name ("<voice_name>.<subvoice>") → language code, in server order
+    - dict: model voice name → its first full voice name
+    - dict: full voice name → model voice name
+    """
+    voices = {}
+    aliases = {}
+    models = {}
+    for model_config in config_response.model_config:
+        parameters = model_config.parameters
+        language_code = parameters.get("language_code")
+        voice_name = parameters.get("voice_name")
+        if not language_code or not voice_name:
+            continue
+        subvoices = [v.split(":")[0] for v in parameters.get("subvoices", "").split(",") if v]
+        for subvoice in subvoices or [None]:
+            name = f"{voice_name}.{subvoice}" if subvoice else voice_name
+            voices.setdefault(name, language_code)
+            aliases.setdefault(voice_name, name)
+            models.setdefault(name, voice_name)
+    return voices, aliases, models
+
+
+def _request(text, language_code, sample_rate, voice=None):
+    req = rtts.SynthesizeSpeechRequest()
+    req.text = text
+    req.language_code = language_code
+    req.encoding = riva.client.AudioEncoding.LINEAR_PCM
+    req.sample_rate_hz = sample_rate
+    if voice:
+        req.voice_name = voice
+    return req
+
+
+def _works(call):
+    """True if the call returns audio without raising."""
+    try:
+        return bool(call())
+    except Exception:
+        return False
+
+
+def _first_online_chunk(service, language_code, sample_rate, voice=None):
+    voice_args = {"voice_name": voice} if voice else {}
+    responses = service.synthesize_online(
+        text=PROBE_TEXT,
+        language_code=language_code,
+        encoding=riva.client.AudioEncoding.LINEAR_PCM,
+        sample_rate_hz=sample_rate,
+        **voice_args
+    )
+    try:
+        for response in responses:
+            if response.audio:
+                return response.audio
+        return None
+    finally:
+        # One chunk is enough: stop the rest of the probe synthesis
+        if hasattr(responses, "cancel"):
+            responses.cancel()
+
+
+def probe_voice(service, voice, language_code, sample_rate, default_voice_works=None):
+    """
+    Find the RPC path that works for one voice.
+
+    Parameters:
+    - service: riva.client.SpeechSynthesisService
+    - voice, language_code: Voice to probe
+    - sample_rate: Sample rate of the requests
+    - default_voice_works: Called with language_code if the voice fails both
+      paths, to know whether the server default voice can be used instead
+
+    Returns:
+    - VoiceRoute, or None if the voice cannot be synthesized at all
+    """
+    batch = _works(lambda: service.stub.Synthesize(
+        _request(PROBE_TEXT, language_code, sample_rate, voice)
+    ).audio)
+    online = _works(lambda: _first_online_chunk(service, language_code, sample_rate, voice))
+    if batch or online:
+        return VoiceRoute(
+            language_code,
+            PATH_BATCH if batch else PATH_ONLINE,
+            {"voice_name": voice} if online else None
+        )
+    if default_voice_works is not None and default_voice_works(language_code):
+        return VoiceRoute(language_code, PATH_DEFAULT_VOICE, {})
+    return None
+
+
+class VoiceCatalog:
+    """
+    Voices of a Riva server and the RPC path to use for each one.
+
+    Parameters:
+    - routes: dict voice name → VoiceRoute
+    - aliases: dict model voice name → full voice name (a model name selects its first subvoice)
+    """
+
+    def __init__(self, routes, aliases=None):
+        self.routes = dict(routes)
+        self._aliases = {a: n for a, n in (aliases or {}).items() if n in self.routes}
+
+    def __len__(self):
+        return len(self.routes)
+
+    def __contains__(self, voice):
+        return self.resolve(voice) is not None
+
+    def resolve(self, voice, language_code=None):
+        """
+        Catalog entry of a requested voice.
+
+        Returns:
+        - (voice name, VoiceRoute), or None if the voice is unknown or not in that language
+        """
+        if voice in self.routes:
+            name = voice
+        elif voice in self._aliases:
+            name = self._aliases[voice]
+        else:
+            return None
+        route = self.routes[name]
+        if language_code and route.language_code != language_code:
+            return None
+        return name, route
+
+    def default_voice(self, language_code):
+        """First voice of a language, or None."""
+        return next((n for n, r in self.routes.items() if r.language_code == language_code), None)
+
+    def as_dict(self):
+        """Catalog by language, in the format of talk.py --list-voices."""
+        languages = {}
+        for name, route in self.routes.items():
+            languages.setdefault(route.language_code, {"voices": []})["voices"].append(name)
+        return dict(sorted(languages.items()))
+
+    def stats(self):
+        paths = {}
+        for route in self.routes.values():
+            paths[route.path] = paths.get(route.path, 0) + 1
+        return {
+            "voices": len(self.routes),
+            "languages": len({r.language_code for r in self.routes.values()}),
+            "paths": paths,
+            "streaming": sum(r.streaming is not None for r in self.routes.values()),
+        }
+
+
+def discover(service, sample_rate):
+    """
+    Build the voice catalog of a Riva server (blocking: run it in a thread).
+
+    Parameters:
+    - service: riva.client.SpeechSynthesisService
+    - sample_rate: Sample rate of the requests
+
+    Returns:
+    - VoiceCatalog, or None if the server does not implement GetRivaSynthesisConfig
+    """
+    try:
+        config_response = service.stub.GetRivaSynthesisConfig(rtts.RivaSynthesisConfigRequest())
+    except Exception as e:
+        if "UNIMPLEMENTED" in str(e):
+            return None
+        raise
+
+    default_voice_checks = {}
+
+    def default_voice_works(language_code):
+        if language_code not in default_voice_checks:
+            default_voice_checks[language_code] = _works(
+                lambda: _first_online_chunk(service, language_code, sample_rate)
+            )
+        return default_voice_checks[language_code]
+
+    voices, aliases, models = parse_synthesis_config(config_response)
+    # Subvoices of a model are served by the same RPCs: probe the model once
+    # (2 syntheses) and give its route to each of its subvoices
+    model_routes = {}
+    routes = {}
+    for voice, language_code in voices.items():
+        key = (models[voice], language_code)
+        if key not in model_routes:
+            model_routes[key] = probe_voice(service, voice, language_code, sample_rate, default_voice_works)
+        route = model_routes[key]
+        if route is None:
+            continue
+        if route.streaming:
+            # The streaming call names this subvoice, not the probed one
+            route = route._replace(streaming={"voice_name": voice})
+        routes[voice] = route
+    return VoiceCatalog(routes, aliases)
@@ -0,0 +1,230 @@
+"""
+Output formats of the TTS server: PCM at a chosen rate, or Ogg Opus
+A client picks the format per message. When streaming Opus, the Riva output
+is cut at Ogg page boundaries and every binary frame carries the stream
+header pages (OpusHead, OpusTags) followed by complete audio pages, so each
+frame is a valid Ogg Opus stream that a client can decode on its own: its
+pages are renumbered, and after the first frame the granule positions are
+shifted to start at 0 and the pre-skip is cleared (the samples to skip are
+only at the start of the whole stream).
+"""
+
+# Import namedtuple for the negotiated format
+from collections import namedtuple
+
+# Import struct to read the Ogg page headers
+import struct
+
+# Client-facing format names → Riva AudioEncoding names
+FORMATS = {
+    "pcm": "LINEAR_PCM",
+    "wav": "LINEAR_PCM",
+    "opus": "OGGOPUS",
+}
+
+# Sample rates accepted for each encoding
+PCM_SAMPLE_RATES = (8000, 16000, 22050, 24000, 44100, 48000)
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+OPUS_DEFAULT_SAMPLE_RATE = 24000
+
+# Ogg page header: "OggS", version, header type, granule position, serial, sequence, CRC, segment count
+_OGG_HEADER = struct.Struct("<4sBBqIIIB")
+_OGG_CONTINUED = 0x01
+_OGG_BOS = 0x02
+_OGG_GRANULE_OFFSET = 6
+_OGG_SEQUENCE_OFFSET = 18
+_OGG_CRC_OFFSET = 22
+_OPUS_PRE_SKIP_OFFSET = 10  # In the OpusHead packet
+
+
+def _ogg_crc_table():
+    table = []
+    for index in range(256):
+        crc = index << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1) & 0xFFFFFFFF
+        table.append(crc)
+    return table
+
+
+_OGG_CRC_TABLE = _ogg_crc_table()
+
+# Opus granule positions are always counted at 48 kHz
+_OPUS_GRANULE_RATE = 48000
+
+# encoding: Riva AudioEncoding name ("LINEAR_PCM" or "OGGOPUS"), sample_rate: Hz
+AudioFormat = namedtuple("AudioFormat", ["encoding", "sample_rate"])
+
+
+def parse_format(name, sample_rate, default_pcm_rate):
+    """
+    Audio format requested by a client.
+
+    Parameters:
+    - name: "pcm" / "wav" / "opus" (None: pcm)
+    - sample_rate: Requested rate in Hz (None: default rate of the encoding)
+    - default_pcm_rate: Rate used for PCM when none is requested
+
+    Returns:
+    - AudioFormat, or None if the name or the rate is not supported
+    """
+    encoding = FORMATS.get(str(name or "pcm").lower())
+    if encoding is None:
+        return None
+    if encoding == "OGGOPUS":
+        allowed, default = OPUS_SAMPLE_RATES, OPUS_DEFAULT_SAMPLE_RATE
+    else:
+        allowed, default = PCM_SAMPLE_RATES, default_pcm_rate
+    try:
+        rate = int(sample_rate) if sample_rate is not None else default
+    except (TypeError, ValueError):
+        return None
+    if rate not in allowed:
+        return None
+    return AudioFormat(encoding, rate)
+
+
+def supported_formats():
+    """Formats and rates, as sent back to a client whose request was refused."""
+    return {"pcm": list(PCM_SAMPLE_RATES), "opus": list(OPUS_SAMPLE_RATES)}
+
+
+class OggOpusPager:
+    """
+    Cut an Ogg Opus byte stream into complete pages.
+
+    Bytes are fed as they arrive (pages may straddle chunks). The header
+    pages are kept aside in `header`; audio pages are returned by feed().
+    A new beginning-of-stream page (e.g. a second Ogg file) replaces the header.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._in_header = False
+        self._header_pages = []
+        self.header = b""
+        self.granule = 0  # Granule position of the last complete audio page
+        self._framed = 0  # Granule position at the end of the last frame()
+
+    def feed(self, data):
+        """
+        Add bytes and return the audio pages they complete.
+
+        Returns:
+        - list of (page bytes, granule position)
+        """
+        self._buffer += data
+        pages = []
+        while True:
+            start = self._buffer.find(b"OggS")
+            if start < 0:
+                # Keep a possible partial capture pattern
+                del self._buffer[:max(0, len(self._buffer) - 3)]
+                return pages
+            if start:
+                del self._buffer[:start]
+            if len(self._buffer) < _OGG_HEADER.size:
+                return pages
+            _, _, header_type, granule, _, _, _, segments = _OGG_HEADER.unpack_from(self._buffer)
+            table_end = _OGG_HEADER.size + segments
+            if len(self._buffer) < table_end:
+                return pages
+            page_size = table_end + sum(self._buffer[_OGG_HEADER.size:table_end])
+            if len(self._buffer) < page_size:
+                return pages
+            page = bytes(self._buffer[:page_size])
+            del self._buffer[:page_size]
+
+            payload = page[table_end:]
+            if header_type & _OGG_BOS:
+                self._in_header = True
+                self._header_pages = []
+                self._framed = 0
+            if self._in_header and (
+                payload.startswith(b"OpusHead") or payload.startswith(b"OpusTags")
+                or header_type & _OGG_CONTINUED
+            ):
+                self._header_pages.append(page)
+                self.header = b"".join(self._header_pages)
+                continue
+            self._in_header = False
+            if granule != -1:
+                self.granule = granule
+            pages.append((page, granule))
+
+    def frame(self, pages):
+        """Independently decodable frame of the next pages returned by feed()."""
+        data = frame(self.header, pages, self._framed)
+        self._framed = self.granule
+        return data
+
+
+def _ogg_pages(data):
+    """Split bytes made of complete Ogg pages into pages."""
+    offset = 0
+    while offset < len(data):
+        segments = data[offset + _OGG_HEADER.size - 1]
+        table_end = offset + _OGG_HEADER.size + segments
+        end = table_end + sum(data[offset + _OGG_HEADER.size:table_end])
+        yield data[offset:end]
+        offset = end
+
+
+def _rewrite_page(page, sequence, granule=None, clear_pre_skip=False):
+    """Copy of a page with a new sequence number (and granule position, pre-skip), CRC updated."""
+    page = bytearray(page)
+    struct.pack_into("<I", page, _OGG_SEQUENCE_OFFSET, sequence)
+    if granule is not None:
+        struct.pack_into("<q", page, _OGG_GRANULE_OFFSET, granule)
+    payload = _OGG_HEADER.size + page[_OGG_HEADER.size - 1]
+    if clear_pre_skip and page.startswith(b"OpusHead", payload):
+        struct.pack_into("<H", page, payload + _OPUS_PRE_SKIP_OFFSET, 0)
+    struct.pack_into("<I", page, _OGG_CRC_OFFSET, 0)
+    crc = 0
+    for byte in page:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _OGG_CRC_TABLE[(crc >> 24) ^ byte]
+    struct.pack_into("<I", page, _OGG_CRC_OFFSET, crc)
+    return bytes(page)
+
+
+def frame(header, pages, start_granule=0):
+    """
+    One independently decodable frame: header pages + audio pages.
+
+    Parameters:
+    - header: Header pages of the stream (OggOpusPager.header)
+    - pages: Audio pages, as returned by OggOpusPager.feed()
+    - start_granule: Granule position where the frame starts (that of the last
+      page sent before it; 0 for the first frame of the stream)
+    """
+    out = []
+    for page in _ogg_pages(header):
+        out.append(_rewrite_page(page, len(out), clear_pre_skip=start_granule > 0))
+    for page, granule in pages:
+        # -1: no packet ends on this page
+        out.append(_rewrite_page(page, len(out), granule - start_granule if granule != -1 else -1))
+    return b"".join(out)
+
+
+def split_ogg_opus(data, min_duration_ms=200):
+    """
+    Cut a complete Ogg Opus file into independently decodable frames of
+    at least min_duration_ms of audio each (the last one may be shorter).
+
+    Returns:
+    - list of bytes
+    """
+    pager = OggOpusPager()
+    frames = []
+    group = []
+    group_start = 0
+    min_granules = _OPUS_GRANULE_RATE * min_duration_ms // 1000
+    for page, granule in pager.feed(bytes(data)):
+        group.append((page, granule))
+        if granule - group_start >= min_granules:
+            frames.append(frame(pager.header, group, group_start))
+            group = []
+            group_start = granule
+    if group:
+        frames.append(frame(pager.header, group, group_start))
+    return frames
@@ -0,0 +1,140 @@
+"""
+Sentence-level synthesis pipeline for long texts
+The text is split into sentences (then clauses, if a sentence is too long)
+with French punctuation rules. Segments are synthesized concurrently, within
+a bounded window, and handed back strictly in order: the first segment is
+available as soon as it is synthesized, without waiting for the others.
+"""
+
+# Import asyncio to run the segment syntheses concurrently
+import asyncio
+
+# Import re for the splitting rules
+import re
+
+# Abbreviations whose final period does not end a sentence
+ABBREVIATIONS = {
+    "m", "mm", "mme", "mmes", "mlle", "mlles", "dr", "pr", "me", "mgr", "st", "ste",
+    "av", "bd", "etc", "cf", "env", "ex", "fig", "p", "pp", "vol", "chap", "tél", "tel",
+    "n", "no", "art", "al", "approx", "janv", "févr", "avr", "juil", "sept", "oct", "nov", "déc",
+}
+
+# End of sentence: . ! ? … (possibly repeated), then closing quotes/brackets
+# (French puts a space before », as before ! ? ; :), then whitespace
+_SENTENCE_END = re.compile(r"(\.{3}|[.!?…]+)(\s?[»”\"')\]])*(?=\s)")
+
+# Clause boundaries used to split a sentence that is too long
+_CLAUSE_END = re.compile(r"[;:,—–](?=\s)")
+
+# Spaces French typography puts before punctuation (kept attached to the sentence)
+_NO_BREAK_SPACES = re.compile("[\u00a0\u202f]")
+
+
+def _ends_with_abbreviation(chunk):
+    match = re.search(r"(?:^|[\s(«\"'])([^\W\d_]+)\.$", chunk)
+    if match is None:
+        return False
+    word = match.group(1).lower()
+    # Single capital letters are initials ("J. Dupont"), not sentence ends
+    return word in ABBREVIATIONS or len(word) == 1
+
+
+def _split_long(sentence, max_chars):
+    """Split a sentence longer than max_chars at clause boundaries, then at spaces."""
+    if len(sentence) <= max_chars:
+        return [sentence]
+    pieces = []
+    start = 0
+    for match in _CLAUSE_END.finditer(sentence):
+        end = match.end()
+        if end - start >= max_chars // 3:
+            pieces.append(sentence[start:end].strip())
+            start = end
+    pieces.append(sentence[start:].strip())
+
+    # Clauses still too long: cut at the last space before the limit
+    result = []
+    for piece in pieces:
+        while len(piece) > max_chars:
+            cut = piece.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            result.append(piece[:cut].strip())
+            piece = piece[cut:].strip()
+        if piece:
+            result.append(piece)
+    return result
+
+
+def split_sentences(text, max_chars=250, min_chars=20):
+    """
+    Split a French text into segments to synthesize.
+
+    Parameters:
+    - text: Text to split
+    - max_chars: Longer sentences are split at clause boundaries
+    - min_chars: Shorter segments are merged with the next one (avoids choppy prosody)
+
+    Returns:
+    - list of str, in order
+    """
+    text = _NO_BREAK_SPACES.sub(" ", text).strip()
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        end = match.end()
+        chunk = text[start:end].strip()
+        # "M. Dupont", "p. ex.", "3.5" (no following space) are not sentence ends
+        if match.group(1) == "." and _ends_with_abbreviation(chunk):
+            continue
+        if chunk:
+            sentences.append(chunk)
+        start = end
+    rest = text[start:].strip()
+    if rest:
+        sentences.append(rest)
+
+    segments = []
+    for sentence in sentences:
+        segments.extend(_split_long(sentence, max_chars))
+
+    merged = []
+    for segment in segments:
+        if merged and len(merged[-1]) < min_chars:
+            merged[-1] = f"{merged[-1]} {segment}"
+        else:
+            merged.append(segment)
+    return merged
+
+
+def silence(duration_ms, sample_rate):
+    """Digital silence (16-bit mono PCM) inserted between segments."""
+    return bytes(2 * (sample_rate * duration_ms // 1000))
+
+
+async def synthesize_in_order(segments, synthesize, max_in_flight=3):
+    """
+    Synthesize segments concurrently and yield their audio in order.
+
+    Parameters:
+    - segments: list of str
+    - synthesize: Coroutine function called as synthesize(segment) → audio
+    - max_in_flight: Segments synthesized ahead of the one being yielded
+
+    Yields:
+    - (index, audio), in segment order, each as soon as it and all previous ones are ready
+    """
+    tasks = {}
+    next_to_start = 0
+    try:
+        for index in range(len(segments)):
+            # Keep the window full: segment `index` plus the ones right after it
+            while next_to_start < len(segments) and next_to_start < index + max_in_flight:
+                tasks[next_to_start] = asyncio.ensure_future(synthesize(segments[next_to_start]))
+                next_to_start += 1
+            audio = await tasks.pop(index)
+            yield index, audio
+    finally:
+        # Consumer gone or error: do not synthesize the rest
+        for task in tasks.values():
+            task.cancel()
@@ -0,0 +1,126 @@
+"""
+Per-connection TTS request queue with barge-in
+Each connection processes its requests one at a time, in a task of their
+own, so the connection keeps reading messages while audio is produced. What
+happens to a request that arrives while another one is running depends on
+its policy:
+- queue: wait behind the running and queued requests (bounded)
+- replace: barge-in; cancel the running request and drop the queued ones
+- reject: refused if the connection is busy
+Cancelling a request cancels its synthesis RPC (see tts.py).
+"""
+
+# Import asyncio for the worker task
+import asyncio
+
+# Import deque for the waiting requests
+from collections import deque
+
+POLICY_QUEUE = "queue"
+POLICY_REPLACE = "replace"
+POLICY_REJECT = "reject"
+POLICIES = (POLICY_QUEUE, POLICY_REPLACE, POLICY_REJECT)
+
+
+class RequestQueue:
+    """
+    Requests of one connection, processed in order by a worker task.
+
+    Parameters:
+    - process: Coroutine function called as process(request); it reports its own errors
+    - max_queued: Waiting requests beyond which new ones are rejected (policy "queue")
+    - on_cancelled: Coroutine function called as on_cancelled(request) for each
+      cancelled request; for the running one, before the next request starts
+    """
+
+    def __init__(self, process, max_queued=8, on_cancelled=None):
+        self._process = process
+        self.max_queued = max_queued
+        self._on_cancelled = on_cancelled
+        self._pending = deque()
+        self._current = None  # Task of the request being processed
+        self._worker = None
+
+        # Counters
+        self.accepted = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.failed = 0  # Requests whose process() raised
+
+    @property
+    def busy(self):
+        """True if a request is running or waiting."""
+        return bool(self._pending) or (self._current is not None and not self._current.done())
+
+    @property
+    def waiting(self):
+        return len(self._pending)
+
+    def submit(self, request, policy=POLICY_QUEUE):
+        """
+        Add a request according to its policy.
+
+        Returns:
+        - True if accepted, False if rejected (connection busy or queue full)
+        """
+        if policy == POLICY_REPLACE:
+            self.cancel()
+        elif policy == POLICY_REJECT and self.busy:
+            self.rejected += 1
+            return False
+        elif len(self._pending) >= self.max_queued:
+            self.rejected += 1
+            return False
+        self._pending.append(request)
+        self.accepted += 1
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run())
+        return True
+
+    def cancel(self):
+        """
+        Drop the waiting requests and cancel the running one.
+
+        Returns:
+        - int: Number of requests cancelled
+        """
+        count = len(self._pending)
+        dropped = list(self._pending)
+        self._pending.clear()
+        if self._current is not None and not self._current.done():
+            self._current.cancel()
+            count += 1
+        self.cancelled += count
+        if self._on_cancelled is not None:
+            for request in dropped:
+                asyncio.ensure_future(self._on_cancelled(request))
+        return count
+
+    async def _run(self):
+        while self._pending:
+            request = self._pending.popleft()
+            self._current = asyncio.ensure_future(self._process(request))
+            # wait() does not propagate the request's cancellation to the worker
+            await asyncio.wait([self._current])
+            if self._current.cancelled():
+                if self._on_cancelled is not None:
+                    await self._on_cancelled(request)
+            elif self._current.exception() is not None:
+                self.failed += 1
+        self._current = None
+
+    def close(self):
+        """Cancel everything (connection closed)."""
+        self.cancel()
+        if self._worker is not None:
+            self._worker.cancel()
+
+    def stats(self):
+        return {
+            "busy": self.busy,
+            "waiting": self.waiting,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+        }
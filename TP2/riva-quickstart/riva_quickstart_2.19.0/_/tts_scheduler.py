@@ -0,0 +1,133 @@
+"""
+Fair, bounded scheduling of blocking Riva TTS calls
+Synthesis runs in a thread pool, never on the asyncio event loop. A global
+limit caps the RPCs in flight (match it to the capacity of the Riva server),
+and connections are served round-robin: a client that queues many requests
+gets one slot at a time and cannot starve the others.
+"""
+
+# Import asyncio for futures resolved on the event loop
+import asyncio
+
+# Import OrderedDict to rotate between clients, deque for their queues
+from collections import OrderedDict, deque
+
+# Import ThreadPoolExecutor to run the blocking gRPC calls
+from concurrent.futures import ThreadPoolExecutor
+
+# Import functools to bind the call arguments
+import functools
+
+
+class FairSynthesisScheduler:
+    """
+    Run blocking synthesis calls off the event loop, fairly across clients.
+
+    Parameters:
+    - max_concurrent: Maximum synthesis calls in flight (all clients)
+    - per_client: Maximum calls in flight for one client
+    - executor: Thread pool to use (default: one with max_concurrent threads)
+    """
+
+    def __init__(self, max_concurrent=4, per_client=1, executor=None):
+        self.max_concurrent = max_concurrent
+        self.per_client = per_client
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix="tts"
+        )
+        self._queues = OrderedDict()  # client → deque of waiting jobs, in rotation order
+        self._in_flight = {}  # client → calls running
+        self.active = 0
+
+        # Counters
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.max_waiting = 0
+
+    @property
+    def waiting(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def busy(self):
+        """True if a new request would have to wait."""
+        return self.active >= self.max_concurrent
+
+    async def run(self, client, fn, *args, limit=None):
+        """
+        Run fn(*args) in the thread pool when a slot is free for this client.
+
+        `limit` overrides per_client for this call (e.g. the segments of one
+        pipelined request may run side by side).
+        If the caller is cancelled before the call starts, the call is dropped.
+        A call already running finishes in its thread and still holds its slot.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        job = (functools.partial(fn, *args), future, limit or self.per_client)
+        self._queues.setdefault(client, deque()).append(job)
+        self.submitted += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        self._dispatch()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            queue = self._queues.get(client)
+            if queue is not None and job in queue:
+                queue.remove(job)
+                if not queue:
+                    del self._queues[client]
+            self.cancelled += 1
+            raise
+
+    def _dispatch(self):
+        """Start waiting calls, one client after the other, while slots are free."""
+        while self.active < self.max_concurrent:
+            client = next(
+                (c for c, queue in self._queues.items() if self._in_flight.get(c, 0) < queue[0][2]),
+                None
+            )
+            if client is None:
+                return
+            # Take the client's next job and move it to the end of the rotation
+            queue = self._queues.pop(client)
+            call, future, _ = queue.popleft()
+            if queue:
+                self._queues[client] = queue
+            if future.done():
+                continue
+            self._start(client, call, future)
+
+    def _start(self, client, call, future):
+        self.active += 1
+        self._in_flight[client] = self._in_flight.get(client, 0) + 1
+        task = asyncio.get_running_loop().run_in_executor(self._executor, call)
+        task.add_done_callback(functools.partial(self._finish, client, future))
+
+    def _finish(self, client, future, task):
+        self.active -= 1
+        self._in_flight[client] -= 1
+        if not self._in_flight[client]:
+            del self._in_flight[client]
+        self.completed += 1
+        if not future.done():
+            if task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+        self._dispatch()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "capacity": self.max_concurrent,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "max_waiting": self.max_waiting,
+        }
@@ -0,0 +1,125 @@
+"""
+Single-flight de-duplication of identical in-flight syntheses
+The first request for a key starts the synthesis; identical requests that
+arrive while it runs attach to it and receive the same chunks, from the
+first one, as they arrive. The synthesis runs in its own task, owned by no
+request: a subscriber that leaves only detaches, and the synthesis is
+cancelled when the last subscriber is gone.
+"""
+
+# Import asyncio for the synthesis task and the chunk notifications
+import asyncio
+
+
+class Flight:
+    """
+    One synthesis shared by the requests with the same key.
+    Chunks are kept until the end, so a late subscriber replays them from the start.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def push(self, chunk):
+        """Add a chunk (on the event loop)."""
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def stream(self):
+        """Yield every chunk, from the first one, as they arrive; raise the synthesis error, if any."""
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+    async def audio(self):
+        """The complete audio, once the synthesis is done."""
+        async for _ in self.stream():
+            pass
+        return self.chunks[0] if len(self.chunks) == 1 else b"".join(self.chunks)
+
+
+class SingleFlight:
+    """Registry of the syntheses in flight, by key."""
+
+    def __init__(self):
+        self._flights = {}
+
+        # Counters
+        self.started = 0
+        self.joined = 0
+        self.aborted = 0
+
+    def __contains__(self, key):
+        return key in self._flights
+
+    def attach(self, key, start):
+        """
+        Subscribe to the synthesis of `key`, starting it if none is in flight.
+
+        Parameters:
+        - key: Request key (text, voice, language, format, streaming mode)
+        - start: Coroutine function called as start(flight); it pushes the chunks
+
+        Returns:
+        - Flight (call detach(flight) when done with it, even on error)
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(key)
+            self._flights[key] = flight
+            flight.task = asyncio.ensure_future(start(flight))
+            flight.task.add_done_callback(lambda task: self._finish(flight, task))
+            self.started += 1
+        else:
+            self.joined += 1
+        flight.subscribers += 1
+        return flight
+
+    def detach(self, flight):
+        """Unsubscribe; the last subscriber to leave cancels an unfinished synthesis."""
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and not flight.done:
+            self._forget(flight)
+            flight.task.cancel()
+            self.aborted += 1
+
+    def _finish(self, flight, task):
+        self._forget(flight)
+        if task.cancelled():
+            flight.finish(asyncio.CancelledError())
+        else:
+            flight.finish(task.exception())
+
+    def _forget(self, flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def stats(self):
+        return {
+            "in_flight": len(self._flights),
+            "started": self.started,
+            "joined": self.joined,
+            "aborted": self.aborted,
+        }
@@ -0,0 +1,143 @@
+"""
+Voice-activity gating before audio is sent to Riva
+A vectorized NumPy energy / zero-crossing detector (the same mean absolute
+amplitude as the volume meter in test_riva.py) decides whether each chunk
+contains speech. Silence is not sent to Riva: only a short keep-alive frame
+every few seconds keeps the stream valid. A hangover window keeps sending a
+little audio after speech so Riva can finalize, and a pre-roll buffer
+replays the audio just before the onset so the first syllable is not clipped.
+"""
+
+# Import deque for the pre-roll buffer
+from collections import deque
+
+# Import numpy for vectorized per-frame energy and zero-crossing rate
+import numpy as np
+
+
+class VoiceActivityGate:
+    """
+    Decide, chunk by chunk, what audio to forward to Riva.
+
+    Parameters:
+    - sample_rate: Audio sample rate in Hz (16-bit mono PCM)
+    - energy_threshold: Minimum mean absolute amplitude of a speech frame
+    - noise_ratio: A frame is speech if louder than noise_ratio x the noise floor
+    - fricative_zcr: Zero-crossing rate above which quieter frames (s, f, ch) count as speech
+    - frame_ms: Analysis frame length inside a chunk
+    - min_speech_ratio: Fraction of speech frames needed to call a chunk speech
+    - hangover_ms: Audio still sent after the last speech chunk
+    - preroll_ms: Audio replayed from before the speech onset
+    - keepalive_interval: Seconds between keep-alive frames while gated off
+    - keepalive_ms: Length of one keep-alive frame (digital silence)
+    """
+
+    def __init__(self, sample_rate=16000, energy_threshold=300, noise_ratio=3.0,
+                 fricative_zcr=0.25, frame_ms=10, min_speech_ratio=0.2,
+                 hangover_ms=600, preroll_ms=300, keepalive_interval=2.0, keepalive_ms=20):
+        self.sample_rate = sample_rate
+        self.energy_threshold = energy_threshold
+        self.noise_ratio = noise_ratio
+        self.fricative_zcr = fricative_zcr
+        self.frame_samples = max(1, sample_rate * frame_ms // 1000)
+        self.min_speech_ratio = min_speech_ratio
+        self.hangover_samples = sample_rate * hangover_ms // 1000
+        self.preroll_samples = sample_rate * preroll_ms // 1000
+        self.keepalive_samples = int(sample_rate * keepalive_interval)
+        self.keepalive_frame = bytes(2 * (sample_rate * keepalive_ms // 1000))
+
+        self.noise_floor = float(energy_threshold) / noise_ratio
+        self._preroll = deque()  # Chunks held back while gated off
+        self._preroll_samples = 0
+        self._hangover_left = 0  # Samples still to send after speech
+        self._since_keepalive = 0  # Gated-off samples since the last keep-alive
+        self.active = False  # True while speech or hangover audio is being forwarded
+
+        # Counters (in samples)
+        self.total_samples = 0
+        self.forwarded_samples = 0
+        self.suppressed_samples = 0
+        self.keepalive_frames = 0
+
+    def is_speech(self, chunk):
+        """Return True if the chunk (16-bit PCM bytes) contains speech."""
+        samples = np.frombuffer(chunk, dtype=np.int16)
+        usable = len(samples) - len(samples) % self.frame_samples
+        if usable == 0:
+            return False
+
+        # One row per analysis frame: all frames are evaluated at once
+        frames = samples[:usable].reshape(-1, self.frame_samples).astype(np.int32)
+        energy = np.abs(frames).mean(axis=1)
+        signs = np.signbit(frames)
+        zcr = (signs[:, 1:] != signs[:, :-1]).mean(axis=1)
+
+        threshold = max(self.energy_threshold, self.noise_floor * self.noise_ratio)
+        voiced = energy >= threshold
+        fricative = (energy >= threshold / 2) & (zcr >= self.fricative_zcr)
+        speech_ratio = (voiced | fricative).mean()
+
+        if speech_ratio < self.min_speech_ratio:
+            # Track the background level on non-speech audio only
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * float(np.median(energy))
+            return False
+        return True
+
+    def process(self, chunk):
+        """
+        Feed one captured chunk.
+
+        Returns:
+        - list of byte chunks to send to Riva (possibly empty)
+        """
+        count = len(chunk) // 2
+        self.total_samples += count
+
+        if self.is_speech(chunk):
+            self._hangover_left = self.hangover_samples
+            out = list(self._preroll)  # Speech onset: replay what came just before
+            out.append(chunk)
+            self._preroll.clear()
+            self._preroll_samples = 0
+        elif self._hangover_left > 0:
+            self._hangover_left -= count
+            out = [chunk]
+        else:
+            out = None
+
+        if out is not None:
+            self.active = True
+            self._since_keepalive = 0
+            self.forwarded_samples += sum(len(piece) for piece in out) // 2
+            return out
+
+        # Gated off: keep the chunk for pre-roll, send only an occasional keep-alive
+        self.active = False
+        self._preroll.append(chunk)
+        self._preroll_samples += count
+        while self._preroll and self._preroll_samples - len(self._preroll[0]) // 2 >= self.preroll_samples:
+            dropped = self._preroll.popleft()
+            self._preroll_samples -= len(dropped) // 2
+            self.suppressed_samples += len(dropped) // 2
+
+        self._since_keepalive += count
+        if self._since_keepalive >= self.keepalive_samples:
+            self._since_keepalive = 0
+            self.keepalive_frames += 1
+            return [self.keepalive_frame]
+        return []
+
+    def suppressed_ratio(self):
+        """Fraction of the captured audio that was not sent to Riva."""
+        if self.total_samples == 0:
+            return 0.0
+        return self.suppressed_samples / self.total_samples
+
+    def stats(self):
+        return {
+            "audio_seconds": round(self.total_samples / self.sample_rate, 1),
+            "forwarded_seconds": round(self.forwarded_samples / self.sample_rate, 1),
+            "suppressed_ratio": round(self.suppressed_ratio(), 3),
+            "keepalive_frames": self.keepalive_frames,
+            "noise_floor": round(self.noise_floor, 1),
+        }
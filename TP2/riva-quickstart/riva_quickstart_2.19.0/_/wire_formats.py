@@ -0,0 +1,172 @@
+"""
+Wire encodings for messages sent to WebSocket clients
+JSON stays the default. A client can ask for a more compact encoding when it
+connects (ws://host:port/?encoding=msgpack or ?encoding=binary): MessagePack,
+or a small fixed binary header followed by the UTF-8 text, which avoids
+repeating the keys of every interim update. A message is encoded at most once
+per encoding, however many clients share that encoding.
+
+Binary frame layout (little-endian, 14-byte header):
+
+    offset  size  field
+    0       1     type code (see TYPE_CODES; 0 = other, text is the JSON message)
+    1       1     flags (bit 0: is_final, bit 1: wall-clock time follows)
+    2       4     session id (0 = none)
+    6       8     timestamp (float64, event loop time)
+    14      8     only with flag bit 1: time (float64, epoch seconds of a final,
+                  the value a client passes back as "since")
+    14/22   ...   text, UTF-8
+
+A message with fields the layout does not carry is sent with code 0.
+"""
+
+# Import json for the default encoding
+import json
+
+# Import struct for the binary frame header
+import struct
+
+# Import parse_qs to read the encoding requested in the connection URL
+from urllib.parse import parse_qs, urlsplit
+
+# MessagePack is optional: without it, clients asking for it get JSON
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ENCODING_JSON = "json"
+ENCODING_MSGPACK = "msgpack"
+ENCODING_BINARY = "binary"
+ENCODINGS = (ENCODING_JSON, ENCODING_MSGPACK, ENCODING_BINARY)
+
+# Message types with a dedicated code in the binary layout
+TYPE_CODES = {"transcription": 1, "status": 2, "error": 3}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+BINARY_HEADER = struct.Struct("<BBId")
+BINARY_TIME = struct.Struct("<d")
+FLAG_FINAL = 0x01
+FLAG_TIME = 0x02
+
+# Fields of a message that the binary layout carries
+BINARY_FIELDS = frozenset(("type", "text", "is_final", "session", "timestamp", "time"))
+
+
+def available_encodings():
+    """Return the encodings this server can produce."""
+    return tuple(e for e in ENCODINGS if e != ENCODING_MSGPACK or msgpack is not None)
+
+
+def websocket_path(websocket):
+    """URL path of a connection (websockets >= 13 keeps it on the request)."""
+    request = getattr(websocket, "request", None)
+    return getattr(request, "path", None) or getattr(websocket, "path", "") or ""
+
+
+def negotiate(path):
+    """
+    Pick the encoding requested in the connection path (?encoding=...).
+
+    Returns:
+    - (encoding, note): note explains a fallback to JSON, or is None
+    """
+    query = parse_qs(urlsplit(path or "").query)
+    requested = (query.get("encoding") or [ENCODING_JSON])[0].lower()
+    if requested in available_encodings():
+        return requested, None
+    if requested == ENCODING_MSGPACK:
+        return ENCODING_JSON, "msgpack is not installed on the server, using json"
+    return ENCODING_JSON, f"unknown encoding '{requested}', using json"
+
+
+def _encode_binary(message):
+    code = TYPE_CODES.get(message.get("type"), 0)
+    if code and not BINARY_FIELDS.issuperset(message):
+        code = 0  # A field the layout would drop: carry the whole message as JSON
+    flags = FLAG_FINAL if message.get("is_final") else 0
+    extra = b""
+    if code == 0:
+        # No dedicated layout for this message: carry it as JSON
+        text = json.dumps(message, separators=(",", ":"))
+    else:
+        text = message.get("text", "")
+        if message.get("time") is not None:
+            flags |= FLAG_TIME
+            extra = BINARY_TIME.pack(message["time"])
+    header = BINARY_HEADER.pack(
+        code, flags, message.get("session") or 0, message.get("timestamp") or 0.0
+    )
+    return header + extra + text.encode("utf-8")
+
+
+def encode(message, encoding=ENCODING_JSON):
+    """
+    Serialize a message (dict) for the wire.
+
+    Returns:
+    - str for JSON (sent as a text frame), bytes otherwise (binary frame)
+    """
+    if encoding == ENCODING_JSON:
+        return json.dumps(message)
+    if encoding == ENCODING_MSGPACK:
+        return msgpack.packb(message, use_bin_type=True)
+    if encoding == ENCODING_BINARY:
+        return _encode_binary(message)
+    raise ValueError(f"Unknown encoding: {encoding}")
+
+
+def decode(payload, encoding=ENCODING_JSON):
+    """Inverse of encode(), for clients and tests."""
+    if encoding == ENCODING_JSON:
+        return json.loads(payload)
+    if encoding == ENCODING_MSGPACK:
+        return msgpack.unpackb(payload, raw=False)
+    if encoding == ENCODING_BINARY:
+        code, flags, session, timestamp = BINARY_HEADER.unpack_from(payload)
+        offset = BINARY_HEADER.size
+        wall_time = None
+        if code and flags & FLAG_TIME:
+            wall_time, = BINARY_TIME.unpack_from(payload, offset)
+            offset += BINARY_TIME.size
+        text = bytes(payload[offset:]).decode("utf-8")
+        if code == 0:
+            return json.loads(text)
+        message = {
+            "type": TYPE_NAMES.get(code, "unknown"),
+            "text": text,
+            "is_final": bool(flags & FLAG_FINAL),
+            "timestamp": timestamp,
+        }
+        if session:
+            message["session"] = session
+        if wall_time is not None:
+            message["time"] = wall_time
+        return message
+    raise ValueError(f"Unknown encoding: {encoding}")
+
+
+class EncodedMessage:
+    """
+    One outgoing message, encoded lazily and at most once per encoding.
+
+    Parameters:
+    - message: The message dict
+    """
+
+    __slots__ = ("message", "_payloads")
+
+    def __init__(self, message):
+        self.message = message
+        self._payloads = {}
+
+    def payload(self, encoding):
+        payload = self._payloads.get(encoding)
+        if payload is None:
+            payload = self._payloads[encoding] = encode(self.message, encoding)
+        return payload
+
+    @property
+    def encodings(self):
+        """Encodings produced so far (for stats)."""
+        return tuple(self._payloads)
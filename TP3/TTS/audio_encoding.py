@@ -0,0 +1,125 @@
+# Encodage en mémoire de la forme d'onde produite par Coqui TTS (WAV ou PCM brut)
+# Remplace le passage par tts_to_file + fichier temporaire : pas de dossier créé,
+# pas d'écriture ni de relecture disque à chaque requête.
+
+# numpy sert à normaliser et convertir les échantillons en entiers 16 bits
+import numpy as np
+
+# struct permet d'écrire l'en-tête WAV directement dans le tampon
+import struct
+
+# threading : chaque thread du pool de FastAPI garde son propre tampon
+import threading
+
+# En-tête WAV PCM 16 bits mono (44 octets), identique à celui écrit par scipy.io.wavfile
+WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+
+# Formats de sortie acceptés et leur type MIME
+MEDIA_TYPES = {
+    "wav": "audio/wav",
+    "pcm": "audio/L16",
+}
+
+
+class AudioEncoder:
+    """
+    Encode une forme d'onde flottante en WAV ou en PCM 16 bits little-endian.
+    La normalisation est celle de Coqui (save_wav) : le résultat est identique,
+    octet pour octet, au fichier qu'écrivait tts_to_file.
+    Le tampon de sortie est réutilisé d'une requête à l'autre (un par thread).
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _buffer(self, size):
+        """Tampon du thread courant, agrandi si besoin (jamais réduit)."""
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None or len(buffer) < size:
+            buffer = bytearray(max(size, 2 * len(buffer or b"")))
+            self._local.buffer = buffer
+        return buffer
+
+    def encode(self, wav, sample_rate, audio_format="wav"):
+        """
+        Encode la forme d'onde.
+
+        Paramètres :
+        - wav : liste, tableau numpy ou tenseur de flottants dans [-1, 1]
+        - sample_rate : fréquence d'échantillonnage du modèle
+        - audio_format : "wav" (fichier complet) ou "pcm" (échantillons bruts)
+
+        Retourne :
+        - bytes
+        """
+        if audio_format not in MEDIA_TYPES:
+            raise ValueError(f"Format audio non supporté: {audio_format} (disponibles: {', '.join(MEDIA_TYPES)})")
+
+        # Tenseur PyTorch → numpy, liste → numpy (comme Synthesizer.save_wav)
+        if hasattr(wav, "cpu"):
+            wav = wav.cpu().numpy()
+        samples = np.asarray(wav).reshape(-1)
+        count = samples.size
+
+        header_size = WAV_HEADER.size if audio_format == "wav" else 0
+        data_size = 2 * count
+        total = header_size + data_size
+        buffer = self._buffer(total)
+
+        if header_size:
+            WAV_HEADER.pack_into(
+                buffer, 0,
+                b"RIFF", total - 8, b"WAVE",
+                b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+                b"data", data_size,
+            )
+
+        if count:
+            # Même normalisation que Coqui : le pic est ramené à 32767 (gain limité à 1/0.01)
+            scale = 32767 / max(0.01, float(np.max(np.abs(samples))))
+            # Conversion écrite directement dans le tampon (troncature, comme astype(np.int16))
+            pcm = np.frombuffer(buffer, dtype="<i2", count=count, offset=header_size)
+            np.multiply(samples, scale, out=pcm, casting="unsafe")
+
+        # Copie finale : le tampon sera réutilisé par la requête suivante du thread
+        return bytes(memoryview(buffer)[:total])
+
+
+# Encodeur partagé par les endpoints (sûr entre threads)
+encoder = AudioEncoder()
+
+
+def encode_audio(wav, sample_rate, audio_format="wav"):
+    """Encode la forme d'onde avec l'encodeur partagé (voir AudioEncoder.encode)."""
+    return encoder.encode(wav, sample_rate, audio_format)
+
+
+def wav_stream_header(sample_rate):
+    """
+    En-tête WAV d'un flux dont la longueur n'est pas connue à l'avance
+    (tailles à 0xFFFFFFFF, convention comprise par les lecteurs en streaming).
+    """
+    return WAV_HEADER.pack(
+        b"RIFF", 0xFFFFFFFF, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", 0xFFFFFFFF,
+    )
+
+
+def encode_chunk(wav):
+    """
+    Morceau de forme d'onde → PCM 16 bits little-endian, pour le streaming.
+    Le pic de l'énoncé complet n'est pas encore connu : pas de normalisation,
+    les échantillons sont seulement écrêtés à [-1, 1].
+    """
+    if hasattr(wav, "cpu"):
+        wav = wav.cpu().numpy()
+    samples = np.clip(np.asarray(wav, dtype=np.float32).reshape(-1), -1.0, 1.0)
+    return (samples * 32767).astype("<i2").tobytes()
+
+
+def media_type(audio_format, sample_rate):
+    """Type MIME de la réponse (le PCM brut précise sa fréquence et son nombre de canaux)."""
+    if audio_format == "pcm":
+        return f"{MEDIA_TYPES['pcm']};rate={sample_rate};channels=1"
+    return MEDIA_TYPES[audio_format]
@@ -0,0 +1,58 @@
+# Réponse HTTP en streaming (transfert chunked) de l'audio généré morceau par morceau
+# Le premier morceau est généré avant d'envoyer les en-têtes : le temps jusqu'au
+# premier morceau est ainsi mesuré et renvoyé dans l'en-tête X-Time-To-First-Chunk-Ms,
+# et une erreur du modèle peut encore être renvoyée avec un vrai code HTTP.
+
+# time pour mesurer le temps jusqu'au premier morceau
+import time
+
+# StreamingResponse envoie le corps en transfert chunked au fil de l'itération
+from fastapi.responses import StreamingResponse
+
+# Encodage des morceaux (PCM 16 bits) et de l'en-tête WAV de streaming
+from audio_encoding import encode_chunk, media_type, wav_stream_header
+
+
+def stream_response(chunks, sample_rate, audio_format="wav"):
+    """
+    Réponse HTTP qui envoie l'audio au fur et à mesure de sa génération.
+
+    Paramètres :
+    - chunks : itérable de formes d'onde (listes, tableaux numpy ou tenseurs), produites par le modèle
+    - sample_rate : fréquence d'échantillonnage du modèle
+    - audio_format : "wav" (en-tête de streaming puis PCM) ou "pcm" (PCM brut)
+
+    Retourne :
+    - StreamingResponse ; une exception du modèle sur le premier morceau est levée ici
+    """
+    start = time.perf_counter()
+    chunks = iter(chunks)
+    first = next(chunks, None)  # Génère le premier morceau (les suivants pendant l'envoi)
+    ttfc_ms = (time.perf_counter() - start) * 1000
+
+    def body():
+        if audio_format == "wav":
+            yield wav_stream_header(sample_rate)
+        if first is None:
+            return
+        yield encode_chunk(first)
+        try:
+            for chunk in chunks:
+                yield encode_chunk(chunk)
+        except Exception as e:
+            # Les en-têtes sont déjà partis : le flux est seulement interrompu
+            print(f"✗ Streaming interrupted: {e}")
+        finally:
+            # Client parti ou fin du texte : arrêter la génération
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+    return StreamingResponse(
+        body(),
+        media_type=media_type(audio_format, sample_rate),
+        headers={
+            "X-Time-To-First-Chunk-Ms": f"{ttfc_ms:.0f}",
+            "X-Sample-Rate": str(sample_rate),
+        },
+    )
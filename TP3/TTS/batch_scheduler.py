@@ -0,0 +1,170 @@
+# Micro-batching des inférences : les requêtes qui arrivent à quelques millisecondes
+# d'intervalle sont regroupées et exécutées en un seul passage du modèle.
+# Un thread unique exécute les lots : le modèle n'est jamais utilisé par deux
+# requêtes à la fois, et le CPU travaille sur des lots plutôt qu'à taille 1.
+
+# threading pour le thread des lots et la file d'attente partagée
+import threading
+
+# time pour les délais d'attente et les métriques
+import time
+
+# Future : résultat attendu par le thread de la requête
+from concurrent.futures import Future
+
+# Counter et deque pour les métriques (tailles de lots, délais récents)
+from collections import Counter, deque
+
+
+class _Pending:
+    """Une entrée en attente dans la file."""
+
+    def __init__(self, item, length, group):
+        self.item = item
+        self.length = max(1, length)
+        self.group = group
+        self.arrived = time.monotonic()
+        self.future = Future()
+
+
+class BatchScheduler:
+    """
+    Regroupe les entrées soumises en lots exécutés par run_batch.
+
+    Paramètres :
+    - run_batch : fonction(liste d'entrées) → liste de résultats, dans le même ordre
+    - max_batch_size : nombre maximal d'entrées par lot
+    - max_wait_ms : attente maximale après l'arrivée de la plus ancienne entrée
+    - max_length_ratio : écart de longueur maximal dans un lot (le remplissage
+      des entrées courtes jusqu'à la plus longue est du calcul perdu)
+
+    Seules les entrées du même groupe sont regroupées ; le groupe None
+    signifie « à exécuter seule ».
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=15, max_length_ratio=1.5):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_length_ratio = max_length_ratio
+
+        self._pending = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._worker.start()
+
+        # Métriques
+        self.batch_sizes = Counter()
+        self.queue_delays = deque(maxlen=10000)  # Secondes entre l'arrivée et le début du lot
+        self.run_times = deque(maxlen=1000)  # Secondes par lot
+        self.failed = 0
+
+    def submit_future(self, item, length, group="default"):
+        """Ajouter une entrée ; retourne un concurrent.futures.Future de son résultat."""
+        pending = _Pending(item, length, group)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Batch scheduler is closed")
+            self._pending.append(pending)
+            self._condition.notify()
+        return pending.future
+
+    def submit(self, item, length, group="default"):
+        """Ajouter une entrée et attendre son résultat (depuis un thread de requête)."""
+        return self.submit_future(item, length, group).result()
+
+    def _take_batch(self):
+        """Retirer de la file le prochain lot : la plus ancienne entrée et celles de longueur proche."""
+        oldest = self._pending[0]
+        batch = [oldest]
+        if oldest.group is not None:
+            low, high = oldest.length / self.max_length_ratio, oldest.length * self.max_length_ratio
+            for pending in self._pending[1:]:
+                if len(batch) >= self.max_batch_size:
+                    break
+                if pending.group == oldest.group and low <= pending.length <= high:
+                    batch.append(pending)
+        taken = set(map(id, batch))
+        self._pending = [pending for pending in self._pending if id(pending) not in taken]
+        return batch
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed and not self._pending:
+                    return
+                # Laisser le lot se remplir jusqu'à max_wait après la plus ancienne entrée
+                # (sauf si elle est du groupe None : elle part seule, sans attendre)
+                oldest = self._pending[0]
+                deadline = oldest.arrived + self.max_wait
+                while (oldest.group is not None and len(self._pending) < self.max_batch_size
+                       and not self._closed):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._take_batch()
+
+            # Entrées annulées entre-temps (client parti) : ignorées
+            batch = [pending for pending in batch if pending.future.set_running_or_notify_cancel()]
+            if batch:
+                self._execute(batch)
+
+    def _execute(self, batch):
+        started = time.monotonic()
+        for pending in batch:
+            self.queue_delays.append(started - pending.arrived)
+        self.batch_sizes[len(batch)] += 1
+        try:
+            results = self.run_batch([pending.item for pending in batch])
+            for pending, result in zip(batch, results):
+                pending.future.set_result(result)
+        except Exception as e:
+            if len(batch) == 1:
+                self.failed += 1
+                batch[0].future.set_exception(e)
+            else:
+                # Une entrée fautive ne doit pas faire échouer les autres : une par une
+                for pending in batch:
+                    try:
+                        pending.future.set_result(self.run_batch([pending.item])[0])
+                    except Exception as item_error:
+                        self.failed += 1
+                        pending.future.set_exception(item_error)
+        self.run_times.append(time.monotonic() - started)
+
+    def close(self):
+        """Terminer les entrées en attente puis arrêter le thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._worker.join()
+
+    def stats(self):
+        batches = sum(self.batch_sizes.values())
+        items = sum(size * count for size, count in self.batch_sizes.items())
+        delays = sorted(self.queue_delays)
+
+        def percentile_ms(fraction):
+            if not delays:
+                return None
+            return round(delays[min(len(delays) - 1, int(fraction * len(delays)))] * 1000, 2)
+
+        return {
+            "queued": len(self._pending),
+            "batches": batches,
+            "items": items,
+            "failed": self.failed,
+            "mean_batch_size": round(items / batches, 2) if batches else None,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "queue_delay_ms": {
+                "p50": percentile_ms(0.50),
+                "p95": percentile_ms(0.95),
+                "p99": percentile_ms(0.99),
+                "max": round(delays[-1] * 1000, 2) if delays else None,
+            },
+            "mean_batch_ms": round(sum(self.run_times) / len(self.run_times) * 1000, 2) if self.run_times else None,
+        }
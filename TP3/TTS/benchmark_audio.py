@@ -0,0 +1,99 @@
+# Benchmark du coût par requête de la sortie audio, hors modèle
+# Compare l'ancien chemin de /tts/wav (dossier temporaire + tts_to_file + relecture
+# du fichier) à l'encodage en mémoire d'audio_encoding.py, sur des formes d'onde
+# de plusieurs durées, avec un ou plusieurs threads (comme le pool de FastAPI).
+#
+# Usage :
+#   python benchmark_audio.py
+#   python benchmark_audio.py --durations 1 5 20 --threads 1 8 --requests 200
+
+# argparse pour les options en ligne de commande
+import argparse
+
+# os et tempfile reproduisent l'ancien chemin (fichier temporaire)
+import os
+import tempfile
+
+# time pour mesurer chaque requête
+import time
+
+# ThreadPoolExecutor simule les requêtes concurrentes
+from concurrent.futures import ThreadPoolExecutor
+
+# numpy pour générer les formes d'onde de test
+import numpy as np
+
+# scipy.io.wavfile est utilisé par Coqui pour écrire le WAV (save_wav)
+import scipy.io.wavfile
+
+# Encodage en mémoire
+from audio_encoding import encode_audio
+
+
+def legacy_wav(wav, sample_rate):
+    """Ancien chemin : Synthesizer.save_wav dans un dossier temporaire, puis relecture."""
+    with tempfile.TemporaryDirectory() as td:
+        out_path = os.path.join(td, "out.wav")
+        wav_norm = wav * (32767 / max(0.01, np.max(np.abs(wav))))
+        scipy.io.wavfile.write(out_path, sample_rate, wav_norm.astype(np.int16))
+        with open(out_path, "rb") as f:
+            return f.read()
+
+
+def in_memory_wav(wav, sample_rate):
+    return encode_audio(wav, sample_rate, "wav")
+
+
+def in_memory_pcm(wav, sample_rate):
+    return encode_audio(wav, sample_rate, "pcm")
+
+
+def measure(function, wav, sample_rate, requests, threads):
+    """Durées (ms) de `requests` appels répartis sur `threads` threads."""
+    def one(_):
+        start = time.perf_counter()
+        function(wav, sample_rate)
+        return (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, range(threads)))  # Échauffement (tampons, cache disque)
+        return sorted(pool.map(one, range(requests)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coût par requête de la sortie audio (sans modèle)")
+    parser.add_argument("--durations", type=float, nargs="+", default=[1, 5, 20],
+                        help="Durées d'audio testées (secondes)")
+    parser.add_argument("--sample-rate", type=int, default=22050,
+                        help="Fréquence (22050 : VITS, 24000 : XTTS v2)")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8],
+                        help="Requêtes simultanées")
+    parser.add_argument("--requests", type=int, default=200, help="Requêtes par mesure")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    paths = [("tempfile + relecture", legacy_wav), ("mémoire WAV", in_memory_wav), ("mémoire PCM", in_memory_pcm)]
+
+    print(f"{'audio':>7} {'threads':>7} | {'chemin':<22} | {'moyenne':>9} | {'p99':>9} | {'gain':>6}")
+    print("-" * 74)
+    for duration in args.durations:
+        # Forme d'onde float32 dans [-1, 1], comme la sortie des modèles
+        wav = (rng.uniform(-0.8, 0.8, int(duration * args.sample_rate))).astype(np.float32)
+
+        # Le nouveau chemin doit produire exactement le même fichier
+        assert in_memory_wav(wav, args.sample_rate) == legacy_wav(wav, args.sample_rate)
+
+        for threads in args.threads:
+            baseline = None
+            for name, function in paths:
+                times = measure(function, wav, args.sample_rate, args.requests, threads)
+                mean = sum(times) / len(times)
+                p99 = times[min(len(times) - 1, int(0.99 * len(times)))]
+                baseline = baseline or mean
+                print(f"{duration:>6g}s {threads:>7} | {name:<22} | {mean:>6.3f} ms | {p99:>6.3f} ms | "
+                      f"{baseline / mean:>5.1f}x")
+        print("-" * 74)
+
+
+if __name__ == "__main__":
+    main()
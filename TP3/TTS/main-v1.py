@@ -7,88 +7,257 @@ from pydantic import BaseModel
 # PyTorch est le backend utilisé pour exécuter le modèle TTS (CPU ou GPU)
 import torch
 
-# tempfile permet de créer un dossier temporaire pour générer le fichier audio
-import tempfile
-
-# os est utilisé pour manipuler les chemins de fichiers
+# os pour lire la configuration du mode répliques
 import os
 
+# numpy pour assembler l'audio des phrases
+import numpy as np
+
+# Encodage en mémoire de l'audio généré (WAV ou PCM brut, sans fichier temporaire)
+from audio_encoding import encode_audio, media_type, MEDIA_TYPES
+
+# Réponse en streaming (transfert chunked) avec le temps jusqu'au premier morceau
+from audio_streaming import stream_response
+
+# Micro-batching : les phrases des requêtes simultanées passent ensemble dans le modèle
+from batch_scheduler import BatchScheduler
+
+# Mode répliques : plusieurs processus ayant chacun leur modèle
+from replica_pool import ReplicaPool
+
 # Ces variables seront utilisées pour charger dynamiquement le modèle TTS
 # On les définit à None pour éviter les erreurs tant que le modèle n’est pas encore chargé
 TTS = None
 tts = None
+trim_silence = None
+sample_rate = None  # Fréquence de sortie du modèle (connue une fois le modèle chargé)
 
 # Nom du modèle vocal Coqui TTS à utiliser (français, modèle VITS CSS10)
 MODEL_NAME = "tts_models/fr/css10/vits"
 # MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2" this need to purchased
 
+# Micro-batching : un lot part dès qu'il est plein, ou BATCH_MAX_WAIT_MS après sa première phrase
+BATCH_MAX_SIZE = 8            # Phrases par passage du modèle
+BATCH_MAX_WAIT_MS = 15        # Attente maximale ajoutée à une requête pour remplir un lot
+BATCH_MAX_LENGTH_RATIO = 1.5  # Écart de longueur maximal dans un lot (limite le remplissage inutile)
+
+# Mode répliques (CPU) : nombre de processus ayant chacun leur modèle (0 = un seul modèle,
+# dans ce processus, avec micro-batching) et threads PyTorch par réplique (0 = cœurs / répliques)
+REPLICAS = int(os.environ.get("TTS_REPLICAS", "0"))
+REPLICA_THREADS = int(os.environ.get("TTS_REPLICA_THREADS", "0")) or None
+
+# Silence ajouté après chaque phrase (en échantillons), comme le fait tts.tts()
+SENTENCE_SILENCE_SAMPLES = 10000
+
 # Création de l'application FastAPI
 app = FastAPI()
 
+# Planificateur des lots (un seul thread utilise le modèle)
+batcher = None
+
+# Pool des répliques (mode TTS_REPLICAS)
+pool = None
+
 # Définition du schéma de données attendu par l’API (JSON envoyé par le client)
 class TTSRequest(BaseModel):
     text: str                    # Texte à synthétiser en audio
     speaker_wav: str | None = None  # Chemin vers un fichier WAV pour utiliser une voix personnalisée (optionnel)
     speaker: str | None = None      # Nom d’un speaker interne au modèle (rare pour CSS10)
     speed: float | None = None      # Vitesse de lecture (1.0 = normal)
+    format: str = "wav"             # Format de la réponse : "wav" ou "pcm" (16 bits mono brut)
+
+# Chargement du modèle dans ce processus
+def create_model(device):
+    global TTS, tts, trim_silence   # On indique que l’on va modifier les variables globales
+
+    # Importation retardée du module TTS pour éviter les erreurs si le modèle n'est pas prêt
+    from TTS.api import TTS as _TTS
+    TTS = _TTS  # On assigne la classe importée à la variable globale
+    from TTS.tts.utils.synthesis import trim_silence as _trim_silence
+    trim_silence = _trim_silence
+
+    # Création de l’instance du modèle TTS et transfert vers CPU ou GPU
+    tts = TTS(MODEL_NAME).to(device)
 
 # Fonction exécutée automatiquement au démarrage du serveur FastAPI
 @app.on_event("startup")
 def load_model():
-    global TTS, tts   # On indique que l’on va modifier les variables globales
+    global batcher, pool, sample_rate
 
     print("Initializing TTS model…")
 
-    # Importation retardée du module TTS pour éviter les erreurs si le modèle n'est pas prêt
-    from TTS.api import TTS as _TTS
-    TTS = _TTS  # On assigne la classe importée à la variable globale
+    # Mode répliques : les modèles sont chargés dans les processus, pas dans celui de l'API
+    if REPLICAS:
+        pool = ReplicaPool(start_replica, REPLICAS, REPLICA_THREADS)
+        sample_rate = pool.info["sample_rate"]
+        print(f"TTS model loaded in {REPLICAS} replicas.")
+        return
 
     # Détection automatique du périphérique : GPU si disponible, sinon CPU
     device = "cuda" if torch.cuda.is_available() else "cpu"
     print("Using device:", device)
 
-    # Création de l’instance du modèle TTS et transfert vers CPU ou GPU
-    tts = TTS(MODEL_NAME).to(device)
+    create_model(device)
+    sample_rate = tts.synthesizer.output_sample_rate
     print("TTS model loaded.")  # Indique que le modèle est prêt
 
+    # Démarrage du planificateur des lots
+    batcher = BatchScheduler(run_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, BATCH_MAX_LENGTH_RATIO)
+
+# Fonction exécutée à l'arrêt du serveur : termine les lots en cours, arrête les répliques
+@app.on_event("shutdown")
+def stop_workers():
+    if batcher is not None:
+        batcher.close()
+    if pool is not None:
+        pool.close()
+
+# Lot de phrases synthétisé en un seul passage de VITS (entrées complétées jusqu'à la
+# plus longue, chaque sortie recoupée à sa propre longueur)
+def vits_batch(texts):
+    model = tts.synthesizer.tts_model
+    device = next(model.parameters()).device
+
+    # Même conversion texte → identifiants que tts.tts()
+    ids = [model.tokenizer.text_to_ids(text) for text in texts]
+    lengths = torch.tensor([len(seq) for seq in ids], dtype=torch.long)
+    x = torch.zeros(len(ids), int(lengths.max()), dtype=torch.long)
+    for row, seq in enumerate(ids):
+        x[row, :len(seq)] = torch.tensor(seq, dtype=torch.long)
+
+    with torch.inference_mode():
+        outputs = model.inference(x.to(device), aux_input={"x_lengths": lengths.to(device)})
+
+    # Nombre de trames de chaque sortie → nombre d'échantillons
+    audio = outputs["model_outputs"][:, 0].cpu()
+    y_mask = outputs["y_mask"]
+    frames = y_mask.sum(dim=(1, 2)).long().cpu()
+    hop = audio.shape[-1] // y_mask.shape[-1]
+
+    trim = model.config.audio.get("do_trim_silence", False)
+    wavs = []
+    for row in range(len(texts)):
+        wav = audio[row, : int(frames[row]) * hop].numpy()
+        if trim:
+            wav = trim_silence(wav, model.ap)
+        # Même silence après chaque phrase que tts.tts()
+        wavs.append(np.concatenate([wav, np.zeros(SENTENCE_SILENCE_SAMPLES, dtype=wav.dtype)]))
+    return wavs
+
+# Synthèse d'une phrase seule par tts.tts() (voix personnalisée ou interne au modèle)
+def synthesize_sentence(sentence, req: TTSRequest):
+    if req.speaker_wav:
+        return tts.tts(text=sentence, speaker_wav=req.speaker_wav, speed=req.speed, split_sentences=False)
+    return tts.tts(text=sentence, speaker=req.speaker, speed=req.speed, split_sentences=False)
+
+# Exécution d'un lot par le planificateur : des phrases de la voix du modèle (batchées),
+# ou une phrase seule avec une voix personnalisée (non batchable)
+def run_batch(items):
+    kind, sentence, req = items[0]
+    if kind == "custom":
+        return [synthesize_sentence(sentence, req)]
+    return vits_batch([sentence for _, sentence, _ in items])
+
+# Démarrage d'une réplique (exécuté dans son processus) : chaque réplique a ses propres
+# cœurs et exécute ses requêtes l'une après l'autre, sans micro-batching
+def start_replica():
+    create_model("cpu")
+    return replica_job, {"sample_rate": tts.synthesizer.output_sample_rate}
+
+# Requête exécutée par une réplique : l'audio phrase par phrase (streaming) ou en une fois
+def replica_job(job):
+    req, stream = job
+    wavs = (synthesize_sentence(sentence, req) for sentence in tts.synthesizer.split_into_sentences(req.text))
+    if stream:
+        yield from wavs
+    else:
+        yield np.concatenate([np.asarray(wav, dtype=np.float32) for wav in wavs])
+
+# Soumet chaque phrase de la requête au planificateur ; retourne un Future par phrase
+def submit_sentences(req: TTSRequest):
+    custom = bool(req.speaker_wav or req.speaker)
+    return [
+        batcher.submit_future(
+            ("custom" if custom else "vits", sentence, req),
+            len(sentence),
+            group=None if custom else "vits"
+        )
+        for sentence in tts.synthesizer.split_into_sentences(req.text)
+    ]
+
 # Endpoint POST permettant de générer un fichier WAV à partir d’un texte
 @app.post("/tts/wav")
 def synthesize(req: TTSRequest):
     global tts
 
     # Si le modèle n'est pas encore prêt, on renvoie une erreur 503
-    if tts is None:
+    if sample_rate is None:
         return Response(content=b"", media_type="text/plain", status_code=503)
 
-    # Création d'un dossier temporaire pour sauvegarder le fichier WAV généré
-    with tempfile.TemporaryDirectory() as td:
-        out_path = os.path.join(td, "out.wav")  # chemin complet du fichier audio temporaire
-
-        # Si l'utilisateur fournit un chemin WAV externe pour une voix personnalisée
-        if req.speaker_wav:
-            tts.tts_to_file(
-                text=req.text,
-                speaker_wav=req.speaker_wav,  # Utilisation d'une voix issue d'un fichier audio
-                file_path=out_path,           # Où sauvegarder la sortie
-                speed=req.speed               # Vitesse de lecture
-            )
-        else:
-            # Synthèse classique avec la voix du modèle
-            tts.tts_to_file(
-                text=req.text,
-                speaker=req.speaker,          # Speaker interne du modèle (rarement utilisé ici)
-                file_path=out_path,
-                speed=req.speed
-            )
-
-        # Lecture du fichier WAV généré pour le renvoyer dans la réponse
-        with open(out_path, "rb") as f:
-            audio_data = f.read()
-
-        # On retourne le contenu audio au client, au format WAV
-        return Response(content=audio_data, media_type="audio/wav")
+    # Format de sortie demandé
+    if req.format not in MEDIA_TYPES:
+        return Response(content=f"Unsupported format: {req.format}".encode(), media_type="text/plain", status_code=400)
+
+    if pool is not None:
+        # Mode répliques : la réplique la moins chargée synthétise tout le texte
+        wav = pool.synthesize((req, False), cost=len(req.text))
+    else:
+        # Les phrases sont synthétisées en lots avec celles des autres requêtes
+        futures = submit_sentences(req)
+        try:
+            wavs = [future.result() for future in futures]
+        finally:
+            # Une phrase en échec : les suivantes, pas encore commencées, ne sont pas synthétisées
+            for future in futures:
+                future.cancel()
+        wav = np.concatenate([np.asarray(part, dtype=np.float32) for part in wavs]) if wavs else np.zeros(0, dtype=np.float32)
+
+    # Encodage de la forme d'onde directement en mémoire (aucun fichier temporaire)
+    audio_data = encode_audio(wav, sample_rate, req.format)
+
+    # On retourne le contenu audio au client (WAV, ou PCM brut avec sa fréquence dans l'en-tête)
+    return Response(
+        content=audio_data,
+        media_type=media_type(req.format, sample_rate),
+        headers={"X-Sample-Rate": str(sample_rate)}
+    )
+
+# Synthèse phrase par phrase : VITS ne génère pas de façon incrémentale, chaque
+# phrase est envoyée dès qu'elle est prête (suivie du même silence que /tts/wav)
+def sentence_chunks(req: TTSRequest):
+    futures = submit_sentences(req)
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        # Client parti : les phrases pas encore commencées ne sont pas synthétisées
+        for future in futures:
+            future.cancel()
+
+# Endpoint POST qui envoie l'audio phrase par phrase (transfert chunked)
+# L'en-tête X-Time-To-First-Chunk-Ms donne le temps de génération de la première phrase
+@app.post("/tts/stream")
+def synthesize_stream(req: TTSRequest):
+    global tts
+
+    # Si le modèle n'est pas encore prêt, on renvoie une erreur 503
+    if sample_rate is None:
+        return Response(content=b"", media_type="text/plain", status_code=503)
+
+    # Format de sortie demandé
+    if req.format not in MEDIA_TYPES:
+        return Response(content=f"Unsupported format: {req.format}".encode(), media_type="text/plain", status_code=400)
+
+    chunks = pool.stream((req, True), cost=len(req.text)) if pool is not None else sentence_chunks(req)
+    return stream_response(chunks, sample_rate, req.format)
+
+# Métriques du micro-batching (taille des lots, délai d'attente dans la file),
+# ou charge de chaque réplique en mode répliques
+@app.get("/metrics")
+def metrics():
+    return pool.stats() if pool is not None else batcher.stats()
 
 # Endpoint simple pour vérifier si l’API est prête (ex : monitoring)
 @app.get("/health")
 def health():
-    return {"ready": tts is not None}  # True si le modèle est chargé
+    return {"ready": sample_rate is not None}  # True si le modèle est chargé
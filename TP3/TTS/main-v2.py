@@ -7,15 +7,30 @@ from pydantic import BaseModel
 # PyTorch est le backend utilisé pour exécuter le modèle TTS (CPU ou GPU)
 import torch
 
-# tempfile permet de créer un dossier temporaire pour générer le fichier audio
-import tempfile
+# Encodage en mémoire de l'audio généré (WAV ou PCM brut, sans fichier temporaire)
+from audio_encoding import encode_audio, media_type, MEDIA_TYPES
 
 # os est utilisé pour manipuler les chemins de fichiers
 import os
 
+# numpy pour assembler l'audio des phrases
+import numpy as np
+
+# Cache des latents de conditionnement de chaque voix (mémoire + disque)
+from speaker_store import SpeakerStore, CONDITIONING_SETTINGS, inference_settings
+
+# Réponse en streaming (transfert chunked) avec le temps jusqu'au premier morceau
+from audio_streaming import stream_response
+
+# Mode répliques : plusieurs processus ayant chacun leur modèle
+from replica_pool import ReplicaPool
+
 # Ces variables seront utilisées pour charger dynamiquement le modèle TTS
 TTS = None
 tts = None
+speaker_store = None
+sample_rate = None  # Fréquence de sortie du modèle (connue une fois le modèle chargé)
+languages = []      # Langues supportées par le modèle
 
 # Nom du modèle vocal Coqui TTS à utiliser (XTTS v2 - multilingue)
 MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
@@ -23,9 +38,29 @@ MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
 # Dossier pour stocker les voix par défaut
 DEFAULT_SPEAKERS_DIR = "./default_speakers"
 
+# Dossier où sont persistés les latents de conditionnement des voix (un fichier par voix)
+SPEAKER_CACHE_DIR = "./speaker_cache"
+SPEAKER_CACHE_VOICES = 64   # Voix gardées en mémoire (~130 Ko chacune)
+SPEAKER_CACHE_FILES = 512   # Fichiers gardés sur disque (les moins récemment utilisés sont supprimés)
+
+# Silence ajouté après chaque phrase (en échantillons), comme le fait tts.tts()
+SENTENCE_SILENCE_SAMPLES = 10000
+
+# Streaming : jetons GPT générés avant de décoder et d'envoyer un morceau d'audio
+# (plus petit = premier morceau plus tôt, plus de passages dans le décodeur)
+STREAM_CHUNK_TOKENS = 20
+
+# Mode répliques : nombre de processus ayant chacun leur modèle (0 = un seul modèle,
+# dans ce processus) et threads PyTorch par réplique (0 = cœurs / répliques)
+REPLICAS = int(os.environ.get("TTS_REPLICAS", "0"))
+REPLICA_THREADS = int(os.environ.get("TTS_REPLICA_THREADS", "0")) or None
+
 # Création de l'application FastAPI
 app = FastAPI()
 
+# Pool des répliques (mode TTS_REPLICAS)
+pool = None
+
 # Définition du schéma de données attendu par l'API (JSON envoyé par le client)
 class TTSRequest(BaseModel):
     text: str                           # Texte à synthétiser en audio
@@ -33,6 +68,7 @@ class TTSRequest(BaseModel):
     speaker_name: str | None = "default" # Nom du speaker par défaut (male, female, default)
     language: str = "fr"                # Langue du texte
     speed: float = 1.0                  # Vitesse de lecture (1.0 = normal)
+    format: str = "wav"                 # Format de la réponse : "wav" ou "pcm" (16 bits mono brut)
 
 # Fonction pour télécharger les voix par défaut
 def setup_default_speakers():
@@ -61,15 +97,9 @@ def setup_default_speakers():
             except Exception as e:
                 print(f"✗ Failed to download {name} speaker: {e}")
 
-# Fonction exécutée automatiquement au démarrage du serveur FastAPI
-@app.on_event("startup")
-def load_model():
-    global TTS, tts
-
-    print("Initializing XTTS v2 model…")
-    
-    # Télécharger les voix par défaut
-    setup_default_speakers()
+# Chargement du modèle dans ce processus
+def create_model():
+    global TTS, tts, speaker_store
 
     # Importation retardée du module TTS
     from TTS.api import TTS as _TTS
@@ -84,15 +114,109 @@ def load_model():
     
     print("XTTS v2 model loaded successfully.")
 
-# Endpoint POST permettant de générer un fichier WAV à partir d'un texte
-@app.post("/tts/wav")
-def synthesize(req: TTSRequest):
-    global tts
+    # Latents des voix par défaut calculés une fois (ou relus du disque)
+    model = tts.synthesizer.tts_model
+    speaker_store = SpeakerStore(
+        model, CONDITIONING_SETTINGS, SPEAKER_CACHE_DIR, SPEAKER_CACHE_VOICES, SPEAKER_CACHE_FILES
+    )
+    speaker_store.precompute(
+        os.path.join(DEFAULT_SPEAKERS_DIR, f)
+        for f in sorted(os.listdir(DEFAULT_SPEAKERS_DIR))
+        if f.endswith(".wav")
+    )
+    print(f"Speaker latents ready: {speaker_store.stats()}")
 
+# Informations sur le modèle utilisées par les endpoints
+def model_info():
+    return {
+        "sample_rate": tts.synthesizer.output_sample_rate,
+        "languages": list(tts.synthesizer.tts_model.config.languages),
+    }
+
+# Fonction exécutée automatiquement au démarrage du serveur FastAPI
+@app.on_event("startup")
+def load_model():
+    global pool, sample_rate, languages
+
+    print("Initializing XTTS v2 model…")
+    
+    # Télécharger les voix par défaut
+    setup_default_speakers()
+
+    if REPLICAS:
+        # Mode répliques : les modèles sont chargés dans les processus, pas dans celui de l'API
+        # (les latents des voix sont partagés par le cache disque)
+        pool = ReplicaPool(start_replica, REPLICAS, REPLICA_THREADS)
+        info = pool.info
+        print(f"XTTS v2 model loaded in {REPLICAS} replicas.")
+    else:
+        create_model()
+        info = model_info()
+    sample_rate, languages = info["sample_rate"], info["languages"]
+
+# Fonction exécutée à l'arrêt du serveur : arrête les répliques
+@app.on_event("shutdown")
+def stop_replicas():
+    if pool is not None:
+        pool.close()
+
+# Synthèse XTTS avec les latents en cache (au lieu de tts.tts(speaker_wav=...), qui les
+# recalcule à partir du WAV pour chaque phrase)
+def synthesize_xtts(text, language, speaker_path, speed=1.0):
+    model = tts.synthesizer.tts_model
+    gpt_cond_latent, speaker_embedding = speaker_store.get(speaker_path)
+    settings = inference_settings(model.config)
+
+    # Même découpage en phrases et même silence entre elles que tts.tts()
+    parts = []
+    for sentence in tts.synthesizer.split_into_sentences(text):
+        outputs = model.inference(sentence, language, gpt_cond_latent, speaker_embedding, speed=speed, **settings)
+        parts.append(np.asarray(outputs["wav"], dtype=np.float32))
+        parts.append(np.zeros(SENTENCE_SILENCE_SAMPLES, dtype=np.float32))
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+
+# Synthèse XTTS incrémentale : les morceaux d'audio sont produits pendant la génération
+# des jetons (inference_stream), phrase par phrase
+def stream_xtts(text, language, speaker_path, speed=1.0):
+    model = tts.synthesizer.tts_model
+    gpt_cond_latent, speaker_embedding = speaker_store.get(speaker_path)
+    settings = inference_settings(model.config)
+
+    for sentence in tts.synthesizer.split_into_sentences(text):
+        yield from model.inference_stream(
+            sentence, language, gpt_cond_latent, speaker_embedding,
+            stream_chunk_size=STREAM_CHUNK_TOKENS, speed=speed, **settings
+        )
+        yield np.zeros(SENTENCE_SILENCE_SAMPLES, dtype=np.float32)
+
+# Démarrage d'une réplique (exécuté dans son processus) : chaque réplique a ses propres
+# cœurs et exécute ses requêtes l'une après l'autre
+def start_replica():
+    create_model()
+    return replica_job, model_info()
+
+# Requête exécutée par une réplique : l'audio au fil de la génération (streaming) ou en une fois
+def replica_job(job):
+    text, language, speaker_path, speed, stream = job
+    if stream:
+        yield from stream_xtts(text, language, speaker_path, speed)
+    else:
+        yield synthesize_xtts(text, language, speaker_path, speed)
+
+# Vérifications communes à /tts/wav et /tts/stream ; retourne le WAV de la voix à utiliser
+def check_request(req: TTSRequest):
     # Si le modèle n'est pas encore prêt, on renvoie une erreur 503
-    if tts is None:
+    if sample_rate is None:
         raise HTTPException(status_code=503, detail="Model not loaded yet")
 
+    # Format de sortie demandé
+    if req.format not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {req.format} (available: {', '.join(MEDIA_TYPES)})")
+
+    # Langue supportée par XTTS (le modèle ne la vérifie plus une fois les latents fournis)
+    if req.language not in languages:
+        raise HTTPException(status_code=400, detail=f"Unsupported language: {req.language}")
+
     # Déterminer quel fichier speaker utiliser
     if req.speaker_wav:
         # Utiliser le fichier WAV fourni par l'utilisateur
@@ -110,37 +234,57 @@ def synthesize(req: TTSRequest):
                     status_code=500, 
                     detail="No default speaker voices available. Please provide speaker_wav or restart the server."
                 )
+    return speaker_path
+
+# Endpoint POST permettant de générer un fichier WAV à partir d'un texte
+@app.post("/tts/wav")
+def synthesize(req: TTSRequest):
+    speaker_path = check_request(req)
+
+    try:
+        # Synthèse vocale avec clonage de voix (latents en cache, forme d'onde en mémoire)
+        # (mode répliques : par la réplique la moins chargée)
+        if pool is not None:
+            wav = pool.synthesize((req.text, req.language, speaker_path, req.speed, False), cost=len(req.text))
+        else:
+            wav = synthesize_xtts(req.text, req.language, speaker_path, req.speed)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"TTS generation failed: {str(e)}")
+
+    # Encodage de la forme d'onde directement en mémoire (aucun fichier temporaire)
+    audio_data = encode_audio(wav, sample_rate, req.format)
+
+    # On retourne le contenu audio au client (WAV, ou PCM brut avec sa fréquence dans l'en-tête)
+    return Response(
+        content=audio_data,
+        media_type=media_type(req.format, sample_rate),
+        headers={"X-Sample-Rate": str(sample_rate)}
+    )
+
+# Endpoint POST qui envoie l'audio au fil de la génération (transfert chunked)
+# L'en-tête X-Time-To-First-Chunk-Ms donne le temps de génération du premier morceau
+@app.post("/tts/stream")
+def synthesize_stream(req: TTSRequest):
+    speaker_path = check_request(req)
 
-    # Création d'un dossier temporaire pour sauvegarder le fichier WAV généré
-    with tempfile.TemporaryDirectory() as td:
-        out_path = os.path.join(td, "out.wav")
-
-        try:
-            # Synthèse vocale avec clonage de voix
-            tts.tts_to_file(
-                text=req.text,
-                speaker_wav=speaker_path,
-                language=req.language,
-                file_path=out_path,
-                speed=req.speed
-            )
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"TTS generation failed: {str(e)}")
-
-        # Lecture du fichier WAV généré pour le renvoyer dans la réponse
-        with open(out_path, "rb") as f:
-            audio_data = f.read()
-
-        # On retourne le contenu audio au client, au format WAV
-        return Response(content=audio_data, media_type="audio/wav")
+    try:
+        if pool is not None:
+            chunks = pool.stream((req.text, req.language, speaker_path, req.speed, True), cost=len(req.text))
+        else:
+            chunks = stream_xtts(req.text, req.language, speaker_path, req.speed)
+        return stream_response(chunks, sample_rate, req.format)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"TTS generation failed: {str(e)}")
 
 # Endpoint simple pour vérifier si l'API est prête
 @app.get("/health")
 def health():
     return {
-        "ready": tts is not None,
+        "ready": sample_rate is not None,
         "model": MODEL_NAME,
-        "device": "cpu"
+        "device": "cpu",
+        "speakers": speaker_store.stats() if speaker_store is not None else None,
+        "replicas": pool.stats()["replicas"] if pool is not None else None
     }
 
 # Endpoint pour lister les voix disponibles
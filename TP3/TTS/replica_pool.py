@@ -0,0 +1,356 @@
+# Pool de répliques du modèle : N processus chargent chacun leur propre modèle.
+# Dans un seul processus, les requêtes simultanées se disputent le GIL et les
+# threads intra-op de PyTorch d'un même modèle ; ici chaque réplique a ses
+# propres cœurs (threads PyTorch répartis, affinité CPU sous Linux) et exécute
+# ses requêtes l'une après l'autre. Le processus de l'API envoie chaque requête
+# à la réplique la moins chargée et reçoit l'audio par mémoire partagée
+# (aucune sérialisation pickle des échantillons).
+
+# multiprocessing : processus des répliques, tubes et sémaphores entre processus
+import multiprocessing
+
+# SharedMemory : zone où chaque réplique écrit l'audio produit
+from multiprocessing.shared_memory import SharedMemory
+
+# os pour le nombre de cœurs et l'affinité CPU
+import os
+
+# queue : résultats d'une requête, remis au thread qui l'attend
+import queue
+
+# threading pour le thread de lecture de chaque réplique
+import threading
+
+# traceback pour remonter l'erreur de chargement d'une réplique
+import traceback
+
+# deque : requêtes reçues par une réplique, pas encore exécutées
+from collections import deque
+
+# itertools.count pour numéroter les requêtes
+import itertools
+
+# numpy : l'audio est échangé en float32
+import numpy as np
+
+# PyTorch, pour limiter le nombre de threads de chaque réplique
+import torch
+
+# Taille initiale de la zone partagée d'une réplique (en échantillons, ~30 s à 24 kHz)
+ARENA_SAMPLES = 24000 * 30
+
+
+def partition_cores(replicas, threads_per_replica=None):
+    """
+    Répartit les cœurs disponibles entre les répliques.
+
+    Paramètres :
+    - replicas : nombre de répliques
+    - threads_per_replica : threads PyTorch par réplique (None = cœurs / répliques)
+
+    Retourne :
+    - liste de (threads, cœurs) par réplique ; cœurs vaut None si l'affinité
+      n'est pas disponible ou si les répliques se partagent les cœurs
+    """
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+    count = len(cores) if cores else (os.cpu_count() or 1)
+    threads = threads_per_replica or max(1, count // replicas)
+
+    partitions = []
+    for index in range(replicas):
+        own = None
+        if cores and threads * replicas <= count:
+            own = cores[index * threads:(index + 1) * threads]
+        partitions.append((threads, own))
+    return partitions
+
+
+class _Arena:
+    """Zone partagée d'une réplique, agrandie si un morceau d'audio ne tient pas."""
+
+    def __init__(self, samples):
+        self.shm = SharedMemory(create=True, size=samples * 4)
+
+    def write(self, samples):
+        """Copie les échantillons dans la zone ; retourne son nom (il change si elle a été agrandie)."""
+        if samples.nbytes > self.shm.size:
+            old = self.shm
+            self.shm = SharedMemory(create=True, size=max(samples.nbytes, 2 * old.size))
+            # Le processus de l'API a relâché l'ancienne zone (sémaphore) : plus utilisée
+            old.close()
+            old.unlink()
+        np.frombuffer(self.shm.buf, dtype=np.float32, count=samples.size)[:] = samples
+        return self.shm.name
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _worker_main(factory, conn, free, threads, cores):
+    """
+    Boucle d'une réplique.
+
+    Paramètres :
+    - factory : fonction (importable) qui charge le modèle et retourne (handler, info) ;
+      handler(job) produit les morceaux d'audio de la requête
+    - conn : tube vers le processus de l'API
+    - free : sémaphore ; acquis avant d'écrire dans la zone partagée, relâché par l'API une fois lue
+    - threads, cores : threads PyTorch et cœurs réservés à cette réplique
+    """
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Déjà fixé (un calcul parallèle a eu lieu pendant l'import)
+
+    try:
+        handler, info = factory()
+    except Exception:
+        conn.send(("failed", None, traceback.format_exc()))
+        return
+
+    arena = _Arena(ARENA_SAMPLES)
+    conn.send(("ready", None, info))
+
+    pending = deque()
+    cancelled = set()
+    stopping = False
+
+    def receive(block):
+        """Lire les messages de l'API (requêtes, annulations, arrêt) sans bloquer la génération."""
+        nonlocal stopping
+        while (block and not pending and not stopping) or conn.poll():
+            message = conn.recv()
+            if message is None:
+                stopping = True
+            elif message[0] == "cancel":
+                cancelled.add(message[1])
+            else:
+                pending.append(message[1:])
+            block = False
+
+    try:
+        while True:
+            receive(block=True)
+            if stopping:
+                break
+            job_id, job = pending.popleft()
+            try:
+                if job_id not in cancelled:
+                    for chunk in handler(job):
+                        # Client parti entre deux morceaux : on arrête la génération
+                        receive(block=False)
+                        if job_id in cancelled:
+                            break
+                        if hasattr(chunk, "cpu"):
+                            chunk = chunk.cpu().numpy()
+                        samples = np.asarray(chunk, dtype=np.float32).reshape(-1)
+                        free.acquire()
+                        name = arena.write(samples)
+                        conn.send(("chunk", job_id, (name, samples.size)))
+                conn.send(("done", job_id, None))
+            except Exception as e:
+                conn.send(("error", job_id, f"{type(e).__name__}: {e}"))
+            cancelled.discard(job_id)
+    finally:
+        arena.release()
+
+
+class _Replica:
+    """État d'une réplique, vu du processus de l'API."""
+
+    def __init__(self, index, process, conn, free, threads, cores):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.free = free
+        self.threads = threads
+        self.cores = cores
+        self.send_lock = threading.Lock()
+        self.shm = None  # Zone partagée de la réplique (rattachée au premier morceau)
+        self.jobs = {}  # job_id → (file des résultats, coût)
+        self.load = 0
+        self.completed = 0
+        self.alive = True
+
+
+class ReplicaPool:
+    """
+    Répliques du modèle dans des processus séparés.
+
+    Paramètres :
+    - factory : fonction définie au niveau d'un module (importable par les processus
+      « spawn ») qui charge le modèle et retourne (handler, info) ; handler(job)
+      est un générateur de formes d'onde
+    - replicas : nombre de processus
+    - threads_per_replica : threads PyTorch par réplique (None = cœurs / répliques)
+
+    `info` (fréquence d'échantillonnage, langues...) est celle retournée par la première réplique.
+    """
+
+    def __init__(self, factory, replicas, threads_per_replica=None):
+        context = multiprocessing.get_context("spawn")
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._next = 0  # Départage des répliques à charge égale (tour à tour)
+        self.replicas = []
+
+        for index, (threads, cores) in enumerate(partition_cores(replicas, threads_per_replica)):
+            parent_conn, child_conn = context.Pipe()
+            free = context.Semaphore(1)
+            process = context.Process(
+                target=_worker_main,
+                args=(factory, child_conn, free, threads, cores),
+                name=f"tts-replica-{index}",
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self.replicas.append(_Replica(index, process, parent_conn, free, threads, cores))
+
+        # Les modèles se chargent en parallèle ; on attend qu'ils soient tous prêts
+        self.info = None
+        for replica in self.replicas:
+            try:
+                kind, _, payload = replica.conn.recv()
+            except EOFError:
+                kind, payload = "failed", f"process exited with code {replica.process.exitcode}"
+            if kind != "ready":
+                self.close()
+                raise RuntimeError(f"Replica {replica.index} failed to load:\n{payload}")
+            self.info = self.info or payload
+            threading.Thread(target=self._read, args=(replica,), name=f"tts-replica-{replica.index}-reader",
+                             daemon=True).start()
+
+    def _read(self, replica):
+        """Thread de lecture d'une réplique : copie l'audio de la zone partagée et le remet à la requête."""
+        try:
+            while True:
+                kind, job_id, payload = replica.conn.recv()
+                results, _ = replica.jobs.get(job_id, (None, None))
+                if kind == "chunk":
+                    name, count = payload
+                    if replica.shm is None or replica.shm.name != name:
+                        if replica.shm is not None:
+                            replica.shm.close()
+                        replica.shm = SharedMemory(name=name)
+                    # Une seule copie mémoire, puis la réplique peut réécrire la zone
+                    samples = np.frombuffer(replica.shm.buf, dtype=np.float32, count=count).copy()
+                    replica.free.release()
+                    if results is not None:
+                        results.put(("chunk", samples))
+                else:
+                    self._finish(replica, job_id)
+                    if results is not None:
+                        results.put((kind, payload))
+        except (EOFError, OSError):
+            pass
+
+        # Réplique arrêtée ou morte : les requêtes en cours échouent
+        replica.alive = False
+        for job_id in list(replica.jobs):
+            results, _ = replica.jobs.get(job_id, (None, None))
+            self._finish(replica, job_id)
+            if results is not None:
+                results.put(("error", f"Replica {replica.index} stopped (exit code {replica.process.exitcode})"))
+        if replica.shm is not None:
+            replica.shm.close()
+            replica.shm = None
+
+    def _finish(self, replica, job_id):
+        with self._lock:
+            entry = replica.jobs.pop(job_id, None)
+            if entry is not None:
+                replica.load -= entry[1]
+                replica.completed += 1
+
+    def _dispatch(self, job, cost):
+        """Envoie la requête à la réplique la moins chargée ; retourne (réplique, job_id, file des résultats)."""
+        results = queue.Queue()
+        with self._lock:
+            alive = [replica for replica in self.replicas if replica.alive]
+            if not alive:
+                raise RuntimeError("No replica available")
+            start = self._next % len(alive)
+            self._next += 1
+            replica = min(alive[start:] + alive[:start], key=lambda r: r.load)
+            job_id = next(self._ids)
+            replica.jobs[job_id] = (results, cost)
+            replica.load += cost
+        try:
+            with replica.send_lock:
+                replica.conn.send(("job", job_id, job))
+        except OSError as e:
+            self._finish(replica, job_id)
+            raise RuntimeError(f"Replica {replica.index} unavailable: {e}")
+        return replica, job_id, results
+
+    def stream(self, job, cost=1):
+        """
+        Exécute une requête sur une réplique et produit ses morceaux d'audio (float32).
+        Fermer le générateur avant la fin annule la requête dans la réplique.
+
+        Paramètres :
+        - job : argument de handler (doit être sérialisable)
+        - cost : charge de la requête (ex. nombre de caractères), pour le choix de la réplique
+        """
+        replica, job_id, results = self._dispatch(job, cost)
+        finished = False
+        try:
+            while True:
+                kind, payload = results.get()
+                if kind == "chunk":
+                    yield payload
+                elif kind == "error":
+                    finished = True
+                    raise RuntimeError(payload)
+                else:
+                    finished = True
+                    return
+        finally:
+            if not finished:
+                try:
+                    with replica.send_lock:
+                        replica.conn.send(("cancel", job_id))
+                except OSError:
+                    pass
+
+    def synthesize(self, job, cost=1):
+        """Exécute une requête sur une réplique ; retourne tout son audio (float32)."""
+        chunks = list(self.stream(job, cost))
+        if len(chunks) == 1:
+            return chunks[0]
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+
+    def close(self, timeout=10):
+        """Arrêter les répliques (la requête en cours de chacune se termine)."""
+        for replica in self.replicas:
+            try:
+                with replica.send_lock:
+                    replica.conn.send(None)
+            except OSError:
+                pass
+        for replica in self.replicas:
+            replica.process.join(timeout)
+            if replica.process.is_alive():
+                replica.process.terminate()
+                replica.process.join()
+
+    def stats(self):
+        return {
+            "replicas": [
+                {
+                    "pid": replica.process.pid,
+                    "alive": replica.alive,
+                    "threads": replica.threads,
+                    "cores": replica.cores,
+                    "in_flight": len(replica.jobs),
+                    "load": replica.load,
+                    "completed": replica.completed,
+                }
+                for replica in self.replicas
+            ],
+        }
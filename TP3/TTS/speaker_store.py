@@ -0,0 +1,222 @@
+# Cache des latents de conditionnement XTTS (clonage de voix)
+# XTTS recalcule, pour chaque phrase de chaque requête, les latents GPT et
+# l'embedding du locuteur à partir du WAV de référence (chargement, rééchantillonnage,
+# passage dans deux encodeurs). Ce calcul ne dépend que du contenu du WAV :
+# il est fait une seule fois par voix, gardé en mémoire et sur disque
+# (redémarrage instantané), et réutilisé par toutes les requêtes.
+# Les deux niveaux sont bornés : les voix les moins récemment utilisées en sortent.
+
+# hashlib pour la clé de cache (empreinte du contenu du WAV)
+import hashlib
+
+# json pour inclure les paramètres de conditionnement dans la clé
+import json
+
+# os pour les chemins et l'écriture atomique des fichiers de cache
+import os
+
+# threading : les requêtes arrivent en parallèle depuis le pool de threads de FastAPI
+import threading
+
+# OrderedDict pour l'ordre LRU des voix en mémoire
+from collections import OrderedDict
+
+# PyTorch pour sauvegarder et recharger les tenseurs
+import torch
+
+
+# Paramètres de conditionnement d'un WAV de référence, identiques à ceux de
+# tts.tts(speaker_wav=...) : Xtts.synthesize appelle Xtts.full_inference sans
+# les transmettre, ce sont donc ses valeurs par défaut (pas config.gpt_cond_len...)
+CONDITIONING_SETTINGS = {
+    "gpt_cond_len": 30,
+    "gpt_cond_chunk_len": 6,
+    "max_ref_length": 10,
+    "sound_norm_refs": False,
+}
+
+
+def inference_settings(config):
+    """Paramètres de génération utilisés par XTTS (Xtts.synthesize) pour chaque phrase."""
+    return {
+        "temperature": config.temperature,
+        "length_penalty": config.length_penalty,
+        "repetition_penalty": config.repetition_penalty,
+        "top_k": config.top_k,
+        "top_p": config.top_p,
+    }
+
+
+class SpeakerStore:
+    """
+    Latents de conditionnement (gpt_cond_latent, speaker_embedding) par voix.
+
+    Paramètres :
+    - model : modèle XTTS (tts.synthesizer.tts_model)
+    - settings : paramètres de get_conditioning_latents (voir CONDITIONING_SETTINGS)
+    - cache_dir : dossier des latents persistés (None = mémoire seulement)
+    - max_voices : voix gardées en mémoire
+    - max_files : fichiers gardés dans cache_dir
+    """
+
+    SUFFIX = ".pth"
+
+    def __init__(self, model, settings, cache_dir=None, max_voices=64, max_files=512):
+        self.model = model
+        self.settings = settings
+        self.cache_dir = cache_dir
+        self.max_voices = max_voices
+        self.max_files = max_files
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        # Empreinte des paramètres : changer de réglages invalide les latents persistés
+        self._settings_key = hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:12]
+
+        self._latents = OrderedDict()  # clé → (gpt_cond_latent, speaker_embedding), ordre LRU
+        self._hashes = OrderedDict()  # chemin → ((taille, mtime), empreinte) : évite de relire un WAV inchangé
+        self._lock = threading.Lock()
+        self._key_locks = {}  # clé → [verrou, utilisateurs] : une voix n'est calculée qu'une fois à la fois
+
+        # Compteurs
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.computed = 0
+        self.evicted_files = 0
+
+    def _content_hash(self, wav_path):
+        stat = os.stat(wav_path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            known = self._hashes.get(wav_path)
+        if known is not None and known[0] == signature:
+            return known[1]
+        digest = hashlib.sha256()
+        with open(wav_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        content_hash = digest.hexdigest()
+        with self._lock:
+            self._hashes[wav_path] = (signature, content_hash)
+            self._hashes.move_to_end(wav_path)
+            while len(self._hashes) > self.max_files:
+                self._hashes.popitem(last=False)
+        return content_hash
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + self.SUFFIX)
+
+    def _remembered(self, key):
+        """Latents en mémoire (marqués récemment utilisés), ou None."""
+        with self._lock:
+            latents = self._latents.get(key)
+            if latents is not None:
+                self._latents.move_to_end(key)
+            return latents
+
+    def _remember(self, key, latents):
+        with self._lock:
+            self._latents[key] = latents
+            self._latents.move_to_end(key)
+            while len(self._latents) > self.max_voices:
+                self._latents.popitem(last=False)
+
+    def _load(self, key):
+        if not self.cache_dir or not os.path.exists(self._path(key)):
+            return None
+        try:
+            data = torch.load(self._path(key), map_location="cpu")
+            # Date de modification = dernière utilisation (ordre d'éviction sur disque)
+            os.utime(self._path(key))
+            return data["gpt_cond_latent"], data["speaker_embedding"]
+        except Exception as e:
+            # Fichier corrompu ou d'une autre version : recalculé
+            print(f"⚠️  Latents illisibles ({key}): {e}")
+            return None
+
+    def _save(self, key, latents):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        gpt_cond_latent, speaker_embedding = latents
+        torch.save({
+            "gpt_cond_latent": gpt_cond_latent.cpu(),
+            "speaker_embedding": speaker_embedding.cpu(),
+        }, tmp_path)
+        # Écriture atomique : un autre processus ne lit jamais un fichier à moitié écrit
+        os.replace(tmp_path, path)
+        self._evict_files()
+
+    def _evict_files(self):
+        """Supprimer les fichiers les moins récemment utilisés au-delà de max_files."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.SUFFIX):
+                try:
+                    entries.append((os.stat(os.path.join(self.cache_dir, name)).st_mtime, name))
+                except FileNotFoundError:
+                    pass  # Supprimé entre-temps (autre réplique)
+        entries.sort()
+        for _, name in entries[:max(0, len(entries) - self.max_files)]:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                self.evicted_files += 1
+            except OSError:
+                pass
+
+    def get(self, wav_path):
+        """
+        Latents de la voix du WAV `wav_path` (calculés au premier appel seulement).
+
+        Retourne :
+        - (gpt_cond_latent, speaker_embedding)
+        """
+        key = f"{self._content_hash(wav_path)}-{self._settings_key}"
+        latents = self._remembered(key)
+        if latents is not None:
+            self.memory_hits += 1
+            return latents
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                latents = self._remembered(key)
+                if latents is not None:
+                    self.memory_hits += 1
+                    return latents
+                latents = self._load(key)
+                if latents is not None:
+                    self.disk_hits += 1
+                else:
+                    with torch.inference_mode():
+                        latents = self.model.get_conditioning_latents(audio_path=wav_path, **self.settings)
+                    self._save(key, latents)
+                    self.computed += 1
+                self._remember(key, latents)
+            return latents
+        finally:
+            # Dernier demandeur de cette voix : son verrou n'est plus gardé
+            with self._lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    del self._key_locks[key]
+
+    def precompute(self, wav_paths):
+        """Calculer (ou recharger du disque) les latents de plusieurs voix, ex. au démarrage."""
+        for wav_path in wav_paths:
+            try:
+                self.get(wav_path)
+            except Exception as e:
+                print(f"✗ Latents non calculés pour {wav_path}: {e}")
+
+    def stats(self):
+        return {
+            "voices": len(self._latents),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "computed": self.computed,
+            "evicted_files": self.evicted_files,
+        }